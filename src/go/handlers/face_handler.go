@@ -1,8 +1,13 @@
 package handlers
 
 import (
+    "bytes"
+    "encoding/base64"
     "encoding/json"
+    "io"
+    "mime"
     "net/http"
+    "strings"
     "face-matching-app/src/go/services"
 )
 
@@ -10,14 +15,37 @@ type FaceHandler struct {
     FaceService *services.FaceService
 }
 
+// MatchFace accepts a JSON body with base64 imageData, or the raw image bytes
+// (application/octet-stream or image/*). Bodies with any other content type
+// are parsed as JSON unless they do not start with '{'.
 func (h *FaceHandler) MatchFace(w http.ResponseWriter, r *http.Request) {
-    var inputImage services.InputImage
-    if err := json.NewDecoder(r.Body).Decode(&inputImage); err != nil {
+    body, err := io.ReadAll(r.Body)
+    if err != nil {
         http.Error(w, err.Error(), http.StatusBadRequest)
         return
     }
+    imageData := body
+    mediaType, _, _ := mime.ParseMediaType(r.Header.Get("Content-Type"))
+    rawImage := mediaType == "application/octet-stream" || strings.HasPrefix(mediaType, "image/")
+    if !rawImage && bytes.HasPrefix(bytes.TrimSpace(body), []byte("{")) {
+        var inputImage services.InputImage
+        if err := json.Unmarshal(body, &inputImage); err != nil {
+            http.Error(w, err.Error(), http.StatusBadRequest)
+            return
+        }
+        decoded, err := base64.StdEncoding.DecodeString(inputImage.ImageData)
+        if err != nil {
+            http.Error(w, "imageData is not valid base64", http.StatusBadRequest)
+            return
+        }
+        imageData = decoded
+    }
+    if len(imageData) == 0 {
+        http.Error(w, "no image data", http.StatusBadRequest)
+        return
+    }
 
-    matchedImages, err := h.FaceService.MatchFace([]byte(inputImage.ImageData))
+    matchedImages, err := h.FaceService.MatchFace(imageData)
     if err != nil {
         http.Error(w, err.Error(), http.StatusInternalServerError)
         return
@@ -25,4 +53,4 @@ func (h *FaceHandler) MatchFace(w http.ResponseWriter, r *http.Request) {
 
     w.Header().Set("Content-Type", "application/json")
     json.NewEncoder(w).Encode(matchedImages)
-}
\ No newline at end of file
+}
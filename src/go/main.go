@@ -3,16 +3,42 @@ package main
 import (
     "log"
     "net/http"
+    "os"
+    "strconv"
+    "time"
     "github.com/gorilla/mux"
     "face-matching-app/src/go/handlers"
     "face-matching-app/src/go/services"
 )
 
+// envInt reads an integer environment variable, falling back to def.
+func envInt(name string, def int) int {
+    if value, err := strconv.Atoi(os.Getenv(name)); err == nil {
+        return value
+    }
+    return def
+}
+
 func main() {
-    // Initialize the face service
-    faceService := &services.FaceService{
-        PythonServiceURL: "http://localhost:5000", // Update this URL as needed
+    pythonServiceURL := os.Getenv("PYTHON_SERVICE_URL")
+    if pythonServiceURL == "" {
+        pythonServiceURL = "http://localhost:5000"
     }
+
+    // One keep-alive client shared by all requests to the Python service
+    cfg := services.DefaultClientConfig
+    cfg.MaxIdleConns = envInt("GATEWAY_MAX_IDLE_CONNS", cfg.MaxIdleConns)
+    cfg.MaxIdleConnsPerHost = envInt("GATEWAY_MAX_IDLE_CONNS_PER_HOST", cfg.MaxIdleConnsPerHost)
+    cfg.MaxConnsPerHost = envInt("GATEWAY_MAX_CONNS_PER_HOST", cfg.MaxConnsPerHost)
+    cfg.DialTimeout = time.Duration(envInt("GATEWAY_DIAL_TIMEOUT_MS", int(cfg.DialTimeout/time.Millisecond))) * time.Millisecond
+    cfg.RequestTimeout = time.Duration(envInt("GATEWAY_REQUEST_TIMEOUT_MS", int(cfg.RequestTimeout/time.Millisecond))) * time.Millisecond
+
+    // Initialize the face service
+    faceService := services.NewFaceService(pythonServiceURL, cfg)
+    // GATEWAY_COMPACT=1 decodes and downsizes images here and sends raw grayscale pixels
+    faceService.CompactMode = os.Getenv("GATEWAY_COMPACT") == "1"
+    faceService.CompactWidth = envInt("GATEWAY_COMPACT_WIDTH", faceService.CompactWidth)
+    faceService.CompactHeight = envInt("GATEWAY_COMPACT_HEIGHT", faceService.CompactHeight)
     
     // Initialize the handler
     faceHandler := &handlers.FaceHandler{
@@ -29,4 +55,4 @@ func main() {
     if err := http.ListenAndServe(":8080", r); err != nil {
         log.Fatalf("Could not start server: %s\n", err)
     }
-}
\ No newline at end of file
+}
@@ -5,40 +5,119 @@ import (
 	"encoding/json"
 	"fmt"
 	"image"
+	"image/color"
 	"image/jpeg"
+	_ "image/png"
+	"io"
+	"net"
 	"net/http"
+	"net/url"
 	"os/exec"
+	"time"
 )
 
+// ClientConfig tunes the pooled HTTP client used to call the Python service.
+type ClientConfig struct {
+	MaxIdleConns        int
+	MaxIdleConnsPerHost int
+	MaxConnsPerHost     int // 0 means unlimited
+	IdleConnTimeout     time.Duration
+	DialTimeout         time.Duration
+	RequestTimeout      time.Duration
+}
+
+// DefaultClientConfig keeps enough idle keep-alive connections for a busy gateway.
+var DefaultClientConfig = ClientConfig{
+	MaxIdleConns:        256,
+	MaxIdleConnsPerHost: 64,
+	MaxConnsPerHost:     0,
+	IdleConnTimeout:     90 * time.Second,
+	DialTimeout:         5 * time.Second,
+	RequestTimeout:      30 * time.Second,
+}
+
+// NewHTTPClient builds a keep-alive client meant to be shared by all requests.
+func NewHTTPClient(cfg ClientConfig) *http.Client {
+	transport := &http.Transport{
+		Proxy:               http.ProxyFromEnvironment,
+		DialContext:         (&net.Dialer{Timeout: cfg.DialTimeout, KeepAlive: 30 * time.Second}).DialContext,
+		MaxIdleConns:        cfg.MaxIdleConns,
+		MaxIdleConnsPerHost: cfg.MaxIdleConnsPerHost,
+		MaxConnsPerHost:     cfg.MaxConnsPerHost,
+		IdleConnTimeout:     cfg.IdleConnTimeout,
+	}
+	return &http.Client{Transport: transport, Timeout: cfg.RequestTimeout}
+}
+
 type FaceService struct {
 	PythonServiceURL string
+	Client           *http.Client
+	// CompactMode sends a CompactWidth x CompactHeight 8-bit grayscale buffer
+	// instead of the encoded image, so the Python service skips decoding.
+	CompactMode   bool
+	CompactWidth  int
+	CompactHeight int
 }
 
-type MatchRequest struct {
-	ImageData []byte `json:"image_data"`
+// NewFaceService returns a FaceService with a pooled client built from cfg.
+func NewFaceService(pythonServiceURL string, cfg ClientConfig) *FaceService {
+	return &FaceService{
+		PythonServiceURL: pythonServiceURL,
+		Client:           NewHTTPClient(cfg),
+		CompactWidth:     128,
+		CompactHeight:    128,
+	}
+}
+
+// Match is one ranked gallery match returned by the Python service.
+type Match struct {
+	Person    string  `json:"person"`
+	Score     float64 `json:"score"`
+	Rank      int     `json:"rank"`
+	Index     int     `json:"index"`
+	ImagePath string  `json:"image_path,omitempty"`
+	ImageURL  string  `json:"image_url,omitempty"`
+	// ThumbnailURL serves a small cached JPEG of the image, with ETag support
+	ThumbnailURL string `json:"thumbnail_url,omitempty"`
 }
 
 type MatchResponse struct {
-	Matches []string `json:"matches"`
+	Matches []Match `json:"matches"`
 }
 
 type InputImage struct {
-    ImageData string `json:"imageData"` // Base64 encoded image data
+	ImageData string `json:"imageData"` // Base64 encoded image data
 }
 
-func (fs *FaceService) MatchFace(imageData []byte) ([]string, error) {
-	requestBody, err := json.Marshal(MatchRequest{ImageData: imageData})
-	if err != nil {
-		return nil, fmt.Errorf("failed to marshal request: %v", err)
+// MatchFace sends an encoded image to the Python /match endpoint as a raw
+// octet-stream body, or as a grayscale buffer in compact mode.
+func (fs *FaceService) MatchFace(imageData []byte) ([]Match, error) {
+	body := imageData
+	query := url.Values{}
+	if fs.CompactMode {
+		gray, err := GrayPixels(imageData, fs.CompactWidth, fs.CompactHeight)
+		if err != nil {
+			return nil, fmt.Errorf("failed to decode image: %v", err)
+		}
+		body = gray
+		query.Set("encoding", "gray8")
+		query.Set("width", fmt.Sprint(fs.CompactWidth))
+		query.Set("height", fmt.Sprint(fs.CompactHeight))
 	}
 
-	resp, err := http.Post(fs.PythonServiceURL+"/match", "application/json", bytes.NewBuffer(requestBody))
+	endpoint := fs.PythonServiceURL + "/match"
+	if len(query) > 0 {
+		endpoint += "?" + query.Encode()
+	}
+	resp, err := fs.client().Post(endpoint, "application/octet-stream", bytes.NewReader(body))
 	if err != nil {
 		return nil, fmt.Errorf("failed to call Python service: %v", err)
 	}
 	defer resp.Body.Close()
 
 	if resp.StatusCode != http.StatusOK {
+		// Drain the body so the connection goes back to the pool
+		io.Copy(io.Discard, resp.Body)
 		return nil, fmt.Errorf("received non-200 response: %s", resp.Status)
 	}
 
@@ -50,6 +129,73 @@ func (fs *FaceService) MatchFace(imageData []byte) ([]string, error) {
 	return matchResponse.Matches, nil
 }
 
+func (fs *FaceService) client() *http.Client {
+	if fs.Client == nil {
+		return http.DefaultClient
+	}
+	return fs.Client
+}
+
+// GrayPixels decodes an image and returns width x height 8-bit grayscale
+// pixels, row-major. Each output pixel averages the source pixels it covers,
+// using the same luma weights as the Python preprocessing.
+func GrayPixels(imageData []byte, width, height int) ([]byte, error) {
+	img, _, err := image.Decode(bytes.NewReader(imageData))
+	if err != nil {
+		return nil, err
+	}
+	bounds := img.Bounds()
+	srcWidth, srcHeight := bounds.Dx(), bounds.Dy()
+	if srcWidth == 0 || srcHeight == 0 {
+		return nil, fmt.Errorf("empty image")
+	}
+
+	// Convert once to grayscale so the box filter reads plain bytes. The luma
+	// plane of a JPEG already is the grayscale image.
+	var gray *image.Gray
+	switch src := img.(type) {
+	case *image.Gray:
+		gray = src
+	case *image.YCbCr:
+		gray = &image.Gray{Pix: src.Y, Stride: src.YStride, Rect: src.Rect}
+	default:
+		gray = image.NewGray(bounds)
+		for y := bounds.Min.Y; y < bounds.Max.Y; y++ {
+			for x := bounds.Min.X; x < bounds.Max.X; x++ {
+				gray.SetGray(x, y, color.GrayModel.Convert(img.At(x, y)).(color.Gray))
+			}
+		}
+	}
+
+	out := make([]byte, width*height)
+	for oy := 0; oy < height; oy++ {
+		y0, y1 := span(oy, height, srcHeight)
+		for ox := 0; ox < width; ox++ {
+			x0, x1 := span(ox, width, srcWidth)
+			sum := 0
+			for y := y0; y < y1; y++ {
+				row := gray.Pix[y*gray.Stride:]
+				for x := x0; x < x1; x++ {
+					sum += int(row[x])
+				}
+			}
+			count := (y1 - y0) * (x1 - x0)
+			out[oy*width+ox] = byte((sum + count/2) / count)
+		}
+	}
+	return out, nil
+}
+
+// span returns the source range [start, end) covered by output pixel i.
+func span(i, outSize, srcSize int) (int, int) {
+	start := i * srcSize / outSize
+	end := (i + 1) * srcSize / outSize
+	if end <= start {
+		end = start + 1
+	}
+	return start, end
+}
+
 func (fs *FaceService) SaveImage(imageData []byte, filename string) error {
 	img, _, err := image.Decode(bytes.NewReader(imageData))
 	if err != nil {
@@ -67,4 +213,4 @@ func (fs *FaceService) SaveImage(imageData []byte, filename string) error {
 	}
 
 	return nil
-}
\ No newline at end of file
+}
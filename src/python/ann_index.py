@@ -0,0 +1,286 @@
+"""
+Approximate nearest-neighbor index (IVF with optional product quantization)
+and a recall@k report against exact search
+"""
+
+import os
+import json
+import time
+import shutil
+import argparse
+import numpy as np
+from sklearn.cluster import MiniBatchKMeans
+
+INDEX_DIR = 'ann_index'
+INDEX_VERSION = 1
+# Rows used to train the k-means quantizers; the rest are only assigned
+MAX_TRAINING_ROWS = 100000
+
+
+class IVFIndex:
+    """Inverted-file index: k-means coarse lists, optionally PQ-compressed residuals.
+
+    search() returns a candidate shortlist of gallery indices; callers re-rank
+    the shortlist exactly against the full-precision features.
+    """
+
+    def __init__(self, n_lists=256, pq_subspaces=0, metric='cosine', default_nprobe=None, random_state=0):
+        self.n_lists = n_lists
+        self.pq_subspaces = pq_subspaces
+        self.metric = metric
+        self.default_nprobe = default_nprobe or max(1, n_lists // 16)
+        self.random_state = random_state
+        self.centroids = None
+        self.list_ids = None  # Gallery indices grouped by list
+        self.list_offsets = None  # list_ids[list_offsets[l]:list_offsets[l + 1]] belong to list l
+        self.pq_codebooks = None  # (pq_subspaces, 256, sub_dim) residual codebooks
+        self.pq_codes = None  # (n_items, pq_subspaces) uint8 codes in list_ids order
+        self.pq_sq_norms = None  # Squared norms of the reconstructed vectors
+
+    def build(self, features):
+        """Cluster the gallery into inverted lists and quantize the residuals"""
+        vectors = self._prepare(features)
+        n_items, dim = vectors.shape
+        self.n_lists = min(self.n_lists, n_items)
+        self.default_nprobe = min(self.default_nprobe, self.n_lists)
+
+        print(f"Building IVF index with {self.n_lists} lists over {n_items} vectors...")
+        coarse = self._kmeans(self.n_lists, vectors)
+        assignments = coarse.predict(vectors)
+        self.centroids = coarse.cluster_centers_.astype(np.float32)
+        self.list_ids = np.argsort(assignments, kind='stable').astype(np.int64)
+        self.list_offsets = np.zeros(self.n_lists + 1, dtype=np.int64)
+        np.cumsum(np.bincount(assignments, minlength=self.n_lists), out=self.list_offsets[1:])
+
+        if self.pq_subspaces:
+            if dim % self.pq_subspaces:
+                raise ValueError(f"pq_subspaces must divide the feature dimension {dim}")
+            print(f"Training product quantizer with {self.pq_subspaces} subspaces...")
+            residuals = vectors[self.list_ids] - self.centroids[assignments[self.list_ids]]
+            sub_dim = dim // self.pq_subspaces
+            self.pq_codebooks = np.empty((self.pq_subspaces, min(256, n_items), sub_dim), dtype=np.float32)
+            self.pq_codes = np.empty((n_items, self.pq_subspaces), dtype=np.uint8)
+            for j in range(self.pq_subspaces):
+                block = np.ascontiguousarray(residuals[:, j * sub_dim:(j + 1) * sub_dim])
+                quantizer = self._kmeans(self.pq_codebooks.shape[1], block)
+                self.pq_codebooks[j] = quantizer.cluster_centers_
+                self.pq_codes[:, j] = quantizer.predict(block)
+            reconstructed = self.centroids[assignments[self.list_ids]] + self._decode(self.pq_codes)
+            self.pq_sq_norms = np.einsum('ij,ij->i', reconstructed, reconstructed)
+
+        return self
+
+    def search(self, query, nprobe=None, shortlist=None):
+        """Return gallery indices of candidates for one query vector"""
+        query = self._prepare(np.asarray(query).reshape(1, -1))[0]
+        nprobe = min(nprobe or self.default_nprobe, self.n_lists)
+
+        # Probe the lists whose centroids are closest to the query
+        if self.metric == 'cosine':
+            coarse_scores = -(self.centroids @ query)
+        else:
+            diff = self.centroids - query
+            coarse_scores = np.einsum('ij,ij->i', diff, diff)
+        probed = np.argpartition(coarse_scores, nprobe - 1)[:nprobe]
+
+        spans = [np.arange(self.list_offsets[l], self.list_offsets[l + 1]) for l in probed]
+        positions = np.concatenate(spans) if spans else np.empty(0, dtype=np.int64)
+        if self.pq_codes is None or shortlist is None or len(positions) <= shortlist:
+            return self.list_ids[positions]
+
+        # Asymmetric distance: q.x ~= q.centroid + sum of per-subspace lookup tables
+        sub_dim = self.pq_codebooks.shape[2]
+        tables = np.einsum('jkd,jd->jk', self.pq_codebooks, query.reshape(self.pq_subspaces, sub_dim))
+        list_of_position = np.repeat(probed, [len(span) for span in spans])
+        approx_dots = (self.centroids[list_of_position] @ query
+                       + tables[np.arange(self.pq_subspaces), self.pq_codes[positions]].sum(axis=1))
+        if self.metric == 'cosine':
+            approx_scores = -approx_dots
+        else:
+            approx_scores = self.pq_sq_norms[positions] - 2 * approx_dots
+        best = np.argpartition(approx_scores, shortlist - 1)[:shortlist]
+        return self.list_ids[positions[best]]
+
+    def save(self, model_dir, model_version=None):
+        """Save the index into model_dir/ann_index/, tagged with the model version it was built for"""
+        index_dir = os.path.join(model_dir, INDEX_DIR)
+        os.makedirs(index_dir, exist_ok=True)
+        arrays = {'centroids': self.centroids, 'list_ids': self.list_ids, 'list_offsets': self.list_offsets}
+        if self.pq_codes is not None:
+            arrays.update({'pq_codebooks': self.pq_codebooks, 'pq_codes': self.pq_codes,
+                           'pq_sq_norms': self.pq_sq_norms})
+        for name, array in arrays.items():
+            # Write then rename so a loaded (memory-mapped) index is never overwritten in place
+            path = os.path.join(index_dir, f'{name}.npy')
+            with open(path + '.tmp', 'wb') as f:
+                np.save(f, array)
+            os.replace(path + '.tmp', path)
+
+        header = {
+            'version': INDEX_VERSION,
+            'metric': self.metric,
+            'n_lists': self.n_lists,
+            'pq_subspaces': self.pq_subspaces,
+            'default_nprobe': self.default_nprobe,
+            'n_items': len(self.list_ids),
+            'model_version': model_version,
+        }
+        with open(os.path.join(index_dir, 'index.json'), 'w') as f:
+            json.dump(header, f, indent=2)
+
+    @classmethod
+    def load(cls, model_dir, n_items=None, model_version=None):
+        """Load the index saved beside a model, or return None if there is none.
+
+        An index built for another model version or gallery size (e.g. left
+        over from an earlier training run or compaction) is ignored. Indexes
+        saved without a version are only checked by size.
+        """
+        index_dir = os.path.join(model_dir, INDEX_DIR)
+        if not os.path.exists(os.path.join(index_dir, 'index.json')):
+            return None
+        with open(os.path.join(index_dir, 'index.json')) as f:
+            header = json.load(f)
+        if header['version'] > INDEX_VERSION:
+            raise ValueError(f"ANN index version {header['version']} is not supported")
+        if n_items is not None and header['n_items'] != n_items:
+            print(f"Ignoring stale ANN index in {index_dir}/: built for {header['n_items']} images, "
+                  f"gallery has {n_items}")
+            return None
+        built_for = header.get('model_version')
+        if model_version is not None and built_for is not None and built_for != model_version:
+            print(f"Ignoring stale ANN index in {index_dir}/: built for model version {built_for}, "
+                  f"not {model_version}")
+            return None
+
+        index = cls(n_lists=header['n_lists'], pq_subspaces=header['pq_subspaces'],
+                    metric=header['metric'], default_nprobe=header['default_nprobe'])
+        for name in ('centroids', 'list_ids', 'list_offsets', 'pq_codebooks', 'pq_codes', 'pq_sq_norms'):
+            path = os.path.join(index_dir, f'{name}.npy')
+            if os.path.exists(path):
+                setattr(index, name, np.load(path, mmap_mode='r'))
+        return index
+
+    @staticmethod
+    def remove(model_dir):
+        """Delete the index saved beside a model, if any"""
+        shutil.rmtree(os.path.join(model_dir, INDEX_DIR), ignore_errors=True)
+
+    def _prepare(self, vectors):
+        """Cast to float32 and L2-normalize for the cosine metric"""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if self.metric == 'cosine':
+            norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+            vectors = vectors / np.where(norms == 0, 1, norms)
+        return vectors
+
+    def _kmeans(self, n_clusters, vectors):
+        """Fit k-means on at most MAX_TRAINING_ROWS sampled rows"""
+        rng = np.random.default_rng(self.random_state)
+        sample = vectors
+        if len(vectors) > MAX_TRAINING_ROWS:
+            sample = vectors[np.sort(rng.choice(len(vectors), MAX_TRAINING_ROWS, replace=False))]
+        return MiniBatchKMeans(n_clusters=n_clusters, batch_size=4096, n_init=3,
+                               random_state=self.random_state).fit(sample)
+
+    def _decode(self, codes):
+        """Reconstruct residuals from PQ codes"""
+        parts = [self.pq_codebooks[j][codes[:, j]] for j in range(self.pq_subspaces)]
+        return np.hstack(parts)
+
+
+def jittered_queries(features, label_codes, rows, scale=1.0, random_state=0):
+    """Copies of the gallery vectors at rows, moved by the gallery's within-person spread.
+
+    Indexed vectors make poor queries: each is its own nearest neighbor and sits
+    in the list its centroid was fitted on, which overstates recall. A jittered
+    copy behaves like a new photo of a known person.
+    """
+    features = np.asarray(features, dtype=np.float32)
+    _, person, counts = np.unique(np.asarray(label_codes), return_inverse=True, return_counts=True)
+    sums = np.zeros((len(counts), features.shape[1]))
+    np.add.at(sums, person, features)
+    residuals = features - (sums / counts[:, None])[person]
+    shared = counts[person] > 1  # Persons with one image have no spread to measure
+    spread = np.sqrt(np.mean(residuals[shared] ** 2, axis=0)) if shared.any() else features.std(axis=0)
+
+    rng = np.random.default_rng(random_state)
+    noise = rng.standard_normal((len(rows), features.shape[1])) * (scale * spread)
+    return features[rows] + noise.astype(np.float32)
+
+
+def recall_report(face_matcher, query_features, top_k=10, nprobe_values=(1, 2, 4, 8, 16), match_type='all',
+                  search_mode='ann'):
+    """Measure recall@k and latency of ANN or prefiltered search against exact search.
+
+    query_features should not be gallery vectors themselves (see jittered_queries).
+    For search_mode='prefilter', nprobe is the number of candidate persons and
+    'scanned' the mean number of vectors scored per query (centroids plus images).
+    """
+    start_time = time.perf_counter()
+    exact = face_matcher.match_features(query_features, top_k=top_k, match_type=match_type)
+    exact_ms = (time.perf_counter() - start_time) * 1000 / len(query_features)
+    rows = [{'search_mode': 'exact', 'nprobe': None, 'recall': 1.0, 'latency_ms': exact_ms,
+             'scanned': float(len(face_matcher.pca_processor.get_gallery()))}]
+
+    for nprobe in nprobe_values:
+        start_time = time.perf_counter()
+        approx = face_matcher.match_features(query_features, top_k=top_k, match_type=match_type,
+                                             search_mode=search_mode, nprobe=nprobe)
+        latency_ms = (time.perf_counter() - start_time) * 1000 / len(query_features)
+        hits = sum(len({m['index'] for m in a} & {m['index'] for m in e}) for a, e in zip(approx, exact))
+        total = sum(len(e) for e in exact)
+        scanned = None
+        if search_mode == 'prefilter':
+            persons = face_matcher.person_index()
+            n_persons = max(nprobe, top_k)
+            scanned = len(persons) + float(np.mean([len(persons.candidate_rows(query, n_persons))
+                                                    for query in query_features]))
+        rows.append({'search_mode': search_mode, 'nprobe': nprobe, 'recall': hits / max(total, 1),
+                     'latency_ms': latency_ms, 'scanned': scanned})
+    return rows
+
+
+def main():
+    from pca_processor import PCAProcessor
+    from face_matcher import FaceMatcher
+
+    parser = argparse.ArgumentParser(description="Report ANN or prefiltered recall@k against exact search")
+    parser.add_argument("model_dir", help="Saved model directory (with an ann_index/ for --search_mode ann)")
+    parser.add_argument("--search_mode", default='ann', choices=['ann', 'prefilter'])
+    parser.add_argument("--top_k", type=int, default=10)
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 2, 4, 8, 16],
+                        help="Inverted lists probed, or candidate persons for --search_mode prefilter")
+    parser.add_argument("--queries", type=int, default=1000,
+                        help="Gallery vectors sampled and jittered into queries")
+    parser.add_argument("--query_noise", type=float, default=1.0,
+                        help="Query jitter as a multiple of the within-person spread of the gallery")
+    parser.add_argument("--match_type", default='all', choices=['all', 'person', 'diverse'])
+    args = parser.parse_args()
+
+    pca_processor = PCAProcessor()
+    pca_processor.load_model(args.model_dir)
+    if args.search_mode == 'ann':
+        if pca_processor.ann_index is None:
+            print(f"No ANN index found in {args.model_dir}/. Train with --ann_lists first.")
+            return
+        face_matcher = FaceMatcher(pca_processor, similarity_metric=pca_processor.ann_index.metric)
+    else:
+        face_matcher = FaceMatcher(pca_processor)
+
+    features = pca_processor.dataset_pca_features
+    rng = np.random.default_rng(0)
+    sample = np.sort(rng.choice(len(features), min(args.queries, len(features)), replace=False))
+    queries = jittered_queries(features, pca_processor.label_codes, sample, scale=args.query_noise)
+    rows = recall_report(face_matcher, queries, top_k=args.top_k,
+                         nprobe_values=args.nprobe, match_type=args.match_type, search_mode=args.search_mode)
+
+    print(f"{'mode':<10}{'nprobe':>8}{'recall@' + str(args.top_k):>12}{'ms/query':>12}{'scanned':>12}")
+    for row in rows:
+        nprobe = '-' if row['nprobe'] is None else row['nprobe']
+        scanned = '-' if row['scanned'] is None else f"{row['scanned']:.0f}"
+        print(f"{row['search_mode']:<10}{nprobe:>8}{row['recall']:>12.4f}{row['latency_ms']:>12.3f}{scanned:>12}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,41 +1,87 @@
-from flask import Flask, request, jsonify, render_template, send_file
+from flask import Flask, request, jsonify, render_template, send_file, g, Response
 import base64
 import numpy as np
 from PIL import Image
 import io
 import os
 import mimetypes
-from face_matcher import FaceMatcher
-from pca_processor import PCAProcessor
+import time
+import hashlib
+import threading
+import feature_store
+import thumbnails
+from query_cache import LRUCache
+from metrics import metrics, SlowRequestProfiler
+from model_registry import ModelRegistry
 
 app = Flask(__name__)
 
-# Global variables for model components
-pca_processor = None
-face_matcher = None
+# Every model under models/ is served by the registry; requests pick one with ?model=
+model_registry = None
+
+# Content-addressed caches: full responses, and projected PCA vectors so a
+# different match_type for the same image skips decode and projection
+result_cache = LRUCache(max_entries=int(os.environ.get('RESULT_CACHE_SIZE', 1024)),
+                        ttl_seconds=float(os.environ.get('RESULT_CACHE_TTL', 300)))
+projection_cache = LRUCache(max_entries=int(os.environ.get('PROJECTION_CACHE_SIZE', 4096)),
+                            ttl_seconds=float(os.environ.get('PROJECTION_CACHE_TTL', 300)))
+
+# /image/<index>?size=N serves the smallest of THUMBNAIL_SIZES covering N from the
+# model's packed thumbnail store; responses may be cached for IMAGE_MAX_AGE seconds
+THUMBNAIL_SIZES = thumbnails.parse_sizes(os.environ.get('THUMBNAIL_SIZES', '128,256'))
+IMAGE_MAX_AGE = int(os.environ.get('IMAGE_MAX_AGE', 300))
+# Thumbnail size the match results link to (the web UI shows 100px images)
+RESULT_THUMBNAIL_SIZE = 128
+thumbnail_sets = {}  # model directory -> ThumbnailSet
+thumbnail_sets_lock = threading.Lock()
+
+# PROFILE_SLOWEST=N keeps cProfile stats of the N slowest sampled requests in PROFILE_DIR
+profiler = SlowRequestProfiler(n_slowest=int(os.environ.get('PROFILE_SLOWEST', 0)),
+                               sample_rate=float(os.environ.get('PROFILE_SAMPLE_RATE', 1.0)),
+                               output_dir=os.environ.get('PROFILE_DIR', os.path.join(os.path.dirname(__file__), 'profiles')))
+
+metrics.describe('requests_total', 'HTTP requests by endpoint, method and status')
+metrics.describe('request_seconds', 'HTTP request latency by endpoint')
+metrics.describe('stage_seconds', 'Time spent in each matching stage')
+metrics.describe('model_load_seconds', 'Time taken to load each model')
+metrics.describe('gallery_images', 'Searchable gallery images per model')
+for cache_name, cache in (('results', result_cache), ('projections', projection_cache)):
+    metrics.set_gauge('cache_hits', lambda cache=cache: cache.hits, cache=cache_name)
+    metrics.set_gauge('cache_misses', lambda cache=cache: cache.misses, cache=cache_name)
+metrics.describe('image_responses_total', 'Gallery image responses by kind (thumbnail, original, not_modified)')
+metrics.describe('batch_queue_depth', 'Match requests waiting for the micro-batcher')
 
 def initialize_model():
-    """Initialize the PCA processor and face matcher with saved model"""
-    global pca_processor, face_matcher
+    """Create the model registry and load the default model"""
+    global model_registry
     
     try:
-        # Initialize PCA processor
-        pca_processor = PCAProcessor(n_components=50, image_size=(128, 128))
-        
-        # Try to load saved model
-        model_dir = os.path.join(os.path.dirname(__file__), "models", "simpsons_faces_pca")
+        models_root = os.environ.get('MODELS_DIR', os.path.join(os.path.dirname(__file__), "models"))
+        # FEATURE_DTYPE=float16/int8 trades precision for bandwidth; concurrent /match
+        # requests arriving within BATCH_WINDOW_MS share one projection and scoring pass
+        model_registry = ModelRegistry(
+            models_root,
+            default_model=os.environ.get('ACTIVE_MODEL_NAME', 'simpsons_faces_pca'),
+            memory_budget_mb=float(os.environ.get('MODEL_MEMORY_BUDGET_MB', 4096)),
+            similarity_metric='cosine',
+            feature_dtype=os.environ.get('FEATURE_DTYPE', 'float32'),
+            batch_window_ms=float(os.environ.get('BATCH_WINDOW_MS', 2)),
+            batch_max_size=int(os.environ.get('BATCH_MAX_SIZE', 32)))
         
-        if os.path.exists(os.path.join(model_dir, 'pca_model.pkl')):
-            print("Loading saved PCA model...")
-            pca_processor.load_model(model_dir)
-            print("Model loaded successfully!")
-        else:
+        available = model_registry.discover()
+        if not available:
             print("No saved model found. Please train the model first using train_PCA.py")
             return False
+        if model_registry.default_model not in available:
+            model_registry.default_model = available[0]
         
-        # Initialize face matcher
-        face_matcher = FaceMatcher(pca_processor, similarity_metric='cosine')
+        print(f"Models available: {', '.join(available)}")
+        model_registry.get()
         
+        # MODEL_WATCH_INTERVAL=N reloads a model N to 2N seconds after its files change
+        watch_interval = float(os.environ.get('MODEL_WATCH_INTERVAL', 0))
+        if watch_interval > 0:
+            model_registry.watch(watch_interval)
         return True
         
     except Exception as e:
@@ -44,6 +90,41 @@ def initialize_model():
         traceback.print_exc()
         return False
 
+def get_model():
+    """Return the ServedModel selected by ?model= (the default model if absent).
+    
+    Raises KeyError for unknown models and LookupError if no model is loaded.
+    """
+    if model_registry is None:
+        raise LookupError('Model not initialized')
+    return model_registry.get(request.args.get('model'))
+
+def model_error(error):
+    """Response for a failed get_model()"""
+    if isinstance(error, KeyError):
+        return jsonify({'error': error.args[0]}), 404
+    return jsonify({'error': str(error)}), 500
+
+@app.before_request
+def start_request_timer():
+    g.start_time = time.perf_counter()
+    g.profile = profiler.start()
+
+@app.after_request
+def record_request_metrics(response):
+    seconds = time.perf_counter() - g.start_time
+    endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+    metrics.inc('requests_total', endpoint=endpoint, method=request.method, status=response.status_code)
+    metrics.observe('request_seconds', seconds, endpoint=endpoint)
+    if g.profile is not None:
+        profiler.finish(g.profile, seconds, f"{request.method} {endpoint}")
+    return response
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """Prometheus text exposition of request, stage, gallery and cache metrics"""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/')
 def index():
     """Serve the web interface"""
@@ -52,58 +133,232 @@ def index():
 @app.route('/health', methods=['GET'])
 def health_check():
     """Health check endpoint"""
-    if pca_processor is None or face_matcher is None:
-        return jsonify({'status': 'error', 'message': 'Model not initialized'}), 500
+    try:
+        model = get_model()
+    except LookupError as e:
+        return jsonify({'status': 'error', 'message': e.args[0]}), 404 if isinstance(e, KeyError) else 500
     
-    info = pca_processor.get_dataset_info()
+    info = model.processor.get_dataset_info()
     return jsonify({
         'status': 'healthy',
-        'model_info': info
+        'model': model.name,
+        'model_info': info,
+        'cache': {
+            'results': result_cache.stats(),
+            'projections': projection_cache.stats()
+        }
     })
 
+def gallery_image(model, image_index):
+    """Return (path, mime type) of a gallery image, or raise LookupError with a message"""
+    # Get image paths (dataset and enrolled images)
+    image_paths = model.processor.get_gallery().image_paths
+    
+    if image_index < 0 or image_index >= len(image_paths):
+        raise LookupError("Image not found")
+    
+    image_path = image_paths[image_index]
+    
+    if not os.path.exists(image_path):
+        raise LookupError("Image file not found")
+    
+    # Determine mime type
+    mime_type, _ = mimetypes.guess_type(image_path)
+    if mime_type is None:
+        mime_type = 'image/jpeg'
+    return image_path, mime_type
+
+def image_size_param(args):
+    """Requested thumbnail size from ?size=, None for the original; raises ValueError"""
+    if 'size' not in args:
+        return None
+    size = int(args['size'])
+    if size <= 0:
+        raise ValueError("size must be positive")
+    return size
+
+def gallery_thumbnail(model, image_path, requested_size):
+    """Return (JPEG bytes, ETag) of a thumbnail covering requested_size, or None to serve the original"""
+    model_dir = model.processor.model_dir
+    if model_dir is None or not THUMBNAIL_SIZES:
+        return None
+    with thumbnail_sets_lock:
+        thumbnail_set = thumbnail_sets.get(model_dir)
+        if thumbnail_set is None:
+            thumbnail_set = thumbnail_sets[model_dir] = thumbnails.ThumbnailSet(model_dir, THUMBNAIL_SIZES)
+    size = thumbnail_set.pick_size(requested_size)
+    if size is None:
+        return None
+    return thumbnail_set.get(image_path, size)
+
 @app.route('/image/<int:image_index>')
 def serve_image(image_index):
-    """Serve dataset images by index"""
+    """Serve dataset images by index, or a cached thumbnail with ?size=N"""
     try:
-        if pca_processor is None:
+        try:
+            model = get_model()
+        except KeyError:
+            return "Model not found", 404
+        except LookupError:
             return "Model not initialized", 500
         
-        # Get image paths
-        _, _, image_paths = pca_processor.get_dataset_features()
-        
-        if image_index < 0 or image_index >= len(image_paths):
-            return "Image not found", 404
-        
-        image_path = image_paths[image_index]
+        try:
+            requested_size = image_size_param(request.args)
+        except ValueError:
+            return "Invalid size", 400
         
-        if not os.path.exists(image_path):
-            return "Image file not found", 404
+        try:
+            image_path, mime_type = gallery_image(model, image_index)
+        except LookupError as e:
+            return e.args[0], 404
         
-        # Determine mime type
-        mime_type, _ = mimetypes.guess_type(image_path)
-        if mime_type is None:
-            mime_type = 'image/jpeg'
-        
-        return send_file(image_path, mimetype=mime_type)
+        thumbnail = gallery_thumbnail(model, image_path, requested_size) if requested_size else None
+        if thumbnail is None:
+            # send_file adds an ETag and Last-Modified and answers conditional requests
+            response = send_file(image_path, mimetype=mime_type, max_age=IMAGE_MAX_AGE)
+            kind = 'original'
+        else:
+            data, etag = thumbnail
+            response = Response(data, mimetype='image/jpeg')
+            response.set_etag(etag)
+            response.cache_control.public = True
+            response.cache_control.max_age = IMAGE_MAX_AGE
+            kind = 'thumbnail'
+        response = response.make_conditional(request)
+        metrics.inc('image_responses_total', kind='not_modified' if response.status_code == 304 else kind)
+        return response
         
     except Exception as e:
         print(f"Error serving image: {e}")
         return "Error serving image", 500
 
+def get_match_params(args=None):
+    """Read the matching options shared by the match endpoints (from request.args by default)"""
+    args = request.args if args is None else args
+    return {
+        'top_k': args.get('top_k', 5, type=int),
+        'match_type': args.get('match_type', 'person'),  # 'all', 'person', or 'diverse'
+        'max_per_person': args.get('max_per_person', 2, type=int),
+        'search_mode': args.get('search_mode', 'exact'),  # 'exact', 'ann' or 'prefilter'
+        'nprobe': args.get('nprobe', None, type=int),
+    }
+
+def check_match_params(model, params):
+    """Return an error message if the match options cannot be served, else None"""
+    if params['search_mode'] not in ('exact', 'ann', 'prefilter'):
+        return f"Unknown search_mode: {params['search_mode']}"
+    if params['search_mode'] == 'ann' and model.processor.get_gallery().ann_index is None:
+        return 'No ANN index available for this model'
+    return None
+
+def run_match(model, image_bytes, params, gray_size=None, projector=None):
+    """Find matches for one encoded image, reusing cached results and projections.
+    
+    With gray_size=(width, height), image_bytes are raw 8-bit grayscale pixels
+    instead of an encoded image, and decoding is skipped. projector(image_bytes,
+    gray_size), if given, replaces in-process decoding and projection (the
+    async server runs them in a process pool); when it returns None, the
+    image is projected in-process as usual.
+    """
+    processor = model.processor
+    image_hash = hashlib.sha256(image_bytes)
+    if gray_size is not None:
+        image_hash.update(b'gray8:%dx%d' % gray_size)
+    image_hash = image_hash.hexdigest()
+    # Copies of a model directory share a version; their projections are the same
+    model_version = processor.model_version
+    # Results hold image URLs of the model they came from, so the name is part of their key.
+    # Enrollments and removals publish a new gallery version, so cached results go stale
+    result_key = (image_hash, model.name, model_version, processor.get_gallery().version) \
+        + tuple(sorted(params.items()))
+    
+    response = result_cache.get(result_key)
+    if response is not None:
+        return response
+    
+    projection_key = (image_hash, model_version)
+    input_pca = projection_cache.get(projection_key)
+    pixels = None
+    if input_pca is None and projector is not None:
+        # None means the projector cannot serve this model version; project in-process instead
+        input_pca = projector(image_bytes, gray_size)
+        if input_pca is not None:
+            projection_cache.put(projection_key, input_pca)
+    if input_pca is None and gray_size is not None:
+        with metrics.stage('preprocess'):
+            pixels = processor.preprocess_gray_bytes(image_bytes, gray_size)
+        if model.batcher is None:
+            input_pca = processor.project(pixels.reshape(1, -1))
+            projection_cache.put(projection_key, input_pca)
+    elif input_pca is None:
+        # Only parses the header; preprocessing decodes, at reduced scale for JPEGs
+        with metrics.stage('image_open'):
+            image = Image.open(io.BytesIO(image_bytes))
+        if model.batcher is None:
+            input_pca = processor.transform(image)
+            projection_cache.put(projection_key, input_pca)
+        else:
+            with metrics.stage('preprocess'):
+                pixels = processor.preprocess_image(image).ravel()
+    
+    if model.batcher is None:
+        matches = model.matcher.match_features(input_pca, **params)[0]
+    else:
+        # Projection and scoring happen in the batcher, together with concurrent requests
+        input_pca, matches = model.batcher.match(params, pixels=pixels, features=input_pca)
+        if pixels is not None:
+            projection_cache.put(projection_key, input_pca)
+    response = format_matches(matches, params['match_type'], model_query(model))
+    result_cache.put(result_key, response)
+    return response
+
+def model_query(model):
+    """Query string selecting model in image URLs, empty for the default model"""
+    return '' if model.name == model_registry.default_model else f"?model={model.name}"
+
+def format_matches(matches, match_type, query=''):
+    """Add image URLs to matches and wrap them in the response body"""
+    thumbnail_query = f"?size={RESULT_THUMBNAIL_SIZE}" + query.replace('?', '&')
+    for match in matches:
+        if 'index' in match:
+            match['image_url'] = f"/image/{match['index']}{query}"
+            match['thumbnail_url'] = f"/image/{match['index']}{thumbnail_query}"
+    
+    return {
+        'matches': matches,
+        'total_matches': len(matches),
+        'match_type': match_type,
+        'unique_persons': len(set(match['person'] for match in matches))
+    }
+
 @app.route('/match', methods=['POST'])
 def match_face():
     """Face matching endpoint"""
     try:
-        if pca_processor is None or face_matcher is None:
-            return jsonify({'error': 'Model not initialized'}), 500
+        try:
+            model = get_model()
+        except LookupError as e:
+            return model_error(e)
         
         # Handle different input formats
-        if request.is_json:
+        gray_size = None
+        if request.mimetype == 'application/octet-stream' or request.mimetype.startswith('image/'):
+            # Raw request body: an encoded image, or with ?encoding=gray8 pre-resized
+            # 8-bit grayscale pixels (?width=&height=, default the model's image size)
+            with metrics.stage('decode'):
+                image_bytes = request.get_data()
+            if request.args.get('encoding') == 'gray8':
+                gray_size = (request.args.get('width', model.processor.image_size[0], type=int),
+                             request.args.get('height', model.processor.image_size[1], type=int))
+                if gray_size[0] <= 0 or gray_size[1] <= 0 or len(image_bytes) != gray_size[0] * gray_size[1]:
+                    return jsonify({'error': f"gray8 body must hold {gray_size[0]}x{gray_size[1]} bytes, "
+                                             f"got {len(image_bytes)}"}), 400
+        elif request.is_json:
             data = request.get_json()
             if 'image_data' in data:
                 # Base64 encoded image
-                image_data = base64.b64decode(data['image_data'])
-                image = Image.open(io.BytesIO(image_data))
+                with metrics.stage('decode'):
+                    image_bytes = base64.b64decode(data['image_data'])
             else:
                 return jsonify({'error': 'No image_data in JSON'}), 400
         else:
@@ -115,39 +370,199 @@ def match_face():
             if file.filename == '':
                 return jsonify({'error': 'No image file selected'}), 400
             
-            image = Image.open(file.stream)
-        
-        # Get number of matches requested
-        top_k = request.args.get('top_k', 5, type=int)
-        match_type = request.args.get('match_type', 'person')  # 'all', 'person', or 'diverse'
-        max_per_person = request.args.get('max_per_person', 2, type=int)
-        
-        # Find matches based on type
-        if match_type == 'person':
-            matches = face_matcher.get_person_matches(image, top_k=top_k)
-        elif match_type == 'diverse':
-            matches = face_matcher.get_diverse_matches(image, top_k=top_k, max_per_person=max_per_person)
-        else:  # 'all'
-            matches = face_matcher.match_face(image, top_k=top_k)
-        
-        # Add image URLs to matches
-        for match in matches:
-            if 'index' in match:
-                match['image_url'] = f"/image/{match['index']}"
+            with metrics.stage('decode'):
+                image_bytes = file.read()
+        
+        params = get_match_params()
+        error = check_match_params(model, params)
+        if error:
+            return jsonify({'error': error}), 400
+        
+        if not image_bytes:
+            return jsonify({'error': 'Empty image body'}), 400
+        response = run_match(model, image_bytes, params, gray_size)
+        with metrics.stage('serialize'):
+            return jsonify(response)
+    
+    except Exception as e:
+        print(f"Error in face matching: {e}")
+        import traceback
+        traceback.print_exc()
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/match/batch', methods=['POST'])
+def match_batch():
+    """Batch face matching endpoint: one projection and one scoring pass for many images"""
+    try:
+        try:
+            model = get_model()
+        except LookupError as e:
+            return model_error(e)
+        
+        # Handle different input formats
+        if request.is_json:
+            data = request.get_json()
+            if not isinstance(data.get('images'), list) or not data['images']:
+                return jsonify({'error': 'JSON must contain a non-empty images array'}), 400
+            # Base64 encoded images
+            with metrics.stage('decode'):
+                encoded = [base64.b64decode(image_data) for image_data in data['images']]
+            with metrics.stage('image_open'):
+                images = [Image.open(io.BytesIO(image_bytes)) for image_bytes in encoded]
+        else:
+            # Handle multipart upload with repeated 'images' fields
+            files = [file for file in request.files.getlist('images') if file.filename != '']
+            if not files:
+                return jsonify({'error': 'No image files provided'}), 400
+            images = [Image.open(file.stream) for file in files]
+        
+        params = get_match_params()
+        error = check_match_params(model, params)
+        if error:
+            return jsonify({'error': error}), 400
+        results = model.matcher.match_batch(images, **params)
+        
+        with metrics.stage('serialize'):
+            return jsonify({
+                'results': [format_matches(matches, params['match_type'], model_query(model))
+                            for matches in results],
+                'total_queries': len(results)
+            })
+    
+    except Exception as e:
+        print(f"Error in batch face matching: {e}")
+        import traceback
+        traceback.print_exc()
+        return jsonify({'error': str(e)}), 500
+
+def read_request_images():
+    """Read one or more images from multipart 'images'/'image' fields or JSON 'images'/'image_data'"""
+    if request.is_json:
+        data = request.get_json()
+        encoded = data.get('images') or ([data['image_data']] if 'image_data' in data else [])
+        return [Image.open(io.BytesIO(base64.b64decode(image_data))) for image_data in encoded]
+    files = request.files.getlist('images') + request.files.getlist('image')
+    return [Image.open(file.stream) for file in files if file.filename != '']
+
+@app.route('/enroll', methods=['POST'])
+def enroll():
+    """Add images of a person to the gallery; they are searchable as soon as this returns"""
+    try:
+        try:
+            model = get_model()
+        except LookupError as e:
+            return model_error(e)
+        
+        label = request.get_json().get('label') if request.is_json else request.form.get('label')
+        if not label:
+            return jsonify({'error': 'No label provided'}), 400
+        images = read_request_images()
+        if not images:
+            return jsonify({'error': 'No images provided'}), 400
         
+        indices = model.processor.enroll(images, label)
         return jsonify({
-            'matches': matches,
-            'total_matches': len(matches),
-            'match_type': match_type,
-            'unique_persons': len(set(match['person'] for match in matches))
+            'label': label,
+            'indices': indices,
+            'image_urls': [f"/image/{index}{model_query(model)}" for index in indices],
+            'total_images': model.processor.get_gallery().n_live
         })
     
     except Exception as e:
-        print(f"Error in face matching: {e}")
+        print(f"Error enrolling images: {e}")
         import traceback
         traceback.print_exc()
         return jsonify({'error': str(e)}), 500
 
+@app.route('/gallery/<int:image_index>', methods=['DELETE'])
+def remove_image(image_index):
+    """Remove one gallery image from matching"""
+    try:
+        try:
+            model = get_model()
+        except LookupError as e:
+            return model_error(e)
+        if not 0 <= image_index < len(model.processor.get_gallery()):
+            return jsonify({'error': 'Image not found'}), 404
+        
+        removed = model.processor.remove(indices=[image_index])
+        return jsonify({'removed': removed, 'total_images': model.processor.get_gallery().n_live})
+    
+    except Exception as e:
+        print(f"Error removing image: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/gallery/compact', methods=['POST'])
+def compact_gallery():
+    """Fold enrolled images into the main feature store and drop removed ones"""
+    try:
+        try:
+            model = get_model()
+        except LookupError as e:
+            return model_error(e)
+        
+        start_time = time.perf_counter()
+        model.processor.compact()
+        return jsonify({
+            'model_version': model.processor.model_version,
+            'total_images': model.processor.get_gallery().n_live,
+            'elapsed_ms': (time.perf_counter() - start_time) * 1000
+        })
+    
+    except Exception as e:
+        print(f"Error compacting gallery: {e}")
+        return jsonify({'error': str(e)}), 500
+
+def check_admin_token():
+    """Return an error response unless the request carries ADMIN_TOKEN (when one is set)"""
+    token = os.environ.get('ADMIN_TOKEN')
+    if token and request.headers.get('X-Admin-Token') != token:
+        return jsonify({'error': 'Invalid admin token'}), 403
+    return None
+
+@app.route('/admin/reload', methods=['GET', 'POST'])
+def reload_model():
+    """Reload ?model= from disk in the background (POST), or report the last reload (GET)"""
+    error = check_admin_token()
+    if error:
+        return error
+    if model_registry is None:
+        return jsonify({'error': 'Model not initialized'}), 500
+    
+    name = request.args.get('model')
+    if request.method == 'GET':
+        return jsonify(model_registry.reload_status(name))
+    try:
+        # ?wait=1 blocks until the new model is serving (or failed)
+        status = model_registry.reload(name, wait=request.args.get('wait', 0, type=int) == 1)
+    except KeyError as e:
+        return jsonify({'error': e.args[0]}), 404
+    if status['state'] == 'failed':
+        return jsonify(status), 500
+    return jsonify(status), 200 if status['state'] == 'ready' else 202
+
+@app.route('/admin/rollback', methods=['POST'])
+def rollback_model():
+    """Serve the version of ?model= that the last reload replaced"""
+    error = check_admin_token()
+    if error:
+        return error
+    if model_registry is None:
+        return jsonify({'error': 'Model not initialized'}), 500
+    
+    try:
+        served = model_registry.rollback(request.args.get('model'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 409
+    return jsonify({'model': served.name, 'model_version': served.processor.model_version})
+
+@app.route('/models', methods=['GET'])
+def list_models():
+    """Resident, evicted and available models with their memory footprint"""
+    if model_registry is None:
+        return jsonify({'error': 'Model not initialized'}), 500
+    return jsonify(model_registry.status())
+
 if __name__ == '__main__':
     print("Starting Face Matching Service...")
     
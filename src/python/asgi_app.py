@@ -0,0 +1,292 @@
+"""
+Production ASGI server for the face matching service.
+
+The event loop does network I/O and request parsing; query images are
+decoded and projected in a process pool, and scored on threads (NumPy
+releases the GIL) through the model's micro-batcher. /match sheds load with
+fast 503 responses once MAX_PENDING_REQUESTS are in flight, and gives up
+with 504 when a request outlives its deadline. Every other route is served
+by the Flask app unchanged.
+
+Run with `python asgi_app.py` or `uvicorn asgi_app:app --port 5000`.
+"""
+
+import os
+import math
+import time
+import base64
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from contextlib import asynccontextmanager
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.responses import Response, JSONResponse, FileResponse, PlainTextResponse
+from starlette.routing import Route, Mount
+from werkzeug.datastructures import MultiDict
+
+import app as flask_app
+import decode_pool
+from metrics import metrics
+
+DECODE_WORKERS = int(os.environ.get('DECODE_WORKERS', os.cpu_count() or 1))
+MAX_PENDING_REQUESTS = int(os.environ.get('MAX_PENDING_REQUESTS', 64))
+# Clients can ask for a shorter deadline with the X-Request-Deadline-Ms header
+REQUEST_DEADLINE_MS = float(os.environ.get('REQUEST_DEADLINE_MS', 5000))
+
+decode_executor = None  # Process pool for decode, preprocessing and projection
+match_executor = None  # Threads that run one pending /match each
+pending_requests = 0  # /match requests in flight; only touched on the event loop
+# (model name, model_version) pairs the workers cannot load because the files on
+# disk hold another version (after a rollback, or a retrain not yet reloaded)
+stale_versions = set()
+
+metrics.describe('pending_requests', '/match requests in flight in the async server')
+metrics.set_gauge('pending_requests', lambda: pending_requests)
+
+
+def record(endpoint, method, status, started_at):
+    """Record request metrics the way the Flask hooks do"""
+    metrics.inc('requests_total', endpoint=endpoint, method=method, status=status)
+    metrics.observe('request_seconds', time.perf_counter() - started_at, endpoint=endpoint)
+
+
+def pool_projector(model, deadline):
+    """projector for run_match that decodes and projects in the process pool"""
+    processor = model.processor
+    if processor.model_dir is None or (model.name, processor.model_version) in stale_versions:
+        # Models that only exist in memory, or whose files hold another version, are projected in-process
+        return None
+
+    def project(image_bytes, gray_size):
+        future = decode_executor.submit(decode_pool.project_image, model.name, processor.model_dir,
+                                        processor.model_version, image_bytes, gray_size, deadline)
+        try:
+            return future.result(timeout=max(0.0, deadline - time.time()))
+        except FutureTimeoutError:
+            future.cancel()
+            raise decode_pool.DeadlineExceeded()
+        except decode_pool.StaleModel:
+            stale_versions.add((model.name, processor.model_version))
+            return None
+    return project
+
+
+async def read_image(request, model):
+    """Return (image bytes, gray_size) from a raw, JSON or multipart body, or an error response"""
+    media_type = request.headers.get('content-type', '').split(';')[0].strip()
+    if media_type == 'application/octet-stream' or media_type.startswith('image/'):
+        image_bytes = await request.body()
+        if request.query_params.get('encoding') != 'gray8':
+            return image_bytes, None
+        size = model.processor.image_size
+        try:
+            gray_size = (int(request.query_params.get('width', size[0])),
+                         int(request.query_params.get('height', size[1])))
+        except ValueError:
+            gray_size = (0, 0)
+        if gray_size[0] <= 0 or gray_size[1] <= 0 or len(image_bytes) != gray_size[0] * gray_size[1]:
+            return JSONResponse({'error': f"gray8 body must hold {gray_size[0]}x{gray_size[1]} bytes, "
+                                          f"got {len(image_bytes)}"}, 400)
+        return image_bytes, gray_size
+
+    if media_type == 'application/json':
+        data = await request.json()
+        if 'image_data' not in data:
+            return JSONResponse({'error': 'No image_data in JSON'}, 400)
+        return base64.b64decode(data['image_data']), None
+
+    form = await request.form()
+    file = form.get('image')
+    if file is None or isinstance(file, str):
+        return JSONResponse({'error': 'No image file provided'}, 400)
+    if file.filename == '':
+        return JSONResponse({'error': 'No image file selected'}, 400)
+    return await file.read(), None
+
+
+async def get_model(request):
+    """ServedModel for ?model=, loading it on a worker thread if needed"""
+    if flask_app.model_registry is None:
+        raise LookupError('Model not initialized')
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(match_executor, flask_app.model_registry.get,
+                                      request.query_params.get('model'))
+
+
+async def match_face(request):
+    """Face matching endpoint; same API as the Flask /match"""
+    global pending_requests
+    started_at = time.perf_counter()
+    if pending_requests >= MAX_PENDING_REQUESTS:
+        record('/match', 'POST', 503, started_at)
+        return JSONResponse({'error': 'Server busy, retry later'}, 503, headers={'Retry-After': '1'})
+
+    pending_requests += 1
+    # Set by handle_match when it gives up on work that is still running on a thread
+    request.state.unfinished_work = None
+    try:
+        response = await handle_match(request)
+    except Exception as e:
+        print(f"Error in face matching: {e}")
+        response = JSONResponse({'error': str(e)}, 500)
+    finally:
+        work = request.state.unfinished_work
+        if work is None:
+            pending_requests -= 1
+        else:
+            # The slot stays taken until the thread is free again, so timeouts cannot pile up work
+            work.add_done_callback(release_pending)
+    record('/match', 'POST', response.status_code, started_at)
+    return response
+
+
+def release_pending(work):
+    """Done callback of abandoned /match work; frees its pending slot"""
+    global pending_requests
+    pending_requests -= 1
+    if not work.cancelled():
+        work.exception()  # Retrieved so an error after the timeout is not reported as unhandled
+
+
+async def handle_match(request):
+    deadline_ms = REQUEST_DEADLINE_MS
+    if 'x-request-deadline-ms' in request.headers:
+        try:
+            requested_ms = float(request.headers['x-request-deadline-ms'])
+        except ValueError:
+            requested_ms = math.nan
+        if not math.isfinite(requested_ms) or requested_ms <= 0:
+            return JSONResponse({'error': 'X-Request-Deadline-Ms must be a positive number of milliseconds'}, 400)
+        deadline_ms = min(deadline_ms, requested_ms)
+    deadline = time.time() + deadline_ms / 1000
+
+    try:
+        model = await get_model(request)
+    except LookupError as e:
+        status = 404 if isinstance(e, KeyError) else 500
+        return JSONResponse({'error': e.args[0]}, status)
+
+    result = await read_image(request, model)
+    if isinstance(result, JSONResponse):
+        return result
+    image_bytes, gray_size = result
+    if not image_bytes:
+        return JSONResponse({'error': 'Empty image body'}, 400)
+
+    params = flask_app.get_match_params(MultiDict(request.query_params.multi_items()))
+    error = flask_app.check_match_params(model, params)
+    if error:
+        return JSONResponse({'error': error}, 400)
+
+    future = match_executor.submit(flask_app.run_match, model, image_bytes, params, gray_size,
+                                   pool_projector(model, deadline))
+    work = asyncio.wrap_future(future)
+    try:
+        # shield: a timeout must not mark the work done while its thread is still running
+        response = await asyncio.wait_for(asyncio.shield(work), timeout=max(0.0, deadline - time.time()))
+    except asyncio.TimeoutError:
+        future.cancel()  # Only succeeds if the work has not started
+        request.state.unfinished_work = work
+        return JSONResponse({'error': 'Deadline exceeded'}, 504)
+    except decode_pool.DeadlineExceeded:
+        return JSONResponse({'error': 'Deadline exceeded'}, 504)
+    return JSONResponse(response)
+
+
+def etag_matches(request, etag):
+    """True if the request's If-None-Match lists the quoted etag"""
+    header = request.headers.get('if-none-match')
+    if header is None:
+        return False
+    tags = [tag.strip() for tag in header.split(',')]
+    return '*' in tags or etag in tags or f'W/{etag}' in tags
+
+
+async def serve_image(request):
+    """Serve dataset images by index; same API as the Flask /image/<index>"""
+    started_at = time.perf_counter()
+    try:
+        requested_size = flask_app.image_size_param(request.query_params)
+    except ValueError:
+        record('/image/<int:image_index>', 'GET', 400, started_at)
+        return PlainTextResponse("Invalid size", 400)
+    try:
+        model = await get_model(request)
+        image_path, mime_type = flask_app.gallery_image(model, request.path_params['image_index'])
+        thumbnail = None
+        if requested_size:
+            # A thumbnail that is not in the store yet is built from the original
+            loop = asyncio.get_running_loop()
+            thumbnail = await loop.run_in_executor(match_executor, flask_app.gallery_thumbnail, model,
+                                                   image_path, requested_size)
+        cache_control = f'public, max-age={flask_app.IMAGE_MAX_AGE}'
+        if thumbnail is None:
+            response = FileResponse(image_path, media_type=mime_type, stat_result=os.stat(image_path),
+                                    headers={'cache-control': cache_control})
+            kind = 'original'
+        else:
+            data, etag = thumbnail
+            response = Response(data, media_type='image/jpeg',
+                                headers={'etag': f'"{etag}"', 'cache-control': cache_control})
+            kind = 'thumbnail'
+        if etag_matches(request, response.headers['etag']):
+            response = Response(status_code=304, headers={'etag': response.headers['etag'],
+                                                          'cache-control': cache_control})
+            kind = 'not_modified'
+        metrics.inc('image_responses_total', kind=kind)
+    except KeyError:
+        response = PlainTextResponse("Model not found", 404)
+    except LookupError as e:
+        not_initialized = e.args[0] == 'Model not initialized'
+        response = PlainTextResponse(e.args[0], 500 if not_initialized else 404)
+    except Exception as e:
+        print(f"Error serving image: {e}")
+        response = PlainTextResponse("Error serving image", 500)
+    record('/image/<int:image_index>', 'GET', response.status_code, started_at)
+    return response
+
+
+@asynccontextmanager
+async def lifespan(starlette_app):
+    global decode_executor, match_executor
+    loop = asyncio.get_running_loop()
+    if not await loop.run_in_executor(None, flask_app.initialize_model):
+        print("Failed to initialize model. Please check the error messages above.")
+    # Spawned workers do not inherit the server's threads or locks
+    decode_executor = ProcessPoolExecutor(max_workers=DECODE_WORKERS, initializer=decode_pool.init_worker,
+                                          mp_context=multiprocessing.get_context('spawn'))
+    match_executor = ThreadPoolExecutor(max_workers=MAX_PENDING_REQUESTS + 4, thread_name_prefix='match')
+
+    # Load the default model in the workers before the first request needs it
+    registry = flask_app.model_registry
+    if registry is not None and registry.resident():
+        model = registry.get()
+        if model.processor.model_dir is not None:
+            warm_ups = [decode_executor.submit(decode_pool.warm_up, model.name, model.processor.model_dir,
+                                               model.processor.model_version) for _ in range(DECODE_WORKERS)]
+            await asyncio.gather(*(asyncio.wrap_future(future) for future in warm_ups))
+    print(f"Async server ready: {DECODE_WORKERS} decode workers, "
+          f"at most {MAX_PENDING_REQUESTS} pending /match requests")
+    yield
+    decode_executor.shutdown(cancel_futures=True)
+    match_executor.shutdown(wait=False)
+
+
+app = Starlette(
+    routes=[
+        Route('/match', match_face, methods=['POST']),
+        Route('/image/{image_index:int}', serve_image, methods=['GET']),
+        # Everything else, including /health, keeps going through Flask
+        Mount('/', app=WSGIMiddleware(flask_app.app)),
+    ],
+    lifespan=lifespan,
+)
+
+
+if __name__ == '__main__':
+    import uvicorn
+
+    print("Starting Face Matching Service (async)...")
+    uvicorn.run(app, host='0.0.0.0', port=int(os.environ.get('PORT', 5000)))
@@ -0,0 +1,144 @@
+import time
+import queue
+import threading
+from concurrent.futures import Future
+import numpy as np
+
+from metrics import metrics
+
+# Batch sizes are counts, not seconds
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256)
+
+
+class _MatchRequest:
+    __slots__ = ('params', 'pixels', 'features', 'future', 'submitted_at')
+
+    def __init__(self, params, pixels, features):
+        self.params = params
+        self.pixels = pixels
+        self.features = features
+        self.future = Future()
+        self.submitted_at = time.perf_counter()
+
+
+class MicroBatcher:
+    """Coalesces concurrent single-image match requests into batched GEMMs.
+
+    Request threads submit a preprocessed pixel row (or an already projected
+    feature row) and block on the result. One worker thread collects requests
+    for up to window_ms after the first arrives, or until max_batch are queued
+    (the window only applies while traffic is concurrent), then projects all
+    pixel rows with one matrix product and scores each group of requests
+    sharing a search mode with one match_features_each call; top_k and the
+    per-person options are applied to each request's own row. If a group
+    fails, its requests are retried one by one so only the bad ones fail.
+    """
+
+    def __init__(self, face_matcher, window_ms=2.0, max_batch=32):
+        self.face_matcher = face_matcher
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+        self._queue = queue.Queue()
+        self._thread = None
+        self._closed = False
+        self._state_lock = threading.Lock()  # Orders submissions against close()
+
+    def queue_depth(self):
+        """Requests waiting to be picked up by the worker"""
+        return self._queue.qsize()
+
+    def match(self, params, pixels=None, features=None):
+        """Match one query given as a flattened preprocessed image or a (1, k) projection.
+
+        Returns (features, matches) with the projection so callers can cache it.
+        """
+        request = _MatchRequest(params, pixels, features)
+        with self._state_lock:
+            queued = not self._closed
+            if queued:
+                self._ensure_worker()
+                self._queue.put(request)
+        if not queued:
+            # Requests that picked this batcher before it was closed are answered inline
+            self._process([request])
+        return request.future.result()
+
+    def close(self):
+        """Stop the worker once the requests already queued are answered"""
+        with self._state_lock:
+            self._closed = True
+            if self._thread is not None:
+                self._queue.put(None)
+
+    def _ensure_worker(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='match-batcher', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        concurrent = False
+        while True:
+            request = self._queue.get()
+            if request is None:
+                return
+            batch = [request]
+            # Only wait for stragglers when the last batch showed concurrent traffic,
+            # so a lone client pays no window latency
+            deadline = time.perf_counter() + (self.window if concurrent else 0)
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.perf_counter()
+                try:
+                    request = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if request is None:
+                    self._process(batch)
+                    return
+                batch.append(request)
+            concurrent = len(batch) > 1
+            self._process(batch)
+
+    def _process(self, batch):
+        started_at = time.perf_counter()
+        for request in batch:
+            metrics.observe('batch_wait_seconds', started_at - request.submitted_at)
+        metrics.observe('batch_size', len(batch), buckets=BATCH_SIZE_BUCKETS)
+
+        try:
+            # One projection GEMM for every request that still needs projecting
+            unprojected = [request for request in batch if request.features is None]
+            if unprojected:
+                projected = self.face_matcher.pca_processor.project(
+                    np.stack([request.pixels for request in unprojected]))
+                for row, request in enumerate(unprojected):
+                    request.features = projected[row:row + 1]
+        except Exception as e:
+            for request in batch:
+                request.future.set_exception(e)
+            return
+
+        # One scoring GEMM per search mode; only the search options change the scores
+        groups = {}
+        for request in batch:
+            key = (request.params.get('search_mode', 'exact'), request.params.get('nprobe'))
+            groups.setdefault(key, []).append(request)
+        for (search_mode, nprobe), requests in groups.items():
+            try:
+                results = self.face_matcher.match_features_each(
+                    np.vstack([request.features for request in requests]),
+                    [request.params for request in requests], search_mode=search_mode, nprobe=nprobe)
+            except Exception:
+                # Bad options of one request must not fail the others; answer each on its own
+                for request in requests:
+                    self._match_alone(request)
+                continue
+            for request, matches in zip(requests, results):
+                request.future.set_result((request.features, matches))
+
+    def _match_alone(self, request):
+        try:
+            matches = self.face_matcher.match_features(request.features, **request.params)[0]
+        except Exception as e:
+            request.future.set_exception(e)
+            return
+        request.future.set_result((request.features, matches))
@@ -0,0 +1,10 @@
+"""
+Reproducible performance benchmarks on synthetic face galleries.
+
+Run from src/python:
+    python -m benchmark run --images 10000 --output results.json
+    python -m benchmark compare results.json baseline.json
+"""
+
+from .synthetic import generate_gallery, generate_queries
+from .runner import run_benchmark, compare_results
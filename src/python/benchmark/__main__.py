@@ -0,0 +1,71 @@
+import sys
+import json
+import argparse
+
+from pca_solvers import SOLVERS
+from .runner import run_benchmark, compare_results, print_results, print_regressions
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(prog="python -m benchmark",
+                                     description="Benchmark the face matching pipeline on synthetic galleries")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run = subparsers.add_parser("run", help="Run the benchmark and write JSON results")
+    run.add_argument("--images", type=int, default=1000, help="Gallery size (1k to 1M)")
+    run.add_argument("--persons", type=int, default=None, help="Number of persons (default: images / 20)")
+    run.add_argument("--n_components", type=int, default=50)
+    run.add_argument("--image_size", type=int, default=128, help="Square image side in pixels")
+    run.add_argument("--queries", type=int, default=200, help="Queries timed per matching stage")
+    run.add_argument("--top_k", type=int, default=5)
+    run.add_argument("--streaming", action="store_true",
+                     help="Train with fit_streaming (needed for galleries that do not fit in memory)")
+    run.add_argument("--chunk_size", type=int, default=1024)
+    run.add_argument("--solver", choices=SOLVERS, default='auto',
+                     help="PCA solver used by fit")
+    run.add_argument("--workers", type=int, default=None)
+    run.add_argument("--data_dir", default=None, help="Where galleries and the model are written")
+    run.add_argument("--seed", type=int, default=0)
+    run.add_argument("--output", default=None, help="Write results to this JSON file")
+    run.add_argument("--baseline", default=None, help="Compare against this results file")
+    run.add_argument("--threshold", type=float, default=0.10, help="Relative change counted as a regression")
+
+    compare = subparsers.add_parser("compare", help="Compare two results files")
+    compare.add_argument("current")
+    compare.add_argument("baseline")
+    compare.add_argument("--threshold", type=float, default=0.10)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if args.command == "run":
+        results = run_benchmark(n_images=args.images, n_persons=args.persons, n_components=args.n_components,
+                                image_size=(args.image_size, args.image_size), n_queries=args.queries,
+                                top_k=args.top_k, streaming=args.streaming, chunk_size=args.chunk_size,
+                                n_workers=args.workers, data_dir=args.data_dir, seed=args.seed,
+                                solver=args.solver)
+        print_results(results)
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump(results, f, indent=2)
+            print(f"Results written to {args.output}")
+        baseline_path = args.baseline
+    else:
+        with open(args.current) as f:
+            results = json.load(f)
+        baseline_path = args.baseline
+
+    if baseline_path:
+        with open(baseline_path) as f:
+            baseline = json.load(f)
+        if baseline['config'] != results['config']:
+            print("Warning: baseline was run with a different configuration")
+        regressions = compare_results(results, baseline, args.threshold)
+        print_regressions(regressions, args.threshold)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
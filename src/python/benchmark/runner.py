@@ -0,0 +1,191 @@
+import io
+import os
+import sys
+import time
+import shutil
+import platform
+import resource
+import tempfile
+import numpy as np
+
+from pca_processor import PCAProcessor
+from face_matcher import FaceMatcher
+from .synthetic import generate_gallery, generate_queries
+
+# Stages compared by latency percentiles; the others run once and compare total time
+LATENCY_METRICS = ('p50_ms', 'p95_ms', 'p99_ms')
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process so far, in MiB"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in KiB on Linux
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def summarize(latencies, items=None):
+    """Throughput and latency percentiles of one stage"""
+    latencies = np.asarray(latencies, dtype=np.float64)
+    total = float(latencies.sum())
+    items = items if items is not None else len(latencies)
+    return {
+        'calls': len(latencies),
+        'items': items,
+        'total_s': total,
+        'throughput_per_s': items / total if total > 0 else 0.0,
+        'p50_ms': float(np.percentile(latencies, 50) * 1000),
+        'p95_ms': float(np.percentile(latencies, 95) * 1000),
+        'p99_ms': float(np.percentile(latencies, 99) * 1000),
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+
+def time_once(function, *args, **kwargs):
+    """Run function once and return (result, seconds)"""
+    start_time = time.perf_counter()
+    result = function(*args, **kwargs)
+    return result, time.perf_counter() - start_time
+
+
+def time_calls(function, inputs, warmup=3):
+    """Call function on every input after a few warmup calls; return per-call seconds"""
+    for value in inputs[:warmup]:
+        function(value)
+    latencies = []
+    for value in inputs:
+        start_time = time.perf_counter()
+        function(value)
+        latencies.append(time.perf_counter() - start_time)
+    return latencies
+
+
+def run_benchmark(n_images=1000, n_persons=None, n_components=50, image_size=(128, 128), n_queries=200,
+                  top_k=5, streaming=False, chunk_size=1024, n_workers=None, data_dir=None, seed=0, solver='auto'):
+    """Time every pipeline stage on a synthetic gallery and return the results as a dict.
+
+    peak_rss_mb is the process peak after each stage, so it only grows from one
+    stage to the next; stages run in pipeline order.
+    """
+    data_dir = data_dir or os.path.join(tempfile.gettempdir(), 'eigenmatch_benchmark')
+    gallery_dir = os.path.join(data_dir, f"gallery_{n_images}_{image_size[0]}x{image_size[1]}_{seed}")
+    model_dir = os.path.join(data_dir, 'model')
+    generate_gallery(gallery_dir, n_images, n_persons, image_size, seed, n_workers)
+    n_persons = n_persons or max(1, n_images // 20)
+
+    stages = {}
+    processor = PCAProcessor(n_components=n_components, image_size=image_size, n_workers=n_workers, solver=solver)
+    if streaming:
+        _, seconds = time_once(processor.fit_streaming, gallery_dir, chunk_size=chunk_size)
+        stages['fit_streaming'] = summarize([seconds], n_images)
+    else:
+        _, seconds = time_once(processor.load_dataset, gallery_dir)
+        stages['load_dataset'] = summarize([seconds], n_images)
+        _, seconds = time_once(processor.fit)
+        stages['fit'] = summarize([seconds], n_images)
+        processor.dataset = None  # Matching does not need the pixels
+
+    shutil.rmtree(model_dir, ignore_errors=True)
+    _, seconds = time_once(processor.save_model, model_dir)
+    stages['save_model'] = summarize([seconds])
+    processor = PCAProcessor(n_components=n_components, image_size=image_size)
+    _, seconds = time_once(processor.load_model, model_dir)
+    stages['load_model'] = summarize([seconds])
+
+    queries = generate_queries(n_queries, n_persons, image_size, seed)
+    matcher = FaceMatcher(processor)
+    stages['transform'] = summarize(time_calls(processor.transform, queries))
+    stages['match_face'] = summarize(time_calls(lambda image: matcher.match_face(image, top_k=top_k), queries))
+    stages['get_person_matches'] = summarize(
+        time_calls(lambda image: matcher.get_person_matches(image, top_k=top_k), queries))
+    stages['get_diverse_matches'] = summarize(
+        time_calls(lambda image: matcher.get_diverse_matches(image, top_k=top_k), queries))
+    stages['http_match'] = summarize(time_http_match(processor, queries, top_k))
+
+    return {
+        'config': {
+            'n_images': n_images, 'n_persons': n_persons, 'n_components': n_components,
+            'image_size': list(image_size), 'n_queries': n_queries, 'top_k': top_k,
+            'streaming': streaming, 'chunk_size': chunk_size, 'n_workers': n_workers, 'seed': seed,
+            'solver': solver,
+        },
+        'environment': {
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+        },
+        'stages': stages,
+    }
+
+
+def time_http_match(processor, queries, top_k):
+    """Time end-to-end POST /match requests through the Flask test client"""
+    import app
+    from model_registry import ModelRegistry
+
+    app.model_registry = ModelRegistry(os.path.dirname(processor.model_dir), default_model='benchmark')
+    app.model_registry.add('benchmark', processor)
+    # Every query is a distinct image, and the caches start empty, so nothing is served from cache
+    app.result_cache.clear()
+    app.projection_cache.clear()
+    client = app.app.test_client()
+
+    bodies = []
+    for image in queries:
+        buffer = io.BytesIO()
+        image.save(buffer, format='PNG')
+        bodies.append(buffer.getvalue())
+
+    def post(body):
+        response = client.post(f'/match?top_k={top_k}', data={'image': (io.BytesIO(body), 'query.png')})
+        if response.status_code != 200:
+            raise RuntimeError(f"/match failed with status {response.status_code}")
+
+    # Warm up on re-encoded copies so the timed requests still miss the caches
+    for image in queries[:3]:
+        buffer = io.BytesIO()
+        image.save(buffer, format='BMP')
+        post(buffer.getvalue())
+    return time_calls(post, bodies, warmup=0)
+
+
+def compare_results(current, baseline, threshold=0.10):
+    """Return regressions of current against baseline beyond a relative threshold.
+
+    Single-run stages compare total_s; repeated stages compare latency
+    percentiles. Throughput and peak RSS are compared for every stage.
+    """
+    regressions = []
+    for stage, now in current['stages'].items():
+        before = baseline['stages'].get(stage)
+        if before is None:
+            continue
+        metrics = LATENCY_METRICS if now['calls'] > 1 else ('total_s',)
+        for metric in metrics + ('peak_rss_mb',):
+            if before[metric] > 0 and now[metric] > before[metric] * (1 + threshold):
+                regressions.append({'stage': stage, 'metric': metric, 'baseline': before[metric],
+                                    'current': now[metric], 'change': now[metric] / before[metric] - 1})
+        if now['throughput_per_s'] < before['throughput_per_s'] / (1 + threshold):
+            regressions.append({'stage': stage, 'metric': 'throughput_per_s',
+                                'baseline': before['throughput_per_s'], 'current': now['throughput_per_s'],
+                                'change': now['throughput_per_s'] / before['throughput_per_s'] - 1})
+    return regressions
+
+
+def print_results(results):
+    """Print a table of stage results"""
+    print(f"{'stage':<22}{'calls':>7}{'items/s':>12}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'peak MiB':>10}")
+    for stage, row in results['stages'].items():
+        print(f"{stage:<22}{row['calls']:>7}{row['throughput_per_s']:>12.1f}{row['p50_ms']:>10.2f}"
+              f"{row['p95_ms']:>10.2f}{row['p99_ms']:>10.2f}{row['peak_rss_mb']:>10.1f}")
+
+
+def print_regressions(regressions, threshold):
+    """Print regressions, or a note that there were none"""
+    if not regressions:
+        print(f"No regressions beyond {threshold:.0%}")
+        return
+    print(f"{len(regressions)} regression(s) beyond {threshold:.0%}:")
+    for regression in regressions:
+        print(f"  {regression['stage']:<22}{regression['metric']:<18}{regression['baseline']:>12.3f}"
+              f" -> {regression['current']:<12.3f}({regression['change']:+.1%})")
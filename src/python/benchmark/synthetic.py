@@ -0,0 +1,100 @@
+import os
+import json
+import numpy as np
+import cv2
+from PIL import Image
+from concurrent.futures import ThreadPoolExecutor
+
+MANIFEST_FILE = 'synthetic.json'
+
+
+def person_params(person, seed=0):
+    """Face geometry and shading that stay fixed for one synthetic person"""
+    rng = np.random.default_rng([seed, person])
+    return {
+        'face_axes': rng.uniform([0.28, 0.36], [0.36, 0.46]),
+        'skin': rng.uniform(120, 220),
+        'background': rng.uniform(0, 90),
+        'eye_y': rng.uniform(0.38, 0.46),
+        'eye_dx': rng.uniform(0.10, 0.17),
+        'eye_size': rng.uniform(0.03, 0.06),
+        'mouth_y': rng.uniform(0.64, 0.72),
+        'mouth_width': rng.uniform(0.08, 0.18),
+        'hair': rng.uniform(0, 100),
+        'hair_height': rng.uniform(0.05, 0.2),
+    }
+
+
+def synthetic_face(params, rng, image_size=(128, 128)):
+    """Draw one grayscale face-like image of a person with per-image jitter and noise"""
+    width, height = image_size
+    scale = np.array([width, height], dtype=np.float64)
+    image = np.full((height, width), params['background'], dtype=np.float32)
+
+    center = scale * (0.5 + rng.normal(0, 0.02, 2))
+    axes = params['face_axes'] * scale * rng.uniform(0.95, 1.05)
+    cv2.ellipse(image, tuple(int(v) for v in center), tuple(int(v) for v in axes), 0, 0, 360,
+                float(params['skin']), -1)
+
+    # Hair band across the top of the face
+    top = int(center[1] - axes[1])
+    cv2.rectangle(image, (int(center[0] - axes[0]), top),
+                  (int(center[0] + axes[0]), top + int(params['hair_height'] * height)),
+                  float(params['hair']), -1)
+
+    eye_y = int(params['eye_y'] * height + center[1] - height / 2)
+    eye_radius = max(1, int(params['eye_size'] * width))
+    for side in (-1, 1):
+        eye_x = int(center[0] + side * params['eye_dx'] * width)
+        cv2.circle(image, (eye_x, eye_y), eye_radius, 30.0, -1)
+
+    mouth_y = int(params['mouth_y'] * height + center[1] - height / 2)
+    half_width = int(params['mouth_width'] * width / 2)
+    cv2.line(image, (int(center[0]) - half_width, mouth_y), (int(center[0]) + half_width, mouth_y),
+             60.0, max(1, height // 64))
+
+    image = image * rng.uniform(0.85, 1.15) + rng.normal(0, 8, image.shape)
+    return np.clip(image, 0, 255).astype(np.uint8)
+
+
+def generate_gallery(output_dir, n_images, n_persons=None, image_size=(128, 128), seed=0, n_workers=None):
+    """Write a person-per-directory gallery of synthetic PNG faces.
+
+    The gallery is reused when output_dir already holds one generated with the
+    same parameters, so repeated benchmark runs skip generation.
+    """
+    n_persons = n_persons or max(1, n_images // 20)
+    manifest = {'n_images': n_images, 'n_persons': n_persons, 'image_size': list(image_size), 'seed': seed}
+    manifest_path = os.path.join(output_dir, MANIFEST_FILE)
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            if json.load(f) == manifest:
+                print(f"Reusing synthetic gallery in {output_dir}/")
+                return output_dir
+
+    print(f"Generating {n_images} synthetic images for {n_persons} persons in {output_dir}/...")
+    for person in range(n_persons):
+        os.makedirs(os.path.join(output_dir, f"person_{person:06d}"), exist_ok=True)
+    params = [person_params(person, seed) for person in range(n_persons)]
+
+    def write_image(index):
+        person = index % n_persons
+        rng = np.random.default_rng([seed, n_persons, index])
+        pixels = synthetic_face(params[person], rng, image_size)
+        cv2.imwrite(os.path.join(output_dir, f"person_{person:06d}", f"img_{index:08d}.png"), pixels)
+
+    with ThreadPoolExecutor(max_workers=n_workers) as executor:
+        list(executor.map(write_image, range(n_images)))
+
+    with open(manifest_path, 'w') as f:
+        json.dump(manifest, f)
+    return output_dir
+
+
+def generate_queries(n_queries, n_persons, image_size=(128, 128), seed=0):
+    """Return unseen PIL images of gallery persons, for use as match queries"""
+    # A seed sequence the gallery never uses, so queries are new images of known persons
+    rng = np.random.default_rng([seed, 2 ** 31, n_queries])
+    persons = rng.integers(0, n_persons, n_queries)
+    return [Image.fromarray(synthetic_face(person_params(int(person), seed), rng, image_size))
+            for person in persons]
@@ -0,0 +1,297 @@
+"""
+Bulk face matching from the command line.
+
+Loads a saved model once and streams query images through a pipeline:
+a prefetch thread decodes upcoming batches on a thread pool while the
+current batch is projected with one GEMM and scored with chunked batch
+matching. Results are written incrementally as JSONL or CSV, and a
+checkpoint beside the output lets an interrupted run resume where it
+stopped.
+"""
+
+import os
+import sys
+import csv
+import glob
+import json
+import time
+import queue
+import argparse
+import threading
+import contextlib
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
+
+from pca_processor import PCAProcessor, IMAGE_EXTENSIONS
+from face_matcher import FaceMatcher
+
+DEFAULT_MODELS_DIR = os.path.join(os.path.dirname(__file__), "models")
+CSV_FIELDS = ['query', 'rank', 'person', 'score', 'index', 'image_path', 'error']
+
+
+def iter_query_paths(inputs, file_list=None):
+    """Yield query image paths in a deterministic order, without listing everything up front.
+
+    inputs are image files, directories (walked recursively in sorted order)
+    or glob patterns; file_list is a text file with one path per line ('-'
+    for stdin).
+    """
+    for item in inputs:
+        if os.path.isdir(item):
+            for root, dirs, files in os.walk(item):
+                dirs.sort()
+                for name in sorted(files):
+                    if name.lower().endswith(IMAGE_EXTENSIONS):
+                        yield os.path.join(root, name)
+        elif os.path.isfile(item):
+            yield item
+        else:
+            matches = sorted(glob.glob(item, recursive=True))
+            if not matches:
+                print(f"No images match {item}", file=sys.stderr)
+            for path in matches:
+                if os.path.isfile(path) and path.lower().endswith(IMAGE_EXTENSIONS):
+                    yield path
+
+    if file_list is not None:
+        stream = sys.stdin if file_list == '-' else open(file_list)
+        try:
+            for line in stream:
+                path = line.strip()
+                if path:
+                    yield path
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+
+
+def iter_batches(paths, batch_size):
+    batch = []
+    for path in paths:
+        batch.append(path)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def decode_batch(processor, paths, executor):
+    """Decode and preprocess a batch of paths on the executor.
+
+    Returns (pixels, decoded paths, {failed path: error}); pixels holds one
+    row per decoded path.
+    """
+    pixels = np.empty((len(paths), processor.image_size[0] * processor.image_size[1]), dtype=np.float32)
+
+    def load(row):
+        try:
+            with Image.open(paths[row]) as image:
+                pixels[row] = processor.preprocess_image(image).ravel()
+            return None
+        except Exception as e:
+            return str(e)
+
+    errors = list(executor.map(load, range(len(paths))))
+    ok = [row for row, error in enumerate(errors) if error is None]
+    failed = {paths[row]: error for row, error in enumerate(errors) if error is not None}
+    return pixels[ok], [paths[row] for row in ok], failed
+
+
+def prefetch(batches, processor, executor, depth):
+    """Decode batches in a background thread, keeping up to depth decoded batches ahead"""
+    decoded = queue.Queue(maxsize=depth)
+    done = object()
+    stop = threading.Event()
+
+    def produce():
+        try:
+            for paths in batches:
+                if stop.is_set():
+                    return
+                decoded.put((paths, decode_batch(processor, paths, executor)))
+        except Exception as e:
+            decoded.put(e)
+        finally:
+            decoded.put(done)
+
+    thread = threading.Thread(target=produce, name='prefetch', daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = decoded.get()
+            if item is done:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stop.set()
+
+
+class ResultWriter:
+    """Appends results as JSONL or CSV rows, and tracks a resumable checkpoint.
+
+    The checkpoint records how many queries are done and the output size at
+    that point; resuming truncates anything written after it.
+    """
+
+    def __init__(self, output, output_format, checkpoint_path, run_signature, resume=False):
+        self.output_format = output_format
+        self.checkpoint_path = checkpoint_path
+        self.run_signature = run_signature
+        self.processed = 0
+
+        checkpoint = self._read_checkpoint() if resume else None
+        if output == '-':
+            self.file = sys.stdout
+            self.checkpoint_path = None
+        elif checkpoint is not None and os.path.exists(output):
+            self.file = open(output, 'r+', newline='')
+            self.file.truncate(checkpoint['output_bytes'])
+            self.file.seek(checkpoint['output_bytes'])
+            self.processed = checkpoint['processed']
+            print(f"Resuming after {self.processed} queries", file=sys.stderr)
+        else:
+            self.file = open(output, 'w', newline='')
+        self.csv = csv.DictWriter(self.file, CSV_FIELDS) if output_format == 'csv' else None
+        if self.csv is not None and (self.file is sys.stdout or self.file.tell() == 0):
+            self.csv.writeheader()
+
+    def _read_checkpoint(self):
+        if self.checkpoint_path is None or not os.path.exists(self.checkpoint_path):
+            return None
+        with open(self.checkpoint_path) as f:
+            checkpoint = json.load(f)
+        if checkpoint.get('run') != self.run_signature:
+            print("Checkpoint belongs to a different run; starting over", file=sys.stderr)
+            return None
+        return checkpoint
+
+    def write(self, query, matches=None, error=None):
+        if self.csv is None:
+            row = {'query': query, 'matches': matches} if error is None else {'query': query, 'error': error}
+            self.file.write(json.dumps(row) + '\n')
+        elif error is not None:
+            self.csv.writerow({'query': query, 'error': error})
+        else:
+            for match in matches:
+                self.csv.writerow({'query': query, 'rank': match['rank'], 'person': match['person'],
+                                   'score': match['score'], 'index': match['index'],
+                                   'image_path': match['image_path']})
+
+    def commit(self, processed):
+        """Make everything written so far durable, then record the checkpoint"""
+        self.processed = processed
+        self.file.flush()
+        if self.checkpoint_path is None:
+            return
+        os.fsync(self.file.fileno())
+        checkpoint = {'run': self.run_signature, 'processed': processed, 'output_bytes': self.file.tell()}
+        with open(self.checkpoint_path + '.tmp', 'w') as f:
+            json.dump(checkpoint, f)
+        os.replace(self.checkpoint_path + '.tmp', self.checkpoint_path)
+
+    def close(self):
+        if self.file is not sys.stdout:
+            self.file.close()
+
+
+def run(processor, face_matcher, paths, writer, params, batch_size=256, n_workers=None, prefetch_depth=4,
+        report_every=10.0):
+    """Match every path and write the results; returns (images matched, seconds)"""
+    # Queries finished by an earlier run are skipped without being decoded
+    skip = writer.processed
+    paths = iter(paths)
+    for _ in range(skip):
+        if next(paths, None) is None:
+            break
+
+    processed = skip
+    matched = 0
+    start_time = last_report = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=n_workers or os.cpu_count() or 1) as executor:
+        for batch_paths, (pixels, decoded, failed) in prefetch(iter_batches(paths, batch_size), processor,
+                                                               executor, prefetch_depth):
+            results = {}
+            if len(decoded):
+                features = processor.project(pixels)
+                results = dict(zip(decoded, face_matcher.match_features(features, **params)))
+            # Rows keep the input order, including unreadable images
+            for path in batch_paths:
+                if path in failed:
+                    writer.write(path, error=failed[path])
+                else:
+                    writer.write(path, results[path])
+            processed += len(batch_paths)
+            matched += len(decoded)
+            writer.commit(processed)
+
+            now = time.perf_counter()
+            if now - last_report >= report_every:
+                print(f"{processed} queries, {matched / (now - start_time):.1f} images/s", file=sys.stderr)
+                last_report = now
+    return matched, time.perf_counter() - start_time
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Match many query images against a saved model")
+    parser.add_argument("inputs", nargs="*", help="Query images, directories or glob patterns")
+    parser.add_argument("--file_list", default=None, help="Text file with one query path per line ('-' for stdin)")
+    parser.add_argument("--model", default=os.environ.get('ACTIVE_MODEL_NAME', 'simpsons_faces_pca'),
+                        help="Model name under --models_dir")
+    parser.add_argument("--models_dir", default=os.environ.get('MODELS_DIR', DEFAULT_MODELS_DIR))
+    parser.add_argument("--output", default='-', help="Results file (default stdout)")
+    parser.add_argument("--format", choices=['jsonl', 'csv'], default=None,
+                        help="Output format (default from the output extension, else jsonl)")
+    parser.add_argument("--resume", action="store_true", help="Continue from the output's checkpoint")
+    parser.add_argument("--top_k", type=int, default=5)
+    parser.add_argument("--match_type", default='person', choices=['all', 'person', 'diverse'])
+    parser.add_argument("--max_per_person", type=int, default=2)
+    parser.add_argument("--search_mode", default='exact', choices=['exact', 'ann', 'prefilter'])
+    parser.add_argument("--nprobe", type=int, default=None)
+    parser.add_argument("--feature_dtype", default='float32', choices=['float32', 'float16', 'int8'])
+    parser.add_argument("--batch_size", type=int, default=256, help="Queries projected and scored together")
+    parser.add_argument("--workers", type=int, default=None, help="Decode threads (default: CPU count)")
+    parser.add_argument("--prefetch", type=int, default=4, help="Decoded batches kept ready ahead of scoring")
+    args = parser.parse_args()
+    if not args.inputs and args.file_list is None:
+        parser.error("give query images, directories, glob patterns or --file_list")
+    return args
+
+
+def main():
+    args = parse_args()
+    output_format = args.format or ('csv' if args.output.lower().endswith('.csv') else 'jsonl')
+
+    processor = PCAProcessor()
+    # Progress goes to stderr so results can be streamed to stdout
+    with contextlib.redirect_stdout(sys.stderr):
+        try:
+            processor.load_model(os.path.join(args.models_dir, args.model))
+        except ValueError as e:
+            print(f"Error loading model: {e}")
+            sys.exit(1)
+        face_matcher = FaceMatcher(processor, feature_dtype=args.feature_dtype)
+        face_matcher.warm_up()
+
+    params = {'top_k': args.top_k, 'match_type': args.match_type, 'max_per_person': args.max_per_person,
+              'search_mode': args.search_mode, 'nprobe': args.nprobe}
+    # A checkpoint only applies to the same inputs, model version and options
+    run_signature = {'inputs': args.inputs, 'file_list': args.file_list, 'model_version': processor.model_version,
+                     'format': output_format, 'params': params}
+    writer = ResultWriter(args.output, output_format, args.output + '.checkpoint.json', run_signature,
+                          resume=args.resume)
+    try:
+        matched, seconds = run(processor, face_matcher, iter_query_paths(args.inputs, args.file_list), writer,
+                               params, batch_size=args.batch_size, n_workers=args.workers,
+                               prefetch_depth=args.prefetch)
+    finally:
+        writer.close()
+    print(f"Matched {matched} images in {seconds:.1f}s ({matched / max(seconds, 1e-9):.1f} images/s); "
+          f"{writer.processed} queries done", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""
+Worker-process side of the async server: decode, preprocess and project
+query images outside the serving process
+"""
+
+import io
+import time
+import cv2
+from PIL import Image
+from threadpoolctl import threadpool_limits
+
+from pca_processor import PCAProcessor
+
+# Model name -> PCAProcessor, loaded lazily in each worker process
+_processors = {}
+
+
+class DeadlineExceeded(Exception):
+    """The request's deadline passed before its work started"""
+
+
+class StaleModel(Exception):
+    """The model on disk is not the version being served (e.g. after a rollback)"""
+
+
+def init_worker():
+    """Keep each worker single-threaded; the pool itself provides the parallelism"""
+    threadpool_limits(1)
+    cv2.setNumThreads(1)
+
+
+def load_processor(model_name, model_dir, model_version):
+    """Return this worker's processor for model_name, (re)loading it if the version changed.
+
+    Raises StaleModel when the files on disk hold a different version; the
+    serving process then projects that version itself.
+    """
+    processor = _processors.get(model_name)
+    if processor is None or processor.model_version != model_version:
+        processor = PCAProcessor()
+        processor.load_model(model_dir)
+        _processors[model_name] = processor
+        if processor.model_version != model_version:
+            raise StaleModel(f"Model {model_name} on disk is not the served version")
+    return processor
+
+
+def warm_up(model_name, model_dir, model_version):
+    """Load a model in this worker ahead of its first request"""
+    try:
+        load_processor(model_name, model_dir, model_version)
+    except StaleModel:
+        pass  # Requests for this version are projected by the serving process
+
+
+def project_image(model_name, model_dir, model_version, image_bytes, gray_size, deadline):
+    """Return the (1, n_components) projection of one query image.
+
+    The worker loads the model from model_dir on first use and again whenever
+    the serving process has moved to another model_version. deadline is a
+    time.time() timestamp; requests that waited in the queue past it are
+    skipped.
+    """
+    if time.time() > deadline:
+        raise DeadlineExceeded()
+
+    processor = load_processor(model_name, model_dir, model_version)
+    if gray_size is not None:
+        pixels = processor.preprocess_gray_bytes(image_bytes, gray_size)
+    else:
+        pixels = processor.preprocess_image(Image.open(io.BytesIO(image_bytes))).ravel()
+    return processor.project(pixels.reshape(1, -1))
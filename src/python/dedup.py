@@ -0,0 +1,146 @@
+"""
+Near-duplicate detection within each person's gallery images, and a
+standalone command that compacts a saved model
+"""
+
+import os
+import json
+import argparse
+import numpy as np
+
+from face_matcher import LabelGroups, safe_norms
+
+REPORT_FILE = 'duplicates.json'
+# Cosine similarity of PCA features above which two images of a person count as duplicates
+DEFAULT_THRESHOLD = 0.98
+
+
+def find_near_duplicates(features, label_codes, threshold=DEFAULT_THRESHOLD, block_rows=2048):
+    """Greedily keep the first of each group of near-identical images of a person.
+
+    An image is dropped when its cosine similarity to an already kept image of
+    the same person reaches threshold. Similarities are computed in blocks of at
+    most block_rows x block_rows, so memory stays bounded for large persons.
+    Returns (keep mask, kept_of) where kept_of[i] is the kept image that
+    dropped image i duplicates (and i itself for kept images).
+    """
+    groups = LabelGroups(label_codes)
+    keep = np.ones(len(label_codes), dtype=bool)
+    kept_of = np.arange(len(label_codes))
+
+    for start, end in zip(groups.group_starts, groups.group_ends):
+        rows = np.arange(start, end) if groups.order is None else groups.order[start:end]
+        kept_rows = []
+        kept_vectors = []  # Unit-length features of kept rows, one array per processed block
+        for block_start in range(0, len(rows), block_rows):
+            block = rows[block_start:block_start + block_rows]
+            vectors = np.asarray(features[block], dtype=np.float32)
+            vectors = vectors / safe_norms(np.linalg.norm(vectors, axis=1))[:, None]
+
+            # Best earlier kept match of every row in the block, one bounded product at a time
+            best = np.full(len(block), -np.inf, dtype=np.float32)
+            best_row = np.full(len(block), -1, dtype=np.intp)
+            offset = 0
+            kept_array = np.asarray(kept_rows, dtype=np.intp)
+            for previous in kept_vectors:
+                similarities = vectors @ previous.T
+                column = np.argmax(similarities, axis=1)
+                value = similarities[np.arange(len(block)), column]
+                better = value > best
+                best[better] = value[better]
+                best_row[better] = kept_array[offset + column[better]]
+                offset += len(previous)
+
+            # Within the block, a row is a duplicate only of earlier rows that were kept.
+            # Rows without a near-identical earlier row are decided without a loop.
+            within = vectors @ vectors.T
+            earlier = np.tril(within >= threshold, -1)
+            block_kept = best < threshold
+            for i in np.flatnonzero(block_kept & earlier.any(axis=1)):
+                matches = np.flatnonzero(earlier[i] & block_kept)
+                if len(matches):
+                    block_kept[i] = False
+                    j = matches[np.argmax(within[i, matches])]
+                    best[i], best_row[i] = within[i, j], block[j]
+
+            keep[block[~block_kept]] = False
+            kept_of[block[~block_kept]] = best_row[~block_kept]
+            kept_rows.extend(block[block_kept])
+            if block_kept.any():
+                kept_vectors.append(vectors[block_kept])
+    return keep, kept_of
+
+
+def summarize(keep, label_codes, n_components, threshold):
+    """How much the gallery shrank"""
+    before, after = len(keep), int(keep.sum())
+    return {
+        'threshold': threshold,
+        'images_before': before,
+        'images_after': after,
+        'dropped': before - after,
+        'shrink_ratio': (before - after) / before if before else 0.0,
+        'persons_affected': int(len(np.unique(np.asarray(label_codes)[~keep]))),
+        'feature_bytes_saved': (before - after) * n_components * 4,
+    }
+
+
+def save_report(model_dir, summary, mapping):
+    """Write the summary and the dropped -> kept image path mapping beside the model.
+
+    Mappings of earlier runs are kept, with their targets redirected when a
+    kept image was itself dropped by this run.
+    """
+    path = os.path.join(model_dir, REPORT_FILE)
+    previous = {}
+    if os.path.exists(path):
+        with open(path) as f:
+            previous = json.load(f).get('mapping', {})
+    merged = {dropped: mapping.get(kept, kept) for dropped, kept in previous.items()}
+    merged.update(mapping)
+
+    with open(path + '.tmp', 'w') as f:
+        json.dump({'summary': summary, 'mapping': merged}, f, indent=2)
+    os.replace(path + '.tmp', path)
+    return path
+
+
+def print_summary(summary):
+    print(f"Near-duplicates (cosine >= {summary['threshold']}): dropped {summary['dropped']} of "
+          f"{summary['images_before']} images ({summary['shrink_ratio']:.1%}) across "
+          f"{summary['persons_affected']} persons, saving {summary['feature_bytes_saved'] / 1e6:.1f} MB of features")
+
+
+def main():
+    from pca_processor import PCAProcessor
+    from enrollment import EnrollmentLog
+
+    parser = argparse.ArgumentParser(description="Drop near-duplicate images from a saved model's gallery")
+    parser.add_argument("model_dir", help="Saved model directory")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="Cosine similarity at which two images of a person are duplicates")
+    parser.add_argument("--dry_run", action="store_true", help="Report without changing the model")
+    args = parser.parse_args()
+
+    pca_processor = PCAProcessor()
+    pca_processor.load_model(args.model_dir)
+    if args.dry_run:
+        gallery = pca_processor.get_gallery()
+        features, _, _ = pca_processor.get_dataset_features()
+        live = np.ones(len(gallery), dtype=bool)
+        live[gallery.removed] = False
+        keep, _ = find_near_duplicates(features[live], gallery.label_codes[live], args.threshold)
+        print_summary(summarize(keep, gallery.label_codes[live], features.shape[1], args.threshold))
+        return
+
+    summary, mapping = pca_processor.deduplicate(args.threshold)
+    print_summary(summary)
+    if mapping:
+        # Pending enrollments were folded in before deduplicating
+        pca_processor.save_model(args.model_dir)
+        EnrollmentLog(args.model_dir).clear()
+        print(f"Duplicate mapping written to {save_report(args.model_dir, summary, mapping)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+import os
+import json
+import uuid
+from collections.abc import Sequence
+import numpy as np
+
+ENROLLMENT_DIR = 'enrollments'
+SEGMENT_FILE = 'segment.f32'
+LOG_FILE = 'log.jsonl'
+
+
+class ConcatSequence(Sequence):
+    """Read-only concatenation of two sequences without copying them"""
+
+    def __init__(self, first, second):
+        self.first = first
+        self.second = second
+
+    def __len__(self):
+        return len(self.first) + len(self.second)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if index < len(self.first):
+            return self.first[index]
+        return self.second[index - len(self.first)]
+
+
+class GallerySnapshot:
+    """Immutable view of the searchable gallery: the main store plus the enrollment segment.
+
+    Gallery indices 0..n_main-1 address the main store and n_main.. the segment.
+    Writers publish a new snapshot instead of mutating this one, so readers never lock.
+    The ANN index, if any, covers this snapshot's main store.
+    """
+
+    def __init__(self, version, main_features, main_normalized, main_sq_norms,
+                 segment_features, label_codes, labels, image_paths, removed, ann_index=None):
+        self.version = version
+        self.main_features = main_features
+        self.main_normalized = main_normalized
+        self.main_sq_norms = main_sq_norms
+        self.segment_features = segment_features
+        self.label_codes = label_codes  # int32 code per gallery index (main then segment)
+        self.labels = labels
+        self.image_paths = image_paths
+        self.removed = removed  # Sorted gallery indices of tombstoned entries
+        self.ann_index = ann_index
+        self.n_main = len(main_features)
+
+    def __len__(self):
+        return self.n_main + len(self.segment_features)
+
+    @property
+    def n_live(self):
+        return len(self) - len(self.removed)
+
+
+class EnrollmentLog:
+    """Append-only on-disk segment of enrolled features next to a saved model.
+
+    Features are appended as raw float32 rows to segment.f32; log.jsonl records
+    each enrollment and removal. The first log line names the model version the
+    segment applies to, so a segment left over from before a compaction is ignored.
+    Rows are written before the log lines describing them; each add record names
+    its segment row, and rows no record describes (from a crash in between) are
+    truncated away by the next append.
+    """
+
+    def __init__(self, model_dir):
+        self.enrollment_dir = os.path.join(model_dir, ENROLLMENT_DIR)
+        self.segment_path = os.path.join(self.enrollment_dir, SEGMENT_FILE)
+        self.log_path = os.path.join(self.enrollment_dir, LOG_FILE)
+
+    def replay(self, model_version, n_components):
+        """Return (features, labels, image_paths, removed) recorded for model_version"""
+        features = np.empty((0, n_components), dtype=np.float32)
+        labels, image_paths, removed = [], [], set()
+        if not os.path.exists(self.log_path):
+            return features, labels, image_paths, removed
+
+        records = []
+        with open(self.log_path) as f:
+            for line in f:
+                if not line.endswith('\n'):
+                    break  # Cut short by a crash
+                if line.strip():
+                    records.append(json.loads(line))
+        if not records or records[0].get('model_version') != model_version:
+            print(f"Ignoring enrollment segment of another model version in {self.enrollment_dir}/")
+            return features, labels, image_paths, removed
+
+        segment = np.fromfile(self.segment_path, dtype=np.float32)
+        segment = segment[:len(segment) - len(segment) % n_components].reshape(-1, n_components)
+        rows = []
+        for record in records[1:]:
+            if record['op'] == 'add':
+                # Logs written before rows were recorded hold them in order
+                row = record.get('row', len(rows))
+                if row >= len(segment):
+                    print(f"Enrollment log in {self.enrollment_dir}/ describes rows missing from the segment")
+                    break
+                rows.append(row)
+                labels.append(record['label'])
+                image_paths.append(record['image_path'])
+            elif record['op'] == 'remove':
+                removed.add(record['index'])
+        return segment[rows], labels, image_paths, removed
+
+    def append(self, model_version, features, label, image_paths, first_row):
+        """Record newly enrolled feature rows; first_row is the number of rows already logged"""
+        self._start(model_version)
+        features = np.ascontiguousarray(features, dtype=np.float32)
+        with open(self.segment_path, 'r+b') as f:
+            # Drop rows of an append that crashed before logging them, so new rows stay aligned
+            f.truncate(first_row * features.shape[1] * features.itemsize)
+            f.seek(0, os.SEEK_END)
+            f.write(features.tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        self._write_records([{'op': 'add', 'row': first_row + i, 'label': label, 'image_path': path}
+                             for i, path in enumerate(image_paths)])
+
+    def remove(self, model_version, indices):
+        """Record tombstones for gallery indices"""
+        self._start(model_version)
+        self._write_records([{'op': 'remove', 'index': int(index)} for index in indices])
+
+    def save_image(self, image):
+        """Keep a copy of an enrolled image so it can be served like dataset images"""
+        image_dir = os.path.join(self.enrollment_dir, 'images')
+        os.makedirs(image_dir, exist_ok=True)
+        image_path = os.path.join(image_dir, f"{uuid.uuid4().hex}.png")
+        image.save(image_path)
+        return image_path
+
+    def clear(self):
+        """Drop the segment after it has been compacted into the main store"""
+        for path in (self.log_path, self.segment_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def _start(self, model_version):
+        if not os.path.exists(self.log_path):
+            os.makedirs(self.enrollment_dir, exist_ok=True)
+            open(self.segment_path, 'wb').close()
+            self._write_records([{'op': 'base', 'model_version': model_version}])
+
+    def _write_records(self, records):
+        self._drop_torn_line()
+        with open(self.log_path, 'a') as f:
+            for record in records:
+                f.write(json.dumps(record) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _drop_torn_line(self):
+        """Cut a log line left unfinished by a crash, so the next record starts on its own line"""
+        if not os.path.exists(self.log_path) or os.path.getsize(self.log_path) == 0:
+            return
+        with open(self.log_path, 'rb+') as f:
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b'\n':
+                f.seek(0)
+                f.truncate(f.read().rfind(b'\n') + 1)
@@ -0,0 +1,209 @@
+"""
+Sweep n_components with a single PCA fit and report recall@k against
+query latency and feature memory for every candidate
+"""
+
+import os
+import json
+import time
+import argparse
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from sklearn.preprocessing import StandardScaler
+
+import feature_store
+import pca_solvers
+from pca_processor import PCAProcessor
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(__file__), "cache", "preprocessed")
+# Upper bound on query-by-gallery scores held in memory at once per candidate
+BLOCK_CELLS = 1 << 24
+
+
+def split_dataset(label_codes, test_fraction, seed=0):
+    """Hold out test_fraction of each person's images as queries (persons with one image stay in the gallery)"""
+    rng = np.random.default_rng(seed)
+    is_query = np.zeros(len(label_codes), dtype=bool)
+    for code in np.unique(label_codes):
+        members = np.flatnonzero(label_codes == code)
+        if len(members) < 2:
+            continue
+        n_queries = min(len(members) - 1, max(1, int(round(len(members) * test_fraction))))
+        is_query[rng.choice(members, n_queries, replace=False)] = True
+    return np.flatnonzero(~is_query), np.flatnonzero(is_query)
+
+
+def normalize_rows(features):
+    norms = np.linalg.norm(features, axis=1, keepdims=True)
+    return features / np.where(norms == 0, 1, norms)
+
+
+def evaluate_candidate(gallery_features, gallery_codes, query_features, query_codes, n_components,
+                       top_k_values, query_gallery_rows=None):
+    """Recall@k and per-person top-1 accuracy using the first n_components features.
+
+    query_gallery_rows[i] is the gallery row of query i itself (leave-one-out),
+    which is excluded from its ranking; None for a held-out split.
+    """
+    gallery = normalize_rows(np.ascontiguousarray(gallery_features[:, :n_components]))
+    queries = normalize_rows(np.ascontiguousarray(query_features[:, :n_components]))
+    max_k = max(top_k_values)
+    hits = {k: np.zeros(len(queries), dtype=bool) for k in top_k_values}
+
+    # Score blockwise so memory stays bounded by BLOCK_CELLS
+    block_size = max(1, BLOCK_CELLS // max(len(gallery), 1))
+    for start in range(0, len(queries), block_size):
+        stop = min(start + block_size, len(queries))
+        scores = queries[start:stop] @ gallery.T
+        if query_gallery_rows is not None:
+            scores[np.arange(stop - start), query_gallery_rows[start:stop]] = -np.inf
+        top = np.argpartition(-scores, max_k - 1, axis=1)[:, :max_k]
+        order = np.argsort(-np.take_along_axis(scores, top, axis=1), axis=1)
+        ranked = np.take_along_axis(top, order, axis=1)
+        same_person = gallery_codes[ranked] == query_codes[start:stop, None]
+        for k in top_k_values:
+            hits[k][start:stop] = same_person[:, :k].any(axis=1)
+
+    # Per-person top-1 accuracy, averaged over persons so large classes do not dominate
+    person_accuracy = [hits[1][query_codes == code].mean() for code in np.unique(query_codes)] if 1 in hits else []
+    return {
+        'recall': {k: float(hits[k].mean()) for k in top_k_values},
+        'person_accuracy_mean': float(np.mean(person_accuracy)) if person_accuracy else None,
+        'person_accuracy_min': float(np.min(person_accuracy)) if person_accuracy else None,
+    }
+
+
+def query_latency_ms(gallery_features, n_components, n_queries=50, top_k=5):
+    """Median single-query latency of a cosine scan plus top-k over the gallery"""
+    gallery = normalize_rows(np.ascontiguousarray(gallery_features[:, :n_components], dtype=np.float32))
+    rng = np.random.default_rng(0)
+    latencies = []
+    for row in rng.integers(0, len(gallery), n_queries):
+        query = gallery[row]
+        start_time = time.perf_counter()
+        scores = gallery @ query
+        np.argpartition(-scores, min(top_k, len(scores) - 1))[:top_k]
+        latencies.append(time.perf_counter() - start_time)
+    return float(np.median(latencies) * 1000)
+
+
+def sweep_components(dataset, label_codes, candidates, top_k_values=(1, 5, 10), test_fraction=0.2,
+                     leave_one_out=False, n_workers=None, seed=0, solver='auto'):
+    """Fit one PCA at the largest candidate and evaluate every candidate by truncation"""
+    candidates = sorted(set(candidates))
+    if leave_one_out:
+        fit_rows = query_rows = np.arange(len(dataset))
+    else:
+        fit_rows, query_rows = split_dataset(label_codes, test_fraction, seed)
+    if len(query_rows) == 0:
+        raise ValueError("No queries to evaluate: every person has a single image")
+
+    max_components = min(candidates[-1], len(fit_rows), dataset.shape[1])
+    candidates = [k for k in candidates if k <= max_components]
+    print(f"Fitting one PCA with {max_components} components on {len(fit_rows)} images...")
+    start_time = time.perf_counter()
+    scaler = StandardScaler()
+    scaled = scaler.fit_transform(dataset[fit_rows])
+    pca, gallery_features = pca_solvers.fit_pca(scaled, max_components, solver, random_state=seed)
+    del scaled
+    print(f"Fitted in {time.perf_counter() - start_time:.1f}s")
+
+    if leave_one_out:
+        query_features = gallery_features
+        query_gallery_rows = np.arange(len(fit_rows))
+    else:
+        query_features = pca.transform(scaler.transform(dataset[query_rows])).astype(np.float32)
+        query_gallery_rows = None
+    gallery_codes, query_codes = label_codes[fit_rows], label_codes[query_rows]
+    cumulative_variance = np.cumsum(pca.explained_variance_ratio_)
+
+    def evaluate(n_components):
+        row = evaluate_candidate(gallery_features, gallery_codes, query_features, query_codes, n_components,
+                                 top_k_values, query_gallery_rows)
+        row.update({
+            'n_components': n_components,
+            'explained_variance': float(cumulative_variance[n_components - 1]),
+            'latency_ms': query_latency_ms(gallery_features, n_components),
+            'feature_bytes': len(fit_rows) * n_components * 4,
+            'projection_bytes': dataset.shape[1] * n_components * 4,
+        })
+        return row
+
+    with ThreadPoolExecutor(max_workers=n_workers) as executor:
+        rows = list(executor.map(evaluate, candidates))
+    return {
+        'mode': 'leave_one_out' if leave_one_out else 'held_out',
+        'n_gallery': int(len(fit_rows)),
+        'n_queries': int(len(query_rows)),
+        'rows': rows,
+    }
+
+
+def cheapest_meeting(rows, target_recall, top_k):
+    """Row with the fewest components whose recall@top_k reaches target_recall, or None"""
+    for row in sorted(rows, key=lambda row: row['n_components']):
+        if row['recall'][top_k] >= target_recall:
+            return row
+    return None
+
+
+def print_table(result, top_k_values):
+    print(f"\n{result['mode']}: {result['n_queries']} queries against {result['n_gallery']} gallery images")
+    header = f"{'components':>10}{'variance':>10}" + ''.join(f"{'R@' + str(k):>8}" for k in top_k_values)
+    print(header + f"{'person acc':>12}{'ms/query':>10}{'features MB':>13}")
+    for row in result['rows']:
+        recalls = ''.join(f"{row['recall'][k]:>8.3f}" for k in top_k_values)
+        accuracy = row['person_accuracy_mean']
+        accuracy = f"{accuracy:>12.3f}" if accuracy is not None else f"{'-':>12}"
+        print(f"{row['n_components']:>10}{row['explained_variance']:>10.3f}{recalls}{accuracy}"
+              f"{row['latency_ms']:>10.3f}{row['feature_bytes'] / 1e6:>13.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Evaluate recall@k for many n_components with one PCA fit")
+    parser.add_argument("dataset_path", help="Dataset root with one subdirectory per person")
+    parser.add_argument("--components", type=int, nargs="+", default=[10, 20, 30, 50, 75, 100, 150, 200])
+    parser.add_argument("--top_k", type=int, nargs="+", default=[1, 5, 10])
+    parser.add_argument("--test_fraction", type=float, default=0.2,
+                        help="Fraction of each person's images held out as queries")
+    parser.add_argument("--leave_one_out", action="store_true",
+                        help="Query every image against all others instead of a held-out split")
+    parser.add_argument("--target_recall", type=float, default=None,
+                        help="Report the cheapest candidate whose recall@k (first --top_k) reaches this")
+    parser.add_argument("--image_width", type=int, default=128)
+    parser.add_argument("--image_height", type=int, default=128)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--cache_dir", default=DEFAULT_CACHE_DIR)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--solver", choices=pca_solvers.SOLVERS, default='auto', help="PCA solver for the fit")
+    parser.add_argument("--output", default=None, help="Write the results to this JSON file")
+    args = parser.parse_args()
+
+    processor = PCAProcessor(image_size=(args.image_width, args.image_height), n_workers=args.workers,
+                             cache_dir=args.cache_dir)
+    processor.load_dataset(args.dataset_path)
+    label_codes, _ = feature_store.encode_labels(processor.dataset_labels)
+
+    top_k_values = sorted(set(args.top_k))
+    result = sweep_components(processor.dataset, np.asarray(label_codes), args.components, top_k_values,
+                              test_fraction=args.test_fraction, leave_one_out=args.leave_one_out,
+                              n_workers=args.workers, seed=args.seed, solver=args.solver)
+    print_table(result, top_k_values)
+
+    if args.target_recall is not None:
+        k = args.top_k[0]
+        best = cheapest_meeting(result['rows'], args.target_recall, k)
+        if best is None:
+            print(f"\nNo candidate reaches recall@{k} >= {args.target_recall}")
+        else:
+            print(f"\nCheapest candidate with recall@{k} >= {args.target_recall}: "
+                  f"n_components={best['n_components']} (train with --n_components {best['n_components']})")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2)
+        print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
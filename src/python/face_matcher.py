@@ -1,43 +1,304 @@
 import numpy as np
-from sklearn.metrics.pairwise import cosine_similarity, euclidean_distances
 import os
+from metrics import metrics
+
+class LabelGroups:
+    """Images grouped by person: scores[order] lists each person's images contiguously"""
+
+    def __init__(self, label_codes):
+        self.label_codes = np.asarray(label_codes)
+        # Galleries loaded per person directory are already sorted, so order is usually None
+        self.order = np.argsort(self.label_codes, kind='stable')
+        if np.array_equal(self.order, np.arange(len(self.order))):
+            self.order = None
+        sorted_codes = self.label_codes if self.order is None else self.label_codes[self.order]
+        boundaries = sorted_codes[1:] != sorted_codes[:-1]
+        self.group_starts = np.flatnonzero(np.r_[len(sorted_codes) > 0, boundaries])
+        self.group_ends = np.r_[self.group_starts[1:], len(sorted_codes)].astype(np.intp)
+
+class GalleryIndex:
+    """Search-ready copies of the gallery features, built once per model.
+
+    feature_dtype 'float16' or 'int8' (per-row scaled) stores the scored matrix in
+    reduced precision; it is dequantized block by block while scoring.
+    """
+    # Rows dequantized at a time when scoring reduced-precision features
+    score_block_rows = 65536
+
+    def __init__(self, features, metric='cosine', feature_dtype='float32', normalized=None, sq_norms=None):
+        self.source = features
+        features = np.asarray(features, dtype=np.float32)
+
+        # Squared norms feed the Euclidean expansion ||g||^2 - 2 g.q + ||q||^2
+        if sq_norms is None:
+            sq_norms = np.einsum('ij,ij->i', features, features)
+        self.sq_norms = np.asarray(sq_norms, dtype=np.float32)
+
+        # Unit-length rows turn cosine similarity into one matrix-vector product
+        if metric == 'cosine':
+            if normalized is None:
+                normalized = features / safe_norms(np.sqrt(self.sq_norms))[:, None]
+            matrix = np.asarray(normalized, dtype=np.float32)
+        else:
+            matrix = features
+
+        self.row_scales = None
+        if feature_dtype == 'float32':
+            self.matrix = matrix
+        elif feature_dtype == 'float16':
+            self.matrix = matrix.astype(np.float16)
+        elif feature_dtype == 'int8':
+            self.row_scales = (safe_norms(np.abs(matrix).max(axis=1)) / 127).astype(np.float32)
+            self.matrix = np.rint(matrix / self.row_scales[:, None]).astype(np.int8)
+        else:
+            raise ValueError(f"Unsupported feature_dtype: {feature_dtype}")
+
+    def __len__(self):
+        return len(self.matrix)
+
+    def dot(self, queries, rows=None):
+        """Inner products of float32 queries with all gallery rows, or only the given rows"""
+        matrix = self.matrix if rows is None else self.matrix[rows]
+        if matrix.dtype == np.float32:
+            return queries @ matrix.T
+
+        products = np.empty((len(queries), len(matrix)), dtype=np.float32)
+        for start in range(0, len(matrix), self.score_block_rows):
+            block = matrix[start:start + self.score_block_rows].astype(np.float32)
+            products[:, start:start + len(block)] = queries @ block.T
+        if self.row_scales is not None:
+            products *= self.row_scales if rows is None else self.row_scales[rows]
+        return products
+
+class PersonIndex:
+    """Per-person centroids of the live gallery rows, the coarse stage of prefiltered search.
+
+    Cosine centroids are the normalized mean of the unit-length rows. Persons
+    whose images were all removed never become candidates.
+    """
+    # Gallery rows summed at a time while building the centroids
+    build_block_rows = 65536
+
+    def __init__(self, snapshot, groups, metric='cosine'):
+        self.metric = metric
+        self.groups = groups
+        n_persons = len(groups.group_starts)
+        # LabelGroups numbers persons in sorted code order, as np.unique does
+        _, person_of_row = np.unique(snapshot.label_codes, return_inverse=True)
+        live = np.ones(len(snapshot), dtype=bool)
+        live[snapshot.removed] = False
+
+        sums = np.zeros((n_persons, snapshot.main_features.shape[1]), dtype=np.float64)
+        parts = [(0, snapshot.main_normalized if metric == 'cosine' and snapshot.main_normalized is not None
+                  else snapshot.main_features), (snapshot.n_main, snapshot.segment_features)]
+        for offset, features in parts:
+            for start in range(0, len(features), self.build_block_rows):
+                block = np.asarray(features[start:start + self.build_block_rows], dtype=np.float32)
+                if metric == 'cosine':
+                    block = block / safe_norms(np.linalg.norm(block, axis=1))[:, None]
+                rows = np.arange(offset + start, offset + start + len(block))
+                keep = live[rows]
+                persons = person_of_row[rows[keep]]
+                order = np.argsort(persons, kind='stable')
+                persons = persons[order]
+                if len(persons):
+                    starts = np.flatnonzero(np.r_[True, persons[1:] != persons[:-1]])
+                    sums[persons[starts]] += np.add.reduceat(block[keep][order], starts)
+
+        counts = np.bincount(person_of_row[live], minlength=n_persons)
+        self.empty = counts == 0
+        centroids = sums / np.maximum(counts, 1)[:, None]
+        if metric == 'cosine':
+            centroids /= safe_norms(np.linalg.norm(centroids, axis=1))[:, None]
+        self.centroids = centroids.astype(np.float32)
+        self.sq_norms = np.einsum('ij,ij->i', self.centroids, self.centroids)
+
+    def __len__(self):
+        return len(self.centroids)
+
+    def candidate_rows(self, query, n_persons):
+        """Sorted gallery rows of the n_persons persons whose centroids best match the query"""
+        query = np.asarray(query, dtype=np.float32).ravel()
+        if self.metric == 'cosine':
+            scores = self.centroids @ (query / safe_norms(np.linalg.norm(query)))
+            scores[self.empty] = -np.inf
+            persons = top_k_indices(scores, n_persons, largest=True)
+        else:
+            scores = self.sq_norms - 2 * (self.centroids @ query)
+            scores[self.empty] = np.inf
+            persons = top_k_indices(scores, n_persons, largest=False)
+
+        groups = self.groups
+        spans = [np.arange(groups.group_starts[p], groups.group_ends[p]) for p in persons]
+        positions = np.concatenate(spans) if spans else np.empty(0, dtype=np.intp)
+        rows = positions if groups.order is None else groups.order[positions]
+        return np.sort(rows)
+
+class SearchState:
+    """Search indexes for one gallery snapshot: the main store plus the enrollment segment"""
+
+    def __init__(self, snapshot, main, segment):
+        self.snapshot = snapshot
+        self.main = main
+        self.segment = segment
+        self.groups = LabelGroups(snapshot.label_codes)
+        self.persons = None  # PersonIndex, built on first use by prefiltered search
+
+    def __len__(self):
+        return len(self.snapshot)
+
+def safe_norms(norms):
+    """Replace zero norms by 1 so zero vectors normalize to zero (as sklearn does)"""
+    return np.where(norms == 0, 1, norms)
+
+def top_k_indices(scores, top_k, largest=True):
+    """Indices of the top_k best scores, best first, without sorting all of them"""
+    top_k = min(top_k, len(scores))
+    if top_k <= 0:
+        return np.empty(0, dtype=np.intp)
+
+    if largest:
+        candidates = np.argpartition(scores, len(scores) - top_k)[len(scores) - top_k:]
+        return candidates[np.argsort(-scores[candidates], kind='stable')]
+    candidates = np.argpartition(scores, top_k - 1)[:top_k]
+    return candidates[np.argsort(scores[candidates], kind='stable')]
 
 class FaceMatcher:
-    def __init__(self, pca_processor, similarity_metric='cosine'):
+    # Upper bound on query-by-gallery scores held in memory at once by batch matching
+    batch_score_cells = 1 << 24
+    # Candidate persons re-ranked exactly by search_mode='prefilter' when nprobe is not given
+    prefilter_persons = 32
+
+    def __init__(self, pca_processor, similarity_metric='cosine', feature_dtype='float32'):
         self.pca_processor = pca_processor
         self.similarity_metric = similarity_metric
+        self.feature_dtype = feature_dtype  # 'float32', 'float16' or 'int8' gallery features
+        self._state = None
 
-    def match_face(self, input_image, top_k=5):
+    def match_face(self, input_image, top_k=5, search_mode='exact', nprobe=None):
         """Find the closest matching faces for the input image"""
         # Preprocess and transform the input image
         input_pca = self.pca_processor.transform(input_image)
         
-        # Get dataset features and labels
-        dataset_features, dataset_labels, image_paths = self.pca_processor.get_dataset_features()
-        
-        # Find closest matches
-        matches = self._find_closest_matches(input_pca, dataset_features, dataset_labels, image_paths, top_k)
+        return self.match_features(input_pca, top_k=top_k, match_type='all',
+                                   search_mode=search_mode, nprobe=nprobe)[0]
+
+    def _get_state(self):
+        """Return search indexes for the current gallery snapshot, rebuilding what changed"""
+        snapshot = self.pca_processor.get_gallery()
+        state = self._state
+        if state is not None and state.snapshot is snapshot:
+            return state
         
-        return matches
+        # Enrollments only touch the small segment; the main index is reused
+        if state is not None and state.snapshot.main_features is snapshot.main_features:
+            main = state.main
+        else:
+            main = self._build_index(snapshot.main_features, snapshot.main_normalized, snapshot.main_sq_norms)
+        segment = None
+        if len(snapshot.segment_features):
+            segment = self._build_index(snapshot.segment_features)
+        self._state = SearchState(snapshot, main, segment)
+        return self._state
 
-    def _find_closest_matches(self, input_pca, dataset_features, dataset_labels, image_paths, top_k=5):
-        """Find and return the closest matching images from the dataset"""
+    def warm_up(self):
+        """Build the search indexes now instead of on the first query"""
+        self._person_index(self._get_state())
+
+    def person_index(self):
+        """The per-person centroid index of the current gallery, built if needed"""
+        return self._person_index(self._get_state())
+
+    def _person_index(self, state):
+        if state.persons is None:
+            state.persons = PersonIndex(state.snapshot, state.groups, self.similarity_metric)
+        return state.persons
+
+    def indexes(self):
+        """The search structures currently built for the gallery (for memory accounting)"""
+        state = self._state
+        if state is None:
+            return []
+        return [part for part in (state.main, state.segment, state.groups, state.persons) if part is not None]
+
+    def _build_index(self, features, normalized=None, sq_norms=None):
+        return GalleryIndex(features, metric=self.similarity_metric, feature_dtype=self.feature_dtype,
+                            normalized=normalized, sq_norms=sq_norms)
+
+    def _score_batch(self, queries, state, rows=None):
+        """Score a (n_queries, n_components) block against the gallery, or only its given rows.
+        
+        rows must list main-store indices before segment indices. Removed entries get the worst score.
+        """
+        queries = np.asarray(queries, dtype=np.float32)
         if self.similarity_metric == 'cosine':
-            # Calculate cosine similarity
-            similarities = cosine_similarity(input_pca, dataset_features)[0]
-            # Higher similarity is better for cosine
-            closest_indices = np.argsort(similarities)[::-1][:top_k]
-            scores = similarities[closest_indices]
+            queries = queries / safe_norms(np.linalg.norm(queries, axis=1))[:, None]
+        
+        n_main = state.snapshot.n_main
+        if rows is None:
+            main_rows = segment_rows = None
         else:
-            # Calculate Euclidean distance
-            distances = euclidean_distances(input_pca, dataset_features)[0]
-            # Lower distance is better for Euclidean
-            closest_indices = np.argsort(distances)[:top_k]
-            scores = distances[closest_indices]
+            split = np.searchsorted(rows, n_main) if len(rows) and rows[-1] >= n_main else len(rows)
+            main_rows, segment_rows = rows[:split], rows[split:] - n_main
         
-        # Prepare results
+        scores = self._score_part(queries, state.main, main_rows)
+        if state.segment is not None and (segment_rows is None or len(segment_rows)):
+            scores = np.hstack([scores, self._score_part(queries, state.segment, segment_rows)])
+        
+        removed = state.snapshot.removed
+        if rows is None and len(removed):
+            scores[:, removed] = -np.inf if self.similarity_metric == 'cosine' else np.inf
+        return scores
+
+    def _score_part(self, queries, gallery, rows=None):
+        """Score prepared queries against one GalleryIndex (similarity or squared distance)"""
+        if self.similarity_metric == 'cosine':
+            return gallery.dot(queries, rows)
+        
+        sq_norms = gallery.sq_norms if rows is None else gallery.sq_norms[rows]
+        # Squared distances rank like distances; clip rounding noise below zero
+        sq_distances = gallery.dot(queries, rows)
+        sq_distances *= -2
+        sq_distances += sq_norms
+        sq_distances += np.einsum('ij,ij->i', queries, queries)[:, None]
+        return np.maximum(sq_distances, 0, out=sq_distances)
+
+    def _ann_candidates(self, query, state, nprobe, shortlist):
+        """Return ANN candidate indices for one query and their exact scores.
+        
+        The index covers the snapshot's main store; enrolled segment entries are always scored.
+        """
+        index = state.snapshot.ann_index
+        if index is None:
+            raise ValueError("No ANN index loaded for this model. Use search_mode='exact'.")
+        if index.metric != self.similarity_metric:
+            raise ValueError(f"ANN index was built for {index.metric}, not {self.similarity_metric}")
+        
+        candidates = np.sort(np.asarray(index.search(query, nprobe=nprobe, shortlist=shortlist), dtype=np.intp))
+        snapshot = state.snapshot
+        if len(snapshot.segment_features):
+            candidates = np.concatenate([candidates, np.arange(snapshot.n_main, len(snapshot))])
+        if len(snapshot.removed):
+            candidates = candidates[~np.isin(candidates, snapshot.removed)]
+        return candidates, self._score_batch(query.reshape(1, -1), state, rows=candidates)[0]
+
+    def _prefilter_candidates(self, query, state, n_persons):
+        """Return the images of the best-matching persons by centroid and their exact scores"""
+        candidates = self._person_index(state).candidate_rows(query, n_persons)
+        if len(state.snapshot.removed):
+            candidates = candidates[~np.isin(candidates, state.snapshot.removed)]
+        return candidates, self._score_batch(query.reshape(1, -1), state, rows=candidates)[0]
+
+    def _final_scores(self, scores, indices):
+        """Convert internal scores of the selected indices into reported scores"""
+        if self.similarity_metric == 'cosine':
+            return scores[indices]
+        return np.sqrt(scores[indices])
+
+    def _build_matches(self, indices, scores, dataset_labels, image_paths):
+        """Build ranked result dicts for the selected gallery indices"""
         matches = []
-        for i, idx in enumerate(closest_indices):
+        for i, idx in enumerate(indices):
             match = {
                 'person': dataset_labels[idx],
                 'score': float(scores[i]),
@@ -49,57 +310,138 @@ class FaceMatcher:
         
         return matches
 
-    def get_person_matches(self, input_image, top_k=5):
+    def _person_best_indices(self, scores, groups, top_k):
+        """Indices of the best image of each of the top_k best persons"""
+        largest = self.similarity_metric == 'cosine'
+        if len(scores) == 0:
+            return np.empty(0, dtype=np.intp)
+        
+        # Best score per person with one vectorized reduction over label-sorted scores
+        sorted_scores = scores if groups.order is None else scores[groups.order]
+        reduce = np.maximum if largest else np.minimum
+        person_scores = reduce.reduceat(sorted_scores, groups.group_starts)
+        
+        # Only the winning persons need their best image located
+        indices = []
+        for group in top_k_indices(person_scores, top_k, largest=largest):
+            start, end = groups.group_starts[group], groups.group_ends[group]
+            group_scores = sorted_scores[start:end]
+            offset = start + (np.argmax(group_scores) if largest else np.argmin(group_scores))
+            indices.append(offset if groups.order is None else groups.order[offset])
+        return np.asarray(indices, dtype=np.intp)
+
+    def _diverse_indices(self, scores, groups, top_k, max_per_person):
+        """Gallery indices of the best matches, keeping at most max_per_person per person"""
+        largest = self.similarity_metric == 'cosine'
+        # The greedy pick only depends on a prefix of the ranking, so rank a bounded
+        # candidate set and widen it only if too many candidates were skipped
+        n_candidates = max(top_k * max(max_per_person, 1), top_k)
+        while True:
+            candidates = top_k_indices(scores, n_candidates, largest=largest)
+            person_counts = {}
+            selected = []
+            for idx in candidates:
+                code = groups.label_codes[idx]
+                if person_counts.get(code, 0) < max_per_person:
+                    selected.append(idx)
+                    person_counts[code] = person_counts.get(code, 0) + 1
+                    if len(selected) >= top_k:
+                        break
+            if len(selected) >= top_k or len(candidates) >= len(scores):
+                return np.asarray(selected, dtype=np.intp)
+            n_candidates *= 4
+
+    def _select_indices(self, scores, groups, match_type, top_k, max_per_person):
+        """Pick result indices from one query's scores according to match_type"""
+        if match_type == 'person':
+            return self._person_best_indices(scores, groups, top_k)
+        if match_type == 'diverse':
+            return self._diverse_indices(scores, groups, top_k, max_per_person)
+        return top_k_indices(scores, top_k, largest=(self.similarity_metric == 'cosine'))
+
+    def match_features(self, query_features, top_k=5, match_type='person', max_per_person=2,
+                       search_mode='exact', nprobe=None):
+        """Match already projected queries (one row each) and return one match list per query.
+        
+        search_mode='ann' scans only the inverted lists picked by the model's ANN index;
+        search_mode='prefilter' scores per-person centroids first and re-ranks only the
+        images of the best nprobe persons. In both, nprobe trades recall for speed.
+        """
+        selections = [(top_k, match_type, max_per_person)] * len(query_features)
+        return self._match(query_features, selections, search_mode, nprobe)
+
+    def match_features_each(self, query_features, params, search_mode='exact', nprobe=None):
+        """Match projected queries that each have their own top_k, match_type and max_per_person.
+        
+        params holds one dict of those options per query (missing ones take the
+        match_features defaults). Exact queries are still scored together, one
+        GEMM per chunk, and each query's own selection is applied to its row.
+        """
+        selections = [(options.get('top_k', 5), options.get('match_type', 'person'),
+                       options.get('max_per_person', 2)) for options in params]
+        return self._match(query_features, selections, search_mode, nprobe)
+
+    def _match(self, query_features, selections, search_mode, nprobe):
+        """match_features with one (top_k, match_type, max_per_person) selection per query"""
+        state = self._get_state()
+        dataset_labels, image_paths = state.snapshot.labels, state.snapshot.image_paths
+        query_features = np.asarray(query_features).reshape(len(query_features), -1)
+        
+        if search_mode in ('ann', 'prefilter'):
+            results = []
+            for query, (top_k, match_type, max_per_person) in zip(query_features, selections):
+                shortlist = max(64, 16 * top_k * (max_per_person if match_type == 'diverse' else 1))
+                n_persons = max(nprobe or self.prefilter_persons, top_k)
+                # Select among the candidates only, then map back to gallery indices
+                with metrics.stage(f'{search_mode}_search'):
+                    if search_mode == 'ann':
+                        candidates, scores = self._ann_candidates(query, state, nprobe, shortlist)
+                    else:
+                        candidates, scores = self._prefilter_candidates(query, state, n_persons)
+                with metrics.stage('selection'):
+                    groups = LabelGroups(state.snapshot.label_codes[candidates])
+                    local = self._select_indices(scores, groups, match_type, top_k, max_per_person)
+                with metrics.stage('build_matches'):
+                    results.append(self._build_matches(candidates[local], self._final_scores(scores, local),
+                                                       dataset_labels, image_paths))
+            return results
+        if search_mode != 'exact':
+            raise ValueError(f"Unknown search_mode: {search_mode}")
+        
+        # Score queries in chunks so the score matrix stays within batch_score_cells
+        chunk_size = max(1, self.batch_score_cells // max(len(state), 1))
+        results = []
+        for start in range(0, len(query_features), chunk_size):
+            with metrics.stage('scoring'):
+                chunk_scores = self._score_batch(query_features[start:start + chunk_size], state)
+            for scores, (top_k, match_type, max_per_person) in zip(chunk_scores,
+                                                                     selections[start:start + chunk_size]):
+                with metrics.stage('selection'):
+                    indices = self._select_indices(scores, state.groups, match_type, top_k, max_per_person)
+                    # Drop removed entries that only filled up a short result list
+                    indices = indices[np.isfinite(scores[indices])]
+                with metrics.stage('build_matches'):
+                    results.append(self._build_matches(indices, self._final_scores(scores, indices),
+                                                       dataset_labels, image_paths))
+        return results
+
+    def match_batch(self, input_images, top_k=5, match_type='person', max_per_person=2,
+                    search_mode='exact', nprobe=None):
+        """Match many images with one projection and chunked query-by-gallery scoring"""
+        input_pca = self.pca_processor.transform_batch(input_images)
+        return self.match_features(input_pca, top_k=top_k, match_type=match_type,
+                                   max_per_person=max_per_person, search_mode=search_mode,
+                                   nprobe=nprobe)
+
+    def get_person_matches(self, input_image, top_k=5, search_mode='exact', nprobe=None):
         """Get matches grouped by person (best match per person)"""
-        # Get ALL matches first
-        all_matches = self.match_face(input_image, top_k=len(self.pca_processor.dataset_labels))
-        
-        # Group by person and take best match for each
-        person_matches = {}
-        for match in all_matches:
-            person = match['person']
-            # For cosine similarity, higher is better; for euclidean, lower is better
-            if self.similarity_metric == 'cosine':
-                if person not in person_matches or match['score'] > person_matches[person]['score']:
-                    person_matches[person] = match
-            else:
-                if person not in person_matches or match['score'] < person_matches[person]['score']:
-                    person_matches[person] = match
-        
-        # Sort by score and return top_k
-        sorted_matches = sorted(person_matches.values(), 
-                              key=lambda x: x['score'], 
-                              reverse=(self.similarity_metric == 'cosine'))
-        
-        # Re-rank the results
-        for i, match in enumerate(sorted_matches):
-            match['rank'] = i + 1
-        
-        return sorted_matches[:top_k]
+        input_pca = self.pca_processor.transform(input_image)
+        return self.match_features(input_pca, top_k=top_k, match_type='person',
+                                   search_mode=search_mode, nprobe=nprobe)[0]
     
-    def get_diverse_matches(self, input_image, top_k=5, max_per_person=2):
+    def get_diverse_matches(self, input_image, top_k=5, max_per_person=2, search_mode='exact', nprobe=None):
         """Get diverse matches with limited results per person"""
-        # Get ALL matches first
-        all_matches = self.match_face(input_image, top_k=len(self.pca_processor.dataset_labels))
-        
-        # Group by person and limit matches per person
-        person_counts = {}
-        diverse_matches = []
-        
-        for match in all_matches:
-            person = match['person']
-            if person not in person_counts:
-                person_counts[person] = 0
-            
-            if person_counts[person] < max_per_person:
-                diverse_matches.append(match)
-                person_counts[person] += 1
-                
-                if len(diverse_matches) >= top_k:
-                    break
-        
-        # Re-rank the results
-        for i, match in enumerate(diverse_matches):
-            match['rank'] = i + 1
-        
-        return diverse_matches
\ No newline at end of file
+        input_pca = self.pca_processor.transform(input_image)
+        return self.match_features(input_pca, top_k=top_k, match_type='diverse',
+                                   max_per_person=max_per_person, search_mode=search_mode,
+                                   nprobe=nprobe)[0]
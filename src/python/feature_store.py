@@ -0,0 +1,196 @@
+import os
+import json
+from collections.abc import Sequence
+import numpy as np
+from sklearn.decomposition import PCA
+from sklearn.preprocessing import StandardScaler
+
+# Bump when the on-disk layout changes; load_store refuses newer versions
+FORMAT_VERSION = 1
+METADATA_FILE = 'model_metadata.json'
+LABELS_FILE = 'labels.json'
+
+# Arrays stored as raw .npy files and opened memory-mapped
+SCALER_ARRAYS = ('mean', 'scale', 'var')
+PCA_ARRAYS = ('mean', 'components', 'explained_variance', 'explained_variance_ratio', 'singular_values')
+
+
+class LabelSequence(Sequence):
+    """Read-only list of person names backed by integer codes and a string table"""
+
+    def __init__(self, codes, names):
+        self.codes = codes
+        self.names = names
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self.names[code] for code in self.codes[index]]
+        return self.names[self.codes[index]]
+
+
+class StringTable(Sequence):
+    """Read-only list of strings stored as one UTF-8 blob plus row offsets"""
+
+    def __init__(self, blob, offsets):
+        self.blob = blob
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("string table index out of range")
+        return bytes(self.blob[self.offsets[index]:self.offsets[index + 1]]).decode('utf-8')
+
+
+def encode_labels(labels):
+    """Encode person names as (int32 codes, sorted list of unique names)"""
+    names, codes = np.unique(np.asarray(list(labels), dtype=object), return_inverse=True)
+    return codes.astype(np.int32), [str(name) for name in names]
+
+
+def has_store(model_dir):
+    """Return True if model_dir holds a model in the memory-mapped format"""
+    return 'format_version' in _read_metadata(model_dir)
+
+
+def model_exists(model_dir):
+    """Return True if model_dir holds a model in either the current or the pickle format"""
+    return has_store(model_dir) or os.path.exists(os.path.join(model_dir, 'pca_model.pkl'))
+
+
+def save_store(model_dir, scaler, pca, features, label_codes, label_names, image_paths, metadata):
+    """Write projection arrays, gallery features and label tables as raw .npy files"""
+    os.makedirs(model_dir, exist_ok=True)
+
+    for name in SCALER_ARRAYS:
+        _save_array(model_dir, f'scaler_{name}', getattr(scaler, f'{name}_'))
+    for name in PCA_ARRAYS:
+        _save_array(model_dir, f'pca_{name}', getattr(pca, f'{name}_'))
+
+    features = np.asarray(features, dtype=np.float32)
+    _save_array(model_dir, 'features', features)
+
+    # Search-ready arrays, so matchers in every worker share them instead of rebuilding
+    sq_norms = np.einsum('ij,ij->i', features, features)
+    norms = np.sqrt(sq_norms)
+    _save_array(model_dir, 'sq_norms', sq_norms)
+    _save_array(model_dir, 'features_normalized', features / np.where(norms == 0, 1, norms)[:, None])
+    _save_array(model_dir, 'label_codes', np.asarray(label_codes, dtype=np.int32))
+
+    encoded_paths = [path.encode('utf-8') for path in image_paths]
+    offsets = np.zeros(len(encoded_paths) + 1, dtype=np.int64)
+    np.cumsum([len(path) for path in encoded_paths], out=offsets[1:])
+    _save_array(model_dir, 'image_paths_offsets', offsets)
+    _save_array(model_dir, 'image_paths', np.frombuffer(b''.join(encoded_paths), dtype=np.uint8))
+
+    _write_json(model_dir, LABELS_FILE, label_names)
+
+    header = dict(metadata)
+    header.update({
+        'format_version': FORMAT_VERSION,
+        'n_samples_seen': int(np.max(scaler.n_samples_seen_)),
+        'pca_noise_variance': float(pca.noise_variance_),
+        'pca_whiten': bool(getattr(pca, 'whiten', False)),
+    })
+    # Written last: a complete header marks a complete store for watchers and readers
+    _write_json(model_dir, METADATA_FILE, header, indent=2)
+
+
+def load_store(model_dir):
+    """Open a saved model memory-mapped and return its components as a dict"""
+    header = _read_metadata(model_dir)
+    version = header.get('format_version')
+    if version is None:
+        raise ValueError(f"No memory-mapped model found in {model_dir}/")
+    if version > FORMAT_VERSION:
+        raise ValueError(f"Model format version {version} is newer than supported version {FORMAT_VERSION}")
+
+    scaler_arrays = {name: _load_array(model_dir, f'scaler_{name}') for name in SCALER_ARRAYS}
+    pca_arrays = {name: _load_array(model_dir, f'pca_{name}') for name in PCA_ARRAYS}
+
+    with open(os.path.join(model_dir, LABELS_FILE)) as f:
+        label_names = json.load(f)
+    label_codes = _load_array(model_dir, 'label_codes')
+    image_paths = StringTable(_load_array(model_dir, 'image_paths'),
+                              _load_array(model_dir, 'image_paths_offsets'))
+
+    return {
+        'header': header,
+        'scaler': _restore_scaler(scaler_arrays, header['n_samples_seen']),
+        'pca': _restore_pca(pca_arrays, header),
+        'features': _load_array(model_dir, 'features'),
+        'features_normalized': _load_optional_array(model_dir, 'features_normalized'),
+        'sq_norms': _load_optional_array(model_dir, 'sq_norms'),
+        'label_codes': label_codes,
+        'label_names': label_names,
+        'dataset_labels': LabelSequence(label_codes, label_names),
+        'dataset_image_paths': image_paths,
+    }
+
+
+def _restore_scaler(arrays, n_samples_seen):
+    """Rebuild a fitted StandardScaler from its arrays"""
+    scaler = StandardScaler()
+    scaler.mean_ = arrays['mean']
+    scaler.scale_ = arrays['scale']
+    scaler.var_ = arrays['var']
+    scaler.n_features_in_ = len(arrays['mean'])
+    scaler.n_samples_seen_ = n_samples_seen
+    return scaler
+
+
+def _restore_pca(arrays, header):
+    """Rebuild a fitted PCA from its arrays (IncrementalPCA models load as PCA)"""
+    pca = PCA(n_components=len(arrays['components']), whiten=header['pca_whiten'])
+    pca.mean_ = arrays['mean']
+    pca.components_ = arrays['components']
+    pca.explained_variance_ = arrays['explained_variance']
+    pca.explained_variance_ratio_ = arrays['explained_variance_ratio']
+    pca.singular_values_ = arrays['singular_values']
+    pca.noise_variance_ = header['pca_noise_variance']
+    pca.n_components_ = len(arrays['components'])
+    pca.n_features_in_ = arrays['components'].shape[1]
+    pca.n_samples_ = header['n_samples_seen']
+    return pca
+
+
+def _save_array(model_dir, name, array):
+    # Write then rename, so processes that memory-mapped the previous file keep a valid mapping
+    path = os.path.join(model_dir, f'{name}.npy')
+    with open(path + '.tmp', 'wb') as f:
+        np.save(f, np.ascontiguousarray(array))
+    os.replace(path + '.tmp', path)
+
+
+def _write_json(model_dir, name, value, indent=None):
+    path = os.path.join(model_dir, name)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(value, f, indent=indent)
+    os.replace(path + '.tmp', path)
+
+
+def _load_array(model_dir, name):
+    return np.load(os.path.join(model_dir, f'{name}.npy'), mmap_mode='r')
+
+
+def _load_optional_array(model_dir, name):
+    if not os.path.exists(os.path.join(model_dir, f'{name}.npy')):
+        return None
+    return _load_array(model_dir, name)
+
+
+def _read_metadata(model_dir):
+    metadata_path = os.path.join(model_dir, METADATA_FILE)
+    if not os.path.exists(metadata_path):
+        return {}
+    with open(metadata_path) as f:
+        return json.load(f)
@@ -0,0 +1,86 @@
+import os
+import json
+import threading
+import numpy as np
+
+DATA_FILE = 'images.u8'
+INDEX_FILE = 'index.json'
+# Bumped whenever preprocessing changes the pixels it produces, so stale caches are not reused
+PIXELS_VERSION = 2
+
+
+class PreprocessedImageCache:
+    """Persistent cache of preprocessed grayscale images for fast retraining.
+
+    Pixels live in one append-only uint8 file read through np.memmap, one row per
+    image. The index maps each image path to its row plus the file's mtime and
+    size, so changed files miss and are decoded again. Each image_size (and
+    preprocessing version) gets its own subdirectory. Rows of modified files
+    are not reclaimed; delete the cache directory to compact it.
+    """
+
+    def __init__(self, cache_dir, image_size):
+        self.cache_dir = os.path.join(cache_dir, f"{image_size[0]}x{image_size[1]}_v{PIXELS_VERSION}")
+        self.row_size = image_size[0] * image_size[1]
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+        self._index = {}
+        index_path = os.path.join(self.cache_dir, INDEX_FILE)
+        if os.path.exists(index_path):
+            with open(index_path) as f:
+                self._index = json.load(f)
+
+        # Rows appended since the last flush are only readable after reopening the memmap
+        self._data_path = os.path.join(self.cache_dir, DATA_FILE)
+        self._writer = open(self._data_path, 'ab')
+        self._n_rows = os.path.getsize(self._data_path) // self.row_size
+        # Drop a partial row from an interrupted append so new rows start on a row boundary
+        self._writer.truncate(self._n_rows * self.row_size)
+        self._pixels = None
+        self._open_pixels()
+
+    def get(self, image_path):
+        """Return the cached uint8 pixels of an unchanged file, or None"""
+        entry = self._index.get(image_path)
+        if entry is not None and self._pixels is not None and entry[0] < len(self._pixels):
+            row, mtime_ns, size = entry
+            stat = os.stat(image_path)
+            if stat.st_mtime_ns == mtime_ns and stat.st_size == size:
+                with self._lock:
+                    self.hits += 1
+                return self._pixels[row]
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def add(self, image_path, pixels):
+        """Append freshly preprocessed uint8 pixels for image_path"""
+        stat = os.stat(image_path)
+        data = np.ascontiguousarray(pixels, dtype=np.uint8).tobytes()
+        with self._lock:
+            self._writer.write(data)
+            self._index[image_path] = [self._n_rows, stat.st_mtime_ns, stat.st_size]
+            self._n_rows += 1
+
+    def flush(self):
+        """Persist new rows and the index, and make new rows readable"""
+        with self._lock:
+            self._writer.flush()
+            index_path = os.path.join(self.cache_dir, INDEX_FILE)
+            with open(index_path + '.tmp', 'w') as f:
+                json.dump(self._index, f)
+            os.replace(index_path + '.tmp', index_path)
+            self._open_pixels()
+        print(f"Image cache: {self.hits} hits, {self.misses} decoded")
+
+    def close(self):
+        self.flush()
+        self._writer.close()
+
+    def _open_pixels(self):
+        if self._n_rows:
+            self._pixels = np.memmap(self._data_path, dtype=np.uint8, mode='r',
+                                     shape=(self._n_rows, self.row_size))
@@ -0,0 +1,224 @@
+import os
+import time
+import heapq
+import random
+import cProfile
+import threading
+from bisect import bisect_left
+
+# Latency buckets in seconds, from 100 microseconds to 10 seconds
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus sense"""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # Last slot is the +Inf bucket
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        bucket = bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[bucket] += 1
+            self.sum += value
+            self.count += 1
+
+    def snapshot(self):
+        with self._lock:
+            return list(self.counts), self.sum, self.count
+
+
+class _Stage:
+    """Context manager that records the time spent in a block into a stage histogram"""
+
+    __slots__ = ('histogram', 'start_time')
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start_time = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.start_time)
+        return False
+
+
+class _NoStage:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NO_STAGE = _NoStage()
+
+
+class MetricsRegistry:
+    """Process-wide counters, gauges and histograms rendered as Prometheus text.
+
+    Metrics are keyed by name plus a tuple of (label, value) pairs. Gauges can
+    be callables, evaluated when the metrics are rendered.
+    """
+
+    def __init__(self, namespace='eigenmatch', enabled=True):
+        self.namespace = namespace
+        self.enabled = enabled
+        self._help = {}
+        self._counters = {}
+        self._gauges = {}
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def describe(self, name, help_text):
+        self._help[name] = help_text
+
+    def inc(self, name, amount=1, **labels):
+        """Increment a counter"""
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def set_gauge(self, name, value, **labels):
+        """Set a gauge to a number, or to a callable returning one"""
+        with self._lock:
+            self._gauges[(name, tuple(sorted(labels.items())))] = value
+
+    def remove_gauge(self, name, **labels):
+        """Stop exporting a gauge (e.g. for a model that was unloaded)"""
+        with self._lock:
+            self._gauges.pop((name, tuple(sorted(labels.items()))), None)
+
+    def histogram(self, name, buckets=DEFAULT_BUCKETS, **labels):
+        """Return the histogram for name and labels, creating it on first use"""
+        key = (name, tuple(sorted(labels.items())))
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            with self._lock:
+                histogram = self._histograms.setdefault(key, Histogram(buckets))
+        return histogram
+
+    def observe(self, name, value, buckets=DEFAULT_BUCKETS, **labels):
+        if self.enabled:
+            self.histogram(name, buckets, **labels).observe(value)
+
+    def stage(self, stage):
+        """Time a block into the stage_seconds histogram: `with metrics.stage('scoring'):`"""
+        if not self.enabled:
+            return _NO_STAGE
+        return _Stage(self.histogram('stage_seconds', stage=stage))
+
+    def render(self):
+        """Render every metric in the Prometheus text exposition format"""
+        with self._lock:
+            counters = sorted(self._counters.items())
+            gauges = sorted(self._gauges.items(), key=lambda item: item[0])
+            histograms = sorted(self._histograms.items(), key=lambda item: item[0])
+
+        lines = []
+        described = set()
+
+        def header(name, metric_type):
+            if name in described:
+                return
+            described.add(name)
+            if name in self._help:
+                lines.append(f"# HELP {self.namespace}_{name} {self._help[name]}")
+            lines.append(f"# TYPE {self.namespace}_{name} {metric_type}")
+
+        for (name, labels), value in counters:
+            header(name, 'counter')
+            lines.append(f"{self.namespace}_{name}{_format_labels(labels)} {value}")
+
+        for (name, labels), value in gauges:
+            if callable(value):
+                try:
+                    value = value()
+                except Exception:
+                    continue
+            header(name, 'gauge')
+            lines.append(f"{self.namespace}_{name}{_format_labels(labels)} {value}")
+
+        for (name, labels), histogram in histograms:
+            header(name, 'histogram')
+            counts, total, count = histogram.snapshot()
+            cumulative = 0
+            for bound, bucket_count in zip(histogram.buckets + ('+Inf',), counts):
+                cumulative += bucket_count
+                lines.append(f"{self.namespace}_{name}_bucket{_format_labels(labels + (('le', bound),))} {cumulative}")
+            lines.append(f"{self.namespace}_{name}_sum{_format_labels(labels)} {total}")
+            lines.append(f"{self.namespace}_{name}_count{_format_labels(labels)} {count}")
+        return '\n'.join(lines) + '\n'
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    pairs = ','.join(f'{name}="{str(value)}"' for name, value in labels)
+    return '{' + pairs + '}'
+
+
+class SlowRequestProfiler:
+    """Opt-in sampling profiler that keeps cProfile stats of the slowest requests.
+
+    A sampled request is profiled from start() to finish(); if it is among the
+    n_slowest seen so far its stats are written to output_dir as a .prof file
+    (load with pstats or snakeviz) and the file it displaces is deleted. Only
+    one request is profiled at a time, since cProfile hooks are process-wide on
+    newer Pythons.
+    """
+
+    def __init__(self, n_slowest=10, sample_rate=1.0, output_dir='profiles'):
+        self.n_slowest = n_slowest
+        self.sample_rate = sample_rate
+        self.output_dir = output_dir
+        self._slowest = []  # Min-heap of (seconds, path)
+        self._active = threading.Lock()
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Start profiling the current request if it is sampled; returns the profile or None"""
+        if self.n_slowest <= 0 or random.random() >= self.sample_rate:
+            return None
+        if not self._active.acquire(blocking=False):
+            return None
+        profile = cProfile.Profile()
+        profile.enable()
+        return profile
+
+    def finish(self, profile, seconds, description):
+        """Stop profiling and keep the stats if the request was one of the slowest"""
+        profile.disable()
+        self._active.release()
+        with self._lock:
+            if len(self._slowest) >= self.n_slowest and seconds <= self._slowest[0][0]:
+                return
+            os.makedirs(self.output_dir, exist_ok=True)
+            safe_description = ''.join(c if c.isalnum() else '_' for c in description).strip('_')
+            path = os.path.join(self.output_dir, f"{seconds * 1000:010.2f}ms_{safe_description}_{time.time_ns()}.prof")
+            profile.dump_stats(path)
+            heapq.heappush(self._slowest, (seconds, path))
+            if len(self._slowest) > self.n_slowest:
+                _, evicted = heapq.heappop(self._slowest)
+                if os.path.exists(evicted):
+                    os.remove(evicted)
+
+    def slowest(self):
+        """(seconds, path) of the kept profiles, slowest first"""
+        with self._lock:
+            return sorted(self._slowest, reverse=True)
+
+
+# Shared registry used by the processor, the matcher and the web app
+metrics = MetricsRegistry(enabled=os.environ.get('METRICS_ENABLED', '1') != '0')
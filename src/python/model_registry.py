@@ -0,0 +1,381 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+import numpy as np
+
+import feature_store
+from metrics import metrics
+from batching import MicroBatcher
+from face_matcher import FaceMatcher
+from pca_processor import PCAProcessor
+
+
+class ServedModel:
+    """A loaded model with the matcher (and optional micro-batcher) serving it"""
+
+    def __init__(self, name, processor, matcher, batcher=None, load_seconds=0.0):
+        self.name = name
+        self.processor = processor
+        self.matcher = matcher
+        self.batcher = batcher
+        self.load_seconds = load_seconds
+        self.last_used = time.time()
+        self.source_mtime = None  # mtime_ns of the model header this was loaded from
+        # Models registered from memory (no model_dir) cannot be reloaded, so they are never evicted
+        self.pinned = processor.model_dir is None
+
+    def footprint_bytes(self):
+        """Bytes held in NumPy arrays by the processor, its fitted objects, ANN index and matcher.
+
+        Memory-mapped arrays count at their full mapped size, although their
+        pages are shared with other processes through the page cache.
+        """
+        owners = [self.processor, self.processor.pca, self.processor.scaler, self.processor.ann_index]
+        owners += self.matcher.indexes()
+        seen = set()
+        total = 0
+        for owner in owners:
+            if owner is None:
+                continue
+            for value in vars(owner).values():
+                if isinstance(value, np.ndarray) and id(value) not in seen:
+                    seen.add(id(value))
+                    total += value.nbytes
+        return total
+
+
+class ModelRegistry:
+    """Serves every model under models_root, loading each on first use.
+
+    Resident models are kept in least-recently-used order; after a load, the
+    least recently used ones are evicted until the total footprint fits in
+    memory_budget_mb (the model just loaded always stays). Evicted models are
+    reloaded transparently on their next request.
+
+    reload() swaps in a retrained model without downtime, and rollback()
+    swaps the replaced version back. Replaced versions kept for rollback
+    are not counted against the memory budget.
+    """
+
+    def __init__(self, models_root, default_model=None, memory_budget_mb=4096, similarity_metric='cosine',
+                 feature_dtype='float32', batch_window_ms=0, batch_max_size=32):
+        self.models_root = models_root
+        self.default_model = default_model
+        self.memory_budget = int(memory_budget_mb * 1024 * 1024)
+        self.similarity_metric = similarity_metric
+        self.feature_dtype = feature_dtype
+        self.batch_window_ms = batch_window_ms
+        self.batch_max_size = batch_max_size
+        self._resident = OrderedDict()  # name -> ServedModel, least recently used first
+        self._history = {}  # name -> {'loads', 'evictions', 'footprint_bytes', 'evicted_at'}
+        self._previous = {}  # name -> ServedModel replaced by the last reload, kept for rollback
+        self._reloads = {}  # name -> status of the last reload
+        self._ignored_mtime = {}  # name -> header mtime the watcher should not reload (after a rollback)
+        self._loading = {}  # name -> Future of a first load in progress
+        self._watcher = None
+        self._lock = threading.Lock()
+
+    def discover(self):
+        """Names of the model directories under models_root"""
+        if not os.path.isdir(self.models_root):
+            return []
+        return sorted(name for name in os.listdir(self.models_root)
+                      if feature_store.model_exists(os.path.join(self.models_root, name)))
+
+    def get(self, name=None):
+        """Return the ServedModel for name (the default model if None), loading it if needed.
+
+        Concurrent requests for a model being loaded share that one load,
+        while other models keep serving. Raises KeyError for unknown model names.
+        """
+        name = name or self.default_model
+        with self._lock:
+            served = self._resident.get(name)
+            if served is not None:
+                self._resident.move_to_end(name)
+                served.last_used = time.time()
+                return served
+            loading = self._loading.get(name)
+            first = loading is None
+            if first:
+                model_dir = self._model_dir(name)
+                loading = self._loading[name] = Future()
+
+        if first:
+            # Loaded without holding the lock, so other models keep serving; later callers wait on loading
+            self._load(name, model_dir, loading)
+        return loading.result()
+
+    def add(self, name, processor):
+        """Serve an already loaded or fitted PCAProcessor under name"""
+        with self._lock:
+            served = self._wrap(name, processor, 0.0)
+            self._register(served)
+            self._evict()
+            return served
+
+    def resident(self):
+        """Names of the loaded models, least recently used first"""
+        with self._lock:
+            return list(self._resident)
+
+    def status(self):
+        """Resident, evicted and not yet loaded models with their memory footprint"""
+        with self._lock:
+            resident = list(self._resident.values())
+            history = {name: dict(entry) for name, entry in self._history.items()}
+
+        models = []
+        for served in resident:
+            models.append({
+                'name': served.name,
+                'state': 'resident',
+                'footprint_bytes': served.footprint_bytes(),
+                'load_ms': served.load_seconds * 1000,
+                'last_used': served.last_used,
+                'total_images': served.processor.get_gallery().n_live,
+                'loads': history.get(served.name, {}).get('loads', 0),
+            })
+        resident_names = {served.name for served in resident}
+        for name in self.discover():
+            if name in resident_names:
+                continue
+            entry = history.get(name)
+            models.append({
+                'name': name,
+                'state': 'evicted' if entry else 'available',
+                'footprint_bytes': entry['footprint_bytes'] if entry else None,
+                'evicted_at': entry['evicted_at'] if entry else None,
+                'loads': entry['loads'] if entry else 0,
+            })
+
+        return {
+            'default_model': self.default_model,
+            'memory_budget_bytes': self.memory_budget,
+            'resident_bytes': sum(model['footprint_bytes'] for model in models if model['state'] == 'resident'),
+            'models': models,
+        }
+
+    def _load(self, name, model_dir, loading):
+        """Load a model and register it, resolving loading for every caller waiting on it"""
+        print(f"Loading model '{name}'...")
+        try:
+            served = self._build(name, model_dir)
+        except Exception as e:
+            with self._lock:
+                del self._loading[name]
+            loading.set_exception(e)
+            return
+        with self._lock:
+            self._register(served)
+            self._evict()
+            del self._loading[name]
+        loading.set_result(served)
+        print(f"Model '{name}' loaded in {served.load_seconds * 1000:.1f} ms "
+              f"({served.footprint_bytes() / 1e6:.1f} MB)")
+
+    def _build(self, name, model_dir):
+        """Load a model from disk into a ServedModel without serving it yet"""
+        source_mtime = header_mtime(model_dir)
+        start_time = time.perf_counter()
+        processor = PCAProcessor()
+        processor.load_model(model_dir)
+        served = self._wrap(name, processor, time.perf_counter() - start_time)
+        served.source_mtime = source_mtime
+        return served
+
+    def _wrap(self, name, processor, load_seconds):
+        matcher = FaceMatcher(processor, similarity_metric=self.similarity_metric, feature_dtype=self.feature_dtype)
+        matcher.warm_up()
+        served = ServedModel(name, processor, matcher, None, load_seconds)
+        self._start_batcher(served)
+        return served
+
+    def _start_batcher(self, served):
+        served.batcher = None
+        if self.batch_window_ms > 0:
+            served.batcher = MicroBatcher(served.matcher, window_ms=self.batch_window_ms,
+                                          max_batch=self.batch_max_size)
+
+    def _register(self, served):
+        """Make served the model answering requests for its name (caller holds the lock)"""
+        name, processor = served.name, served.processor
+        self._resident[name] = served
+        self._resident.move_to_end(name)
+        entry = self._history.setdefault(name, {'loads': 0, 'evictions': 0, 'evicted_at': None})
+        entry['loads'] += 1
+        entry['footprint_bytes'] = served.footprint_bytes()
+
+        metrics.set_gauge('model_load_seconds', served.load_seconds, model=name)
+        metrics.set_gauge('gallery_images', lambda: processor.get_gallery().n_live, model=name)
+        metrics.set_gauge('gallery_persons', lambda: len(processor.label_names), model=name)
+        if served.batcher is not None:
+            metrics.set_gauge('batch_queue_depth', served.batcher.queue_depth, model=name)
+        else:
+            metrics.remove_gauge('batch_queue_depth', model=name)
+
+    def reload(self, name=None, wait=False):
+        """Load the current files of a model in the background and swap it in when ready.
+        
+        The new model is validated and warmed with a test query first; requests
+        already holding the old model finish on it. The replaced model is kept
+        for rollback(). Returns the reload status.
+        """
+        name = name or self.default_model
+        model_dir = self._model_dir(name)
+        with self._lock:
+            status = self._reloads.get(name)
+            if status is not None and status['state'] == 'loading':
+                return dict(status)
+            self._reloads[name] = {'state': 'loading', 'started_at': time.time(), 'error': None}
+
+        thread = threading.Thread(target=self._reload, args=(name, model_dir), name=f'reload-{name}', daemon=True)
+        thread.start()
+        if wait:
+            thread.join()
+        return self.reload_status(name)
+
+    def reload_status(self, name=None):
+        """Status of the last reload of a model: loading, ready or failed"""
+        name = name or self.default_model
+        with self._lock:
+            return dict(self._reloads.get(name) or {'state': 'idle'})
+
+    def rollback(self, name=None):
+        """Swap back the model replaced by the last reload (or undo a rollback)"""
+        name = name or self.default_model
+        with self._lock:
+            previous = self._previous.pop(name, None)
+            if previous is None:
+                raise ValueError(f"No previous version of model '{name}' to roll back to")
+            current = self._resident.get(name)
+            self._start_batcher(previous)
+            self._register(previous)
+            if current is not None:
+                self._retire(current)
+                self._previous[name] = current
+            # The files on disk still hold the newer version; keep the watcher from reloading it
+            self._ignored_mtime[name] = header_mtime(os.path.join(self.models_root, name))
+            self._evict()
+        print(f"Rolled model '{name}' back to version {previous.processor.model_version}")
+        return previous
+
+    def watch(self, interval=5.0):
+        """Reload resident models whose files changed, polling every interval seconds"""
+        if self._watcher is None:
+            self._watcher = threading.Thread(target=self._watch, args=(interval,), name='model-watcher', daemon=True)
+            self._watcher.start()
+
+    def _reload(self, name, model_dir):
+        try:
+            served = self._build(name, model_dir)
+            validate_model(served)
+        except Exception as e:
+            print(f"Reload of model '{name}' failed, keeping the current version: {e}")
+            with self._lock:
+                self._reloads[name].update(state='failed', error=str(e), finished_at=time.time())
+            return
+
+        with self._lock:
+            current = self._resident.get(name)
+            self._register(served)
+            if current is not None:
+                self._retire(current)
+                self._previous[name] = current
+            self._ignored_mtime.pop(name, None)
+            self._evict()
+            self._reloads[name].update(
+                state='ready', error=None, finished_at=time.time(),
+                model_version=served.processor.model_version,
+                previous_version=current.processor.model_version if current is not None else None)
+        print(f"Model '{name}' reloaded: version {served.processor.model_version} "
+              f"in {served.load_seconds * 1000:.1f} ms")
+
+    def _retire(self, served):
+        """Stop serving a replaced model; requests still holding it finish normally"""
+        if served.batcher is not None:
+            served.batcher.close()
+
+    def _watch(self, interval):
+        pending = {}  # name -> header mtime seen on the previous poll
+        while True:
+            time.sleep(interval)
+            with self._lock:
+                resident = list(self._resident.values())
+                loading = {name for name, status in self._reloads.items() if status['state'] == 'loading'}
+            for served in resident:
+                if served.pinned or served.name in loading:
+                    continue
+                mtime = header_mtime(os.path.join(self.models_root, served.name))
+                if mtime is None or mtime == served.source_mtime or mtime == self._ignored_mtime.get(served.name):
+                    pending.pop(served.name, None)
+                    continue
+                # Only reload once the files have stopped changing for a whole interval
+                if pending.get(served.name) == mtime:
+                    del pending[served.name]
+                    print(f"Model files of '{served.name}' changed, reloading...")
+                    self.reload(served.name)
+                else:
+                    pending[served.name] = mtime
+
+    def _model_dir(self, name):
+        """Directory of a known model; raises KeyError for unknown names"""
+        model_dir = os.path.join(self.models_root, name) if name else None
+        if name is None or os.path.basename(name) != name or name.startswith('.') \
+                or not feature_store.model_exists(model_dir):
+            raise KeyError(f"Unknown model: {name}")
+        return model_dir
+
+    def _evict(self):
+        """Drop least recently used models until the resident footprint fits the budget"""
+        footprints = {name: served.footprint_bytes() for name, served in self._resident.items()}
+        total = sum(footprints.values())
+        for name in list(self._resident)[:-1]:
+            if total <= self.memory_budget:
+                break
+            served = self._resident[name]
+            if served.pinned:
+                continue
+            # Requests still holding the model finish normally; the arrays are freed afterwards
+            del self._resident[name]
+            total -= footprints[name]
+            self._retire(served)
+            self._previous.pop(name, None)
+            entry = self._history[name]
+            entry['evictions'] += 1
+            entry['evicted_at'] = time.time()
+            for gauge in ('model_load_seconds', 'gallery_images', 'gallery_persons', 'batch_queue_depth'):
+                metrics.remove_gauge(gauge, model=name)
+            metrics.inc('model_evictions_total', model=name)
+            print(f"Evicted model '{name}' ({footprints[name] / 1e6:.1f} MB)")
+
+
+def header_mtime(model_dir):
+    """mtime_ns of a model's header file, or None if it has none"""
+    try:
+        return os.stat(os.path.join(model_dir, feature_store.METADATA_FILE)).st_mtime_ns
+    except OSError:
+        return None
+
+
+def validate_model(served):
+    """Check a freshly loaded model and warm it with a test query; raises ValueError if unusable"""
+    processor = served.processor
+    gallery = processor.get_gallery()
+    if gallery.n_live == 0:
+        raise ValueError("Model has an empty gallery")
+    n_components = processor.projection_matrix.shape[1]
+    if gallery.main_features.shape[1] != n_components:
+        raise ValueError(f"Gallery features have {gallery.main_features.shape[1]} dimensions, "
+                         f"the projection has {n_components}")
+    if gallery.ann_index is not None and len(gallery.ann_index.list_ids) != gallery.n_main:
+        raise ValueError("ANN index does not cover the gallery (model still being written?)")
+
+    probe = np.full((processor.image_size[1], processor.image_size[0]), 128, dtype=np.uint8)
+    features = processor.transform(probe)
+    if not np.all(np.isfinite(features)):
+        raise ValueError("Projection of a test image is not finite")
+    if not served.matcher.match_features(features, top_k=1, match_type='all')[0]:
+        raise ValueError("Test query returned no matches")
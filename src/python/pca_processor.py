@@ -1,153 +1,385 @@
 import os
 import numpy as np
 from PIL import Image
-from sklearn.decomposition import PCA
+from sklearn.decomposition import IncrementalPCA
 from sklearn.preprocessing import StandardScaler
 import cv2
 import pickle
-import json
+import time
+import uuid
+import itertools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import feature_store
+from enrollment import ConcatSequence, EnrollmentLog, GallerySnapshot
+from image_cache import PreprocessedImageCache
+from ann_index import IVFIndex
+import dedup
+import pca_solvers
+from metrics import metrics
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp')
+# Reduced JPEG decodes keep at least this multiple of the target size, so the
+# final resize still averages over neighboring pixels
+DRAFT_OVERSAMPLE = 2
+# Gallery snapshot versions, unique across every processor in the process (they key cached results)
+_gallery_versions = itertools.count(1)
 
 class PCAProcessor:
-    def __init__(self, n_components=0.95, image_size=(128, 128)):
+    def __init__(self, n_components=0.95, image_size=(128, 128), n_workers=None, cache_dir=None, solver='auto'):
+        if solver not in pca_solvers.SOLVERS:
+            raise ValueError(f"Unknown PCA solver {solver!r}; choose from {', '.join(pca_solvers.SOLVERS)}")
         self.n_components = n_components
+        self.solver = solver  # PCA solver used by fit(): auto, full, snapshot or randomized
         self.image_size = image_size
+        self.n_workers = n_workers or os.cpu_count() or 1  # Threads used to decode images
+        self.cache_dir = cache_dir  # Preprocessed image cache reused across training runs
         self.pca = None
         self.scaler = StandardScaler()
-        self.dataset = []
+        self.dataset = None  # (n_images, n_pixels) float32 matrix
         self.dataset_labels = []
         self.dataset_image_paths = []  # Store image paths
         self.dataset_pca_features = None  # Store transformed dataset
+        self.label_codes = None  # int32 person code per gallery image
+        self.label_names = []  # Person name for each code
+        self.dataset_features_normalized = None  # Unit-length features, when stored with the model
+        self.dataset_sq_norms = None  # Squared feature norms, when stored with the model
+        self.ann_index = None  # Optional IVFIndex for approximate search; readers use the snapshot's
+        self.projection_matrix = None  # Fused scaler + PCA projection (n_pixels, n_components) float32
+        self.projection_bias = None  # Subtracted after projecting: features = x @ matrix - bias
+        self.model_version = None  # Changes whenever the model is refitted or reloaded from disk
+        self.model_dir = None  # Directory the model was saved to or loaded from
+        # Online enrollment: an append-only segment on top of the main store, plus tombstones
+        self.segment_features = None
+        self.segment_labels = []
+        self.segment_image_paths = []
+        self.removed = frozenset()  # Gallery indices removed since the last compaction
+        self.compact_threshold = 1000  # Segment size that triggers compaction into the main store
+        self._gallery = None  # Published GallerySnapshot, replaced (never mutated) by writers
+        self._gallery_lock = threading.Lock()  # Serializes writers; readers never take it
+        self._buffers = threading.local()  # Per-thread preprocessing buffers
 
-    def load_dataset(self, dataset_path):
-        """Load images from dataset directory"""
-        self.dataset = []
-        self.dataset_labels = []
-        self.dataset_image_paths = []
-        
+    def list_dataset_images(self, dataset_path):
+        """List (image_path, person_name) pairs for every person directory"""
         if not os.path.exists(dataset_path):
             raise ValueError(f"Dataset path {dataset_path} does not exist")
         
+        entries = []
+        # Each subdirectory represents a person
+        for person_name in sorted(os.listdir(dataset_path)):
+            person_dir = os.path.join(dataset_path, person_name)
+            if not os.path.isdir(person_dir):
+                continue
+            for image_file in sorted(os.listdir(person_dir)):
+                if image_file.lower().endswith(IMAGE_EXTENSIONS):
+                    entries.append((os.path.join(person_dir, image_file), person_name))
+        return entries
+
+    def load_dataset(self, dataset_path):
+        """Load images from dataset directory into one preallocated matrix"""
         print(f"Loading dataset from: {dataset_path}")
-        # Load images from subdirectories (each subdirectory represents a person)
-        print(os.listdir(dataset_path))
-        person_name = os.listdir(dataset_path)[0]
-        person_dir = os.path.join(dataset_path, person_name)
-        if os.path.isdir(person_dir):
-            person_count = 0
-            for image_file in os.listdir(person_dir):
-                if image_file.lower().endswith(('.png', '.jpg', '.jpeg', '.bmp')):
-                    image_path = os.path.join(person_dir, image_file)
-                    try:
-                        image = Image.open(image_path)
-                        processed_image = self.preprocess_image(image)
-                        self.dataset.append(processed_image.flatten())
-                        self.dataset_labels.append(person_name)
-                        self.dataset_image_paths.append(image_path)
-                        person_count += 1
-                    except Exception as e:
-                        print(f"Error processing {image_path}: {e}")
-            print(f"Loaded {person_count} images for {person_name}")
-        
-        print(f"Total loaded: {len(self.dataset)} images from dataset")
-        return len(self.dataset)
+        entries = self.list_dataset_images(dataset_path)
+        
+        # Decode straight into the final matrix, one row per image
+        n_features = self.image_size[0] * self.image_size[1]
+        dataset = np.empty((len(entries), n_features), dtype=np.float32)
+        
+        image_cache = self._open_image_cache()
+        with ThreadPoolExecutor(max_workers=self.n_workers) as executor:
+            kept = self._load_rows(dataset, entries, executor, image_cache)
+        if image_cache is not None:
+            image_cache.close()
+        
+        self.dataset = dataset[:len(kept)]
+        self.dataset_labels = [person_name for _, person_name in kept]
+        self.dataset_image_paths = [image_path for image_path, _ in kept]
+        
+        print(f"Total loaded: {len(kept)} images for {len(set(self.dataset_labels))} persons")
+        return len(kept)
+
+    def iter_dataset_chunks(self, entries, chunk_size=1024):
+        """Yield (chunk, labels, image_paths) blocks of at most chunk_size images.
+        
+        The chunk matrix is a reused buffer and is overwritten by the next block.
+        """
+        n_features = self.image_size[0] * self.image_size[1]
+        buffer = np.empty((min(chunk_size, len(entries)), n_features), dtype=np.float32)
+        
+        image_cache = self._open_image_cache()
+        try:
+            with ThreadPoolExecutor(max_workers=self.n_workers) as executor:
+                for start in range(0, len(entries), chunk_size):
+                    block = entries[start:start + chunk_size]
+                    kept = self._load_rows(buffer, block, executor, image_cache)
+                    if kept:
+                        yield (buffer[:len(kept)],
+                               [person_name for _, person_name in kept],
+                               [image_path for image_path, _ in kept])
+        finally:
+            if image_cache is not None:
+                image_cache.close()
+
+    def _open_image_cache(self):
+        """Open the preprocessed image cache, or return None when caching is off"""
+        if self.cache_dir is None:
+            return None
+        return PreprocessedImageCache(self.cache_dir, self.image_size)
+
+    def _load_rows(self, matrix, entries, executor, image_cache=None):
+        """Load entries into the leading rows of matrix and return the ones that loaded"""
+        def load_row(row):
+            return self._load_image_into(matrix[row], entries[row][0], image_cache)
+        
+        loaded = list(executor.map(load_row, range(len(entries))))
+        
+        # Close the gaps left by unreadable images without reallocating
+        count = 0
+        for row, ok in enumerate(loaded):
+            if not ok:
+                continue
+            if row != count:
+                matrix[count] = matrix[row]
+            count += 1
+        
+        return [entry for entry, ok in zip(entries, loaded) if ok]
+
+    def _load_image_into(self, row, image_path, image_cache=None):
+        """Decode and preprocess one image file into a preallocated row"""
+        try:
+            pixels = image_cache.get(image_path) if image_cache is not None else None
+            if pixels is None:
+                with Image.open(image_path) as image:
+                    pixels = self.preprocess_pixels(image, out=self._pixel_buffer())
+                if image_cache is not None:
+                    image_cache.add(image_path, pixels)
+            # Same float32 normalization as preprocess_image
+            row[:] = pixels.ravel()
+            row /= 255.0
+            return True
+        except Exception as e:
+            print(f"Error processing {image_path}: {e}")
+            return False
+
+    def _pixel_buffer(self):
+        """Per-thread uint8 (height, width) buffer reused by preprocess_pixels"""
+        buffer = getattr(self._buffers, 'pixels', None)
+        if buffer is None or buffer.shape != (self.image_size[1], self.image_size[0]):
+            buffer = self._buffers.pixels = np.empty((self.image_size[1], self.image_size[0]), dtype=np.uint8)
+        return buffer
 
     def preprocess_image(self, image):
         """Preprocess image: resize, convert to grayscale, normalize"""
-        # Convert PIL Image to numpy array if needed
+        # Normalize pixel values to [0, 1]
+        return self.preprocess_pixels(image).astype(np.float32) / 255.0
+
+    def preprocess_pixels(self, image, out=None):
+        """Convert to grayscale and resize, keeping the pixel dtype (uint8 for PIL images).
+        
+        PIL images that are not decoded yet take a fast path: JPEGs are decoded
+        by the codec at a reduced scale (DCT scaling, still at least
+        DRAFT_OVERSAMPLE times the target size) straight to grayscale, so
+        multi-megapixel uploads never materialize at full resolution. The
+        draft decode reads the file through a second image object, so the
+        caller's image keeps its full resolution and mode. The resize writes
+        into out when a matching buffer is given.
+        """
         if hasattr(image, 'convert'):
-            # Convert to RGB if it's a PIL image
-            image = image.convert('RGB')
-            image_array = np.array(image)
-        else:
-            image_array = image
-        
-        # Convert to grayscale using OpenCV
-        if len(image_array.shape) == 3:
-            gray_image = cv2.cvtColor(image_array, cv2.COLOR_RGB2GRAY)
+            if image.mode != 'L':
+                # Same ITU-R 601 luma weights as cv2.COLOR_RGB2GRAY, without a full RGB copy
+                if image.format == 'JPEG' and getattr(image, 'fp', None) is not None:
+                    # Not decoded yet: draft() changes the image it is called on
+                    image.fp.seek(0)
+                    with Image.open(image.fp) as draft_image:
+                        draft_image.draft('L', (self.image_size[0] * DRAFT_OVERSAMPLE,
+                                                self.image_size[1] * DRAFT_OVERSAMPLE))
+                        image = draft_image.convert('L')
+                else:
+                    image = image.convert('L')
+            gray_image = np.asarray(image)
+        elif len(image.shape) == 3:
+            gray_image = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
         else:
-            gray_image = image_array
+            gray_image = image
         
         # Resize image
-        resized_image = cv2.resize(gray_image, self.image_size)
-        
-        # Normalize pixel values to [0, 1]
-        normalized_image = resized_image.astype(np.float32) / 255.0
+        return cv2.resize(gray_image, self.image_size, dst=out)
+
+    def preprocess_gray_bytes(self, pixel_bytes, size):
+        """Normalized pixel row from raw (width, height) 8-bit grayscale bytes.
         
-        return normalized_image
+        Buffers already at image_size are only normalized.
+        """
+        gray = np.frombuffer(pixel_bytes, dtype=np.uint8).reshape(size[1], size[0])
+        return self.preprocess_pixels(gray).astype(np.float32).ravel() / 255.0
 
     def fit(self, dataset_path=None):
         """Fit the PCA model to the dataset"""
         if dataset_path:
             self.load_dataset(dataset_path)
         
-        if not self.dataset:
+        if self.dataset is None or len(self.dataset) == 0:
             raise ValueError("No dataset loaded. Please load dataset first.")
         
         print("Fitting PCA model...")
-        # Convert to numpy array
-        dataset_array = np.array(self.dataset)
+        # Standardize the dataset (float32 in, float32 out)
+        scaled_data = self.scaler.fit_transform(self.dataset)
+        
+        # Fit PCA and keep the dataset features for future matching; the solver
+        # may center scaled_data in place, which is fine as it is a copy
+        self.pca, self.dataset_pca_features = pca_solvers.fit_pca(scaled_data, self.n_components, self.solver)
+        del scaled_data
+        self._encode_labels()
+        self._compile_projection()
+        self.dataset_features_normalized = self.dataset_sq_norms = None
+        self.ann_index = None
+        self.model_version = uuid.uuid4().hex
+        self.model_dir = None
+        self._reset_segment()
+        
+        print(f"PCA fitted with {self.pca.n_components_} components")
+        print(f"Explained variance ratio: {sum(self.pca.explained_variance_ratio_):.4f}")
         
-        # Standardize the dataset
-        scaled_data = self.scaler.fit_transform(dataset_array)
+        return self.pca
+
+    def fit_streaming(self, dataset_path, chunk_size=1024):
+        """Fit the PCA model out of core, holding at most chunk_size images in memory"""
+        if not isinstance(self.n_components, int):
+            raise ValueError("Streaming training needs an integer n_components")
+        if chunk_size < self.n_components:
+            raise ValueError("chunk_size must be at least n_components")
+        
+        print(f"Streaming dataset from: {dataset_path} (chunk size {chunk_size})")
+        entries = self.list_dataset_images(dataset_path)
+        if not entries:
+            raise ValueError("No images found in dataset.")
+        
+        # Pass 1: scaler statistics. They must be final before PCA sees scaled data.
+        self.scaler = StandardScaler()
+        for chunk, _, _ in self._stream_with_progress("Scaler pass", entries, chunk_size):
+            self.scaler.partial_fit(chunk)
         
-        # Fit PCA
-        self.pca = PCA(n_components=self.n_components)
-        self.pca.fit(scaled_data)
+        # Pass 2: incremental PCA on standardized chunks
+        self.pca = IncrementalPCA(n_components=self.n_components)
+        for chunk, _, _ in self._stream_with_progress("PCA pass", entries, chunk_size):
+            self.pca.partial_fit(self.scaler.transform(chunk))
         
-        # Transform the dataset and store for future matching
-        self.dataset_pca_features = self.pca.transform(scaled_data)
+        # Pass 3: project the gallery
+        features = np.empty((len(entries), self.n_components), dtype=np.float32)
+        self.dataset_labels = []
+        self.dataset_image_paths = []
+        for chunk, labels, image_paths in self._stream_with_progress("Projection pass", entries, chunk_size):
+            count = len(self.dataset_labels)
+            features[count:count + len(chunk)] = self.pca.transform(self.scaler.transform(chunk))
+            self.dataset_labels.extend(labels)
+            self.dataset_image_paths.extend(image_paths)
+        
+        self.dataset = None
+        self.dataset_pca_features = features[:len(self.dataset_labels)]
+        self._encode_labels()
+        self._compile_projection()
+        self.dataset_features_normalized = self.dataset_sq_norms = None
+        self.ann_index = None
+        self.model_version = uuid.uuid4().hex
+        self.model_dir = None
+        self._reset_segment()
         
         print(f"PCA fitted with {self.pca.n_components_} components")
         print(f"Explained variance ratio: {sum(self.pca.explained_variance_ratio_):.4f}")
         
         return self.pca
 
+    def build_ann_index(self, n_lists=256, pq_subspaces=0, metric='cosine'):
+        """Build an approximate nearest-neighbor index over the gallery features and publish it"""
+        if self.dataset_pca_features is None:
+            raise ValueError("Dataset features not available. Train or load model first.")
+        
+        with self._gallery_lock:
+            self.ann_index = self._new_ann_index(n_lists, pq_subspaces, metric)
+            self._publish_gallery()
+        return self.ann_index
+
+    def _new_ann_index(self, n_lists, pq_subspaces, metric):
+        index = IVFIndex(n_lists=n_lists, pq_subspaces=pq_subspaces, metric=metric)
+        index.build(self.dataset_pca_features)
+        return index
+
+    def _stream_with_progress(self, pass_name, entries, chunk_size):
+        """Iterate dataset chunks while printing progress and throughput"""
+        start_time = time.perf_counter()
+        done = 0
+        for chunk, labels, image_paths in self.iter_dataset_chunks(entries, chunk_size):
+            yield chunk, labels, image_paths
+            done += len(chunk)
+            elapsed = time.perf_counter() - start_time
+            print(f"{pass_name}: {done}/{len(entries)} images ({done / elapsed:.1f} images/s)")
+
     def save_model(self, model_dir="models"):
-        """Save the trained PCA model and dataset features"""
+        """Save the trained PCA model and dataset features as memory-mappable arrays"""
         if self.pca is None:
             raise ValueError("No model to save. Train the model first.")
         
-        os.makedirs(model_dir, exist_ok=True)
-        
-        # Save PCA model and scaler
-        model_data = {
-            'pca': self.pca,
-            'scaler': self.scaler,
-            'image_size': self.image_size,
-            'n_components': self.n_components
-        }
-        
-        with open(os.path.join(model_dir, 'pca_model.pkl'), 'wb') as f:
-            pickle.dump(model_data, f)
-        
-        # Save dataset features, labels, and image paths
-        dataset_data = {
-            'dataset_pca_features': self.dataset_pca_features,
-            'dataset_labels': self.dataset_labels,
-            'dataset_image_paths': self.dataset_image_paths,
-            'total_images': len(self.dataset_labels)
-        }
+        if len(self.segment_features) or self.removed:
+            # Enrolled and removed entries are folded in by compacting
+            return self.compact(model_dir)
         
-        with open(os.path.join(model_dir, 'dataset_features.pkl'), 'wb') as f:
-            pickle.dump(dataset_data, f)
-        
-        # Save metadata as JSON for easy inspection
+        # Metadata doubles as the versioned header of the feature store
         metadata = {
+            'model_version': self.model_version,
             'total_images': len(self.dataset_labels),
-            'unique_persons': len(set(self.dataset_labels)),
-            'image_size': self.image_size,
-            'pca_components': self.pca.n_components_,
+            'unique_persons': len(self.label_names),
+            'image_size': list(self.image_size),
+            'n_components': self.n_components,
+            'pca_components': int(self.pca.n_components_),
             'explained_variance_ratio': float(sum(self.pca.explained_variance_ratio_))
         }
         
-        with open(os.path.join(model_dir, 'model_metadata.json'), 'w') as f:
-            json.dump(metadata, f, indent=2)
+        feature_store.save_store(model_dir, self.scaler, self.pca, self.dataset_pca_features,
+                                 self.label_codes, self.label_names, self.dataset_image_paths,
+                                 metadata)
+        if self.ann_index is not None:
+            self.ann_index.save(model_dir, self.model_version)
+        else:
+            # An index from an earlier training run would not match this gallery
+            IVFIndex.remove(model_dir)
+        self.model_dir = model_dir
         
         print(f"Model saved to {model_dir}/")
         return model_dir
 
     def load_model(self, model_dir="models"):
         """Load the trained PCA model and dataset features"""
+        if not feature_store.has_store(model_dir):
+            return self._load_pickle_model(model_dir)
+        
+        # Arrays are memory-mapped, so worker processes share one page-cached copy
+        store = feature_store.load_store(model_dir)
+        header = store['header']
+        
+        self.pca = store['pca']
+        self.scaler = store['scaler']
+        self.image_size = tuple(header['image_size'])
+        self.n_components = header['n_components']
+        
+        self.dataset_pca_features = store['features']
+        self.dataset_labels = store['dataset_labels']
+        self.dataset_image_paths = store['dataset_image_paths']
+        self.label_codes = store['label_codes']
+        self.label_names = store['label_names']
+        self.dataset_features_normalized = store['features_normalized']
+        self.dataset_sq_norms = store['sq_norms']
+        self._compile_projection()
+        self.model_version = header.get('model_version') or uuid.uuid4().hex
+        self.ann_index = IVFIndex.load(model_dir, n_items=len(self.dataset_pca_features),
+                                       model_version=self.model_version)
+        self.model_dir = model_dir
+        self._reset_segment()
+        
+        print(f"Model loaded from {model_dir}/")
+        print(f"Loaded {len(self.dataset_labels)} images with {self.pca.n_components_} PCA components")
+        return True
+
+    def _load_pickle_model(self, model_dir):
+        """Load a model saved in the older pickle format"""
         pca_model_path = os.path.join(model_dir, 'pca_model.pkl')
         dataset_features_path = os.path.join(model_dir, 'dataset_features.pkl')
         
@@ -170,33 +402,272 @@ class PCAProcessor:
         self.dataset_pca_features = dataset_data['dataset_pca_features']
         self.dataset_labels = dataset_data['dataset_labels']
         self.dataset_image_paths = dataset_data.get('dataset_image_paths', [])
-        
-        print(f"Model loaded from {model_dir}/")
+        self._encode_labels()
+        self._compile_projection()
+        self.dataset_features_normalized = self.dataset_sq_norms = None
+        self.ann_index = None
+        self.model_version = uuid.uuid4().hex
+        self.model_dir = None
+        self._reset_segment()
+        
+        print(f"Model loaded from {model_dir}/ (pickle format, re-save to upgrade)")
         print(f"Loaded {len(self.dataset_labels)} images with {self.pca.n_components_} PCA components")
         return True
 
+    def _reset_segment(self):
+        """Start the enrollment segment (replaying the saved one, if any) and publish the gallery"""
+        n_components = self.dataset_pca_features.shape[1]
+        self.segment_features = np.empty((0, n_components), dtype=np.float32)
+        self.segment_labels = []
+        self.segment_image_paths = []
+        self.removed = frozenset()
+        
+        if self.model_dir is not None:
+            features, labels, image_paths, removed = EnrollmentLog(self.model_dir).replay(
+                self.model_version, n_components)
+            self.segment_features = features
+            self.segment_labels = labels
+            self.segment_image_paths = image_paths
+            self.removed = frozenset(removed)
+            if labels or removed:
+                print(f"Replayed {len(labels)} enrolled and {len(removed)} removed images")
+        
+        self._publish_gallery()
+
+    def _publish_gallery(self):
+        """Build a new immutable GallerySnapshot and swap it in with one reference assignment"""
+        n_main = len(self.dataset_pca_features)
+        
+        # New persons get codes after the existing ones, so main-store codes stay valid
+        code_of = {name: code for code, name in enumerate(self.label_names)}
+        new_names = [name for name in dict.fromkeys(self.segment_labels) if name not in code_of]
+        if new_names:
+            self.label_names = self.label_names + new_names
+            code_of.update((name, code) for code, name in enumerate(self.label_names))
+        
+        if self.segment_labels:
+            segment_codes = np.array([code_of[name] for name in self.segment_labels], dtype=np.int32)
+            label_codes = np.concatenate([self.label_codes, segment_codes])
+            labels = ConcatSequence(self.dataset_labels, self.segment_labels)
+            image_paths = ConcatSequence(self.dataset_image_paths, self.segment_image_paths)
+        else:
+            label_codes = self.label_codes
+            labels = self.dataset_labels
+            image_paths = self.dataset_image_paths
+        
+        self._gallery = GallerySnapshot(
+            version=next(_gallery_versions),
+            main_features=self.dataset_pca_features,
+            main_normalized=self.dataset_features_normalized,
+            main_sq_norms=self.dataset_sq_norms,
+            segment_features=self.segment_features,
+            label_codes=label_codes,
+            labels=labels,
+            image_paths=image_paths,
+            removed=np.array(sorted(i for i in self.removed if i < n_main + len(self.segment_labels)),
+                             dtype=np.intp),
+            ann_index=self.ann_index,
+        )
+
+    def get_gallery(self):
+        """Return the current GallerySnapshot used for matching"""
+        if self._gallery is None:
+            raise ValueError("Dataset features not available. Train or load model first.")
+        return self._gallery
+
+    def enroll(self, images, label):
+        """Add images of a person to the gallery without refitting PCA.
+        
+        Returns the gallery indices of the new entries. They are visible to matchers
+        as soon as this returns; concurrent matches keep using the previous snapshot.
+        """
+        if self.pca is None:
+            raise ValueError("PCA model not fitted. Call fit() or load_model() first.")
+        
+        features = self.transform_batch(images)
+        with self._gallery_lock:
+            if self.model_dir is not None:
+                log = EnrollmentLog(self.model_dir)
+                image_paths = [log.save_image(image) for image in images]
+                log.append(self.model_version, features, label, image_paths, len(self.segment_features))
+            else:
+                image_paths = [''] * len(images)
+            
+            # Copy-on-write: published snapshots keep referencing the old arrays and lists
+            self.segment_features = np.vstack([self.segment_features, features])
+            self.segment_labels = self.segment_labels + [label] * len(images)
+            self.segment_image_paths = self.segment_image_paths + image_paths
+            self._publish_gallery()
+            
+            if len(self.segment_features) >= self.compact_threshold:
+                self._compact_locked(self.model_dir)
+            total = len(self._gallery)
+        
+        return list(range(total - len(images), total))
+
+    def remove(self, indices=None, label=None):
+        """Tombstone gallery entries by index and/or every image of a person; returns removed indices"""
+        with self._gallery_lock:
+            gallery = self._gallery
+            targets = set(int(index) for index in (indices or []))
+            if label is not None:
+                if label not in self.label_names:
+                    raise ValueError(f"Unknown person: {label}")
+                code = self.label_names.index(label)
+                targets.update(int(index) for index in np.flatnonzero(gallery.label_codes == code))
+            
+            invalid = [index for index in targets if not 0 <= index < len(gallery)]
+            if invalid:
+                raise ValueError(f"Gallery indices out of range: {sorted(invalid)}")
+            
+            new_removals = sorted(targets - self.removed)
+            if new_removals:
+                if self.model_dir is not None:
+                    EnrollmentLog(self.model_dir).remove(self.model_version, new_removals)
+                self.removed = self.removed | frozenset(new_removals)
+                self._publish_gallery()
+        return new_removals
+
+    def compact(self, model_dir=None):
+        """Fold enrolled entries into the main store and drop removed ones"""
+        with self._gallery_lock:
+            return self._compact_locked(model_dir or self.model_dir)
+
+    def _compact_locked(self, model_dir):
+        gallery = self._gallery
+        keep = np.ones(len(gallery), dtype=bool)
+        keep[gallery.removed] = False
+        print(f"Compacting gallery: {len(self.segment_labels)} enrolled, {len(gallery.removed)} removed")
+        
+        features = np.vstack([self.dataset_pca_features, self.segment_features])[keep]
+        labels = [gallery.labels[i] for i in np.flatnonzero(keep)]
+        image_paths = [gallery.image_paths[i] for i in np.flatnonzero(keep)]
+        
+        self.dataset_pca_features = features
+        self.dataset_labels = labels
+        self.dataset_image_paths = image_paths
+        self._encode_labels()
+        self.dataset_features_normalized = self.dataset_sq_norms = None
+        if self.ann_index is not None:
+            # Gallery indices shift, so the index is rebuilt with the same settings and
+            # published together with the compacted gallery
+            self.ann_index = self._new_ann_index(self.ann_index.n_lists, self.ann_index.pq_subspaces,
+                                                 self.ann_index.metric)
+        self.model_version = uuid.uuid4().hex
+        self.model_dir = None
+        self._reset_segment()
+        
+        if model_dir is not None:
+            # Files are replaced atomically, so memory-mapped readers of the old store keep working
+            self.save_model(model_dir)
+            EnrollmentLog(model_dir).clear()
+            self.load_model(model_dir)
+        return model_dir
+
+    def deduplicate(self, threshold=dedup.DEFAULT_THRESHOLD):
+        """Drop near-duplicate images of each person from the gallery.
+        
+        Pending enrollments and removals are compacted first. Returns the
+        summary and a {dropped image path: kept image path} mapping.
+        """
+        with self._gallery_lock:
+            if len(self.segment_features) or self.removed:
+                self._compact_locked(None)
+            
+            features = self.dataset_pca_features
+            keep, kept_of = dedup.find_near_duplicates(features, self.label_codes, threshold)
+            summary = dedup.summarize(keep, self.label_codes, features.shape[1], threshold)
+            paths = self.dataset_image_paths or [str(i) for i in range(len(features))]
+            mapping = {paths[i]: paths[kept_of[i]] for i in np.flatnonzero(~keep)}
+            if not mapping:
+                return summary, mapping
+            
+            kept = np.flatnonzero(keep)
+            self.dataset_pca_features = np.asarray(features[kept], dtype=np.float32)
+            self.dataset_labels = [self.dataset_labels[i] for i in kept]
+            if self.dataset_image_paths:
+                self.dataset_image_paths = [self.dataset_image_paths[i] for i in kept]
+            if self.dataset is not None and len(self.dataset) == len(keep):
+                self.dataset = self.dataset[kept]
+            self._encode_labels()
+            self.dataset_features_normalized = self.dataset_sq_norms = None
+            if self.ann_index is not None:
+                self.ann_index = self._new_ann_index(self.ann_index.n_lists, self.ann_index.pq_subspaces,
+                                                     self.ann_index.metric)
+            self.model_version = uuid.uuid4().hex
+            self.model_dir = None
+            self._reset_segment()
+        return summary, mapping
+
+    def _compile_projection(self):
+        """Fold the scaler and PCA into one float32 matrix and bias for query-time projection"""
+        # ((x - scaler_mean) / scale - pca_mean) @ components.T == x @ W - b
+        components = np.asarray(self.pca.components_, dtype=np.float64)
+        scale = np.asarray(self.scaler.scale_, dtype=np.float64)
+        matrix = (components / scale).T
+        bias = (np.asarray(self.scaler.mean_) / scale + np.asarray(self.pca.mean_)) @ components.T
+        if getattr(self.pca, 'whiten', False):
+            std = np.sqrt(np.asarray(self.pca.explained_variance_))
+            matrix /= std
+            bias /= std
+        self.projection_matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+        self.projection_bias = bias.astype(np.float32)
+
+    def _project(self, flattened_images):
+        """Project (n_images, n_pixels) float32 rows with the fused projection"""
+        projected = flattened_images @ self.projection_matrix
+        projected -= self.projection_bias
+        return projected
+
+    def _encode_labels(self):
+        """Compute integer label codes and the person name table from dataset_labels"""
+        self.label_codes, self.label_names = feature_store.encode_labels(self.dataset_labels)
+
     def transform(self, image):
         """Transform the image into PCA space"""
         if self.pca is None:
             raise ValueError("PCA model not fitted. Call fit() or load_model() first.")
         
-        processed_image = self.preprocess_image(image)
+        with metrics.stage('preprocess'):
+            processed_image = self.preprocess_image(image)
         # Reshape to match dataset format (flatten)
-        flattened_image = processed_image.flatten().reshape(1, -1)
+        flattened_image = processed_image.reshape(1, -1)
+        
+        # Standardize and project in one fused GEMV
+        with metrics.stage('projection'):
+            return self._project(flattened_image)
+
+    def transform_batch(self, images):
+        """Transform many images into PCA space with a single projection"""
+        if self.pca is None:
+            raise ValueError("PCA model not fitted. Call fit() or load_model() first.")
         
-        # Standardize using the same scaler
-        scaled_image = self.scaler.transform(flattened_image)
+        # Preprocess into one preallocated matrix, one row per image
+        n_features = self.image_size[0] * self.image_size[1]
+        batch = np.empty((len(images), n_features), dtype=np.float32)
+        with metrics.stage('preprocess'):
+            buffer = self._pixel_buffer()
+            for row, image in enumerate(images):
+                batch[row] = self.preprocess_pixels(image, out=buffer).ravel()
+            batch /= 255.0
+        
+        with metrics.stage('projection'):
+            return self._project(batch)
+
+    def project(self, flattened_images):
+        """Project already preprocessed, flattened images (one row each) into PCA space"""
+        if self.pca is None:
+            raise ValueError("PCA model not fitted. Call fit() or load_model() first.")
         
-        return self.pca.transform(scaled_image)
+        with metrics.stage('projection'):
+            return self._project(np.asarray(flattened_images, dtype=np.float32))
 
     def transform_dataset(self):
         """Transform the entire dataset into PCA space"""
         if self.pca is None:
             raise ValueError("PCA model not fitted. Call fit() first.")
         
-        dataset_array = np.array(self.dataset)
-        scaled_data = self.scaler.transform(dataset_array)
-        return self.pca.transform(scaled_data)
+        return self._project(self.dataset)
 
     def inverse_transform(self, pca_data):
         """Inverse transform PCA data back to original space"""
@@ -212,16 +683,20 @@ class PCAProcessor:
 
     def get_dataset_info(self):
         """Get information about the loaded dataset"""
+        gallery = self._gallery
         return {
-            'total_images': len(self.dataset_labels) if self.dataset_labels else 0,
-            'unique_persons': len(set(self.dataset_labels)) if self.dataset_labels else 0,
+            'total_images': gallery.n_live if gallery is not None else 0,
+            'enrolled_images': len(self.segment_labels),
+            'removed_images': len(self.removed),
+            'unique_persons': len(self.label_names),
             'image_size': self.image_size,
-            'feature_dimension': len(self.dataset[0]) if self.dataset else 0,
+            'feature_dimension': self.dataset.shape[1] if self.dataset is not None else 0,
             'pca_components': self.pca.n_components_ if self.pca else 0
         }
 
     def get_dataset_features(self):
-        """Get the PCA features of the dataset for matching"""
-        if self.dataset_pca_features is None:
-            raise ValueError("Dataset features not available. Train or load model first.")
-        return self.dataset_pca_features, self.dataset_labels, self.dataset_image_paths
+        """Get the PCA features of the dataset for matching (including enrolled images)"""
+        gallery = self.get_gallery()
+        if not len(gallery.segment_features):
+            return gallery.main_features, gallery.labels, gallery.image_paths
+        return np.vstack([gallery.main_features, gallery.segment_features]), gallery.labels, gallery.image_paths
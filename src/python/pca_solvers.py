@@ -0,0 +1,144 @@
+"""
+Float32 PCA solvers for training: exact snapshot (Gram matrix) eigenfaces
+when there are fewer images than pixels, and randomized SVD with a fixed
+number of power iterations for large galleries. Both return a fitted
+sklearn PCA, so models are saved and loaded exactly as before.
+"""
+
+import numpy as np
+import scipy.linalg
+from sklearn.decomposition import PCA
+
+SOLVERS = ('auto', 'full', 'snapshot', 'randomized')
+# auto keeps the exact snapshot solver up to this many images (an n x n Gram matrix)
+SNAPSHOT_MAX_SAMPLES = 3000
+# ...and switches to randomized SVD above it when n_components is at most this share of the rank
+RANDOMIZED_MAX_FRACTION = 0.25
+RANDOMIZED_OVERSAMPLES = 10
+RANDOMIZED_ITERATIONS = 4
+BLOCK_ROWS = 4096
+
+
+def choose_solver(n_samples, n_features, n_components):
+    """Pick the cheapest solver for a data shape; variance fractions need the full spectrum"""
+    rank = min(n_samples, n_features)
+    # Above SNAPSHOT_MAX_SAMPLES the dense n x n Gram matrix costs more memory than a full SVD
+    exact = 'snapshot' if n_samples < n_features and n_samples <= SNAPSHOT_MAX_SAMPLES else 'full'
+    if not isinstance(n_components, int) or n_samples <= SNAPSHOT_MAX_SAMPLES:
+        return exact
+    if n_components <= RANDOMIZED_MAX_FRACTION * rank:
+        return 'randomized'
+    return exact
+
+
+def fit_pca(data, n_components, solver='auto', random_state=0):
+    """Fit PCA to float32 data and return (pca, features of data).
+
+    n_components is a component count, or a variance fraction below 1. The
+    snapshot and randomized solvers center data in place to avoid a copy of
+    the matrix, so pass a buffer the caller no longer needs.
+    """
+    if solver not in SOLVERS:
+        raise ValueError(f"Unknown PCA solver {solver!r}; choose from {', '.join(SOLVERS)}")
+    data = np.asarray(data, dtype=np.float32)
+    n_samples, n_features = data.shape
+    rank = min(n_samples, n_features)
+    if isinstance(n_components, int) and not 1 <= n_components <= rank:
+        raise ValueError(f"n_components={n_components} must be between 1 and {rank} for this dataset")
+    if solver == 'auto':
+        solver = choose_solver(n_samples, n_features, n_components)
+    print(f"PCA solver: {solver} ({n_samples} images x {n_features} pixels)")
+
+    if solver == 'full':
+        pca = PCA(n_components=n_components, svd_solver='full')
+        features = pca.fit_transform(data)
+        return pca, np.asarray(features, dtype=np.float32)
+
+    mean = data.mean(axis=0, dtype=np.float64).astype(np.float32)
+    for start in range(0, n_samples, BLOCK_ROWS):
+        data[start:start + BLOCK_ROWS] -= mean
+
+    if solver == 'snapshot':
+        features, singular_values, components, total_var = _snapshot(data, n_components)
+    else:
+        if not isinstance(n_components, int):
+            raise ValueError("The randomized solver needs an integer n_components")
+        features, singular_values, components, total_var = _randomized(data, n_components, random_state)
+
+    # Same sign convention as sklearn: the largest loading of each component is positive
+    signs = np.sign(components[np.arange(len(components)), np.argmax(np.abs(components), axis=1)])
+    signs[signs == 0] = 1
+    components *= signs[:, None]
+    features *= signs
+    return _fitted_pca(mean, components, singular_values, total_var, n_samples, n_features), features
+
+
+def _snapshot(data, n_components):
+    """Eigendecompose the n x n Gram matrix and map its eigenvectors back to pixel space.
+
+    Returns (features, singular values, components, total variance).
+    """
+    n_samples = len(data)
+    gram = data @ data.T
+    total_var = float(np.trace(gram, dtype=np.float64)) / (n_samples - 1)
+    if isinstance(n_components, int):
+        eigenvalues, eigenvectors = scipy.linalg.eigh(gram, subset_by_index=[n_samples - n_components,
+                                                                            n_samples - 1])
+    else:
+        eigenvalues, eigenvectors = scipy.linalg.eigh(gram)
+    del gram
+    eigenvalues, eigenvectors = eigenvalues[::-1], eigenvectors[:, ::-1]
+    eigenvalues = np.maximum(eigenvalues, 0)
+    if not isinstance(n_components, int):
+        ratio_cumsum = np.cumsum(eigenvalues / (n_samples - 1) / total_var)
+        n_components = min(int(np.searchsorted(ratio_cumsum, n_components, side='right')) + 1, len(eigenvalues))
+    eigenvalues = eigenvalues[:n_components]
+    left = np.ascontiguousarray(eigenvectors[:, :n_components], dtype=np.float32)
+
+    singular_values = np.sqrt(eigenvalues).astype(np.float32)
+    components = left.T @ data
+    components /= np.where(singular_values > 0, singular_values, 1)[:, None]
+    return left * singular_values, singular_values, components, total_var
+
+
+def _randomized(data, n_components, random_state):
+    """Halko et al. randomized SVD with a fixed number of QR-normalized power iterations.
+
+    Returns the same tuple as _snapshot.
+    """
+    n_samples, n_features = data.shape
+    n_random = min(n_components + RANDOMIZED_OVERSAMPLES, n_samples, n_features)
+    rng = np.random.default_rng(random_state)
+    test_matrix = rng.standard_normal((n_features, n_random), dtype=np.float32)
+
+    basis, _ = np.linalg.qr(data @ test_matrix)
+    for _ in range(RANDOMIZED_ITERATIONS):
+        basis, _ = np.linalg.qr(data.T @ basis)
+        basis, _ = np.linalg.qr(data @ basis)
+    _, singular_values, components = np.linalg.svd(basis.T @ data, full_matrices=False)
+    components = components[:n_components]
+    # Projecting (rather than using the approximate left vectors) matches how queries are projected
+    features = data @ components.T
+
+    total_var = sum(float(np.einsum('ij,ij->', block, block))
+                    for block in (data[start:start + BLOCK_ROWS] for start in range(0, n_samples, BLOCK_ROWS)))
+    return features, singular_values[:n_components], components, total_var / (n_samples - 1)
+
+
+def _fitted_pca(mean, components, singular_values, total_var, n_samples, n_features):
+    """Build a fitted sklearn PCA from float32 solver results"""
+    n_components = len(components)
+    explained_variance = singular_values ** 2 / (n_samples - 1)
+    pca = PCA(n_components=n_components)
+    pca.mean_ = mean
+    pca.components_ = np.ascontiguousarray(components, dtype=np.float32)
+    pca.explained_variance_ = explained_variance.astype(np.float32)
+    pca.explained_variance_ratio_ = (explained_variance / total_var).astype(np.float32)
+    pca.singular_values_ = singular_values.astype(np.float32)
+    rank = min(n_samples, n_features)
+    pca.noise_variance_ = (total_var - float(explained_variance.sum())) / (rank - n_components) \
+        if n_components < rank else 0.0
+    pca.n_components_ = n_components
+    pca.n_features_in_ = n_features
+    pca.n_samples_ = n_samples
+    return pca
@@ -0,0 +1,33 @@
+import numpy as np
+
+import pca_solvers
+from pca_solvers import SNAPSHOT_MAX_SAMPLES, choose_solver, fit_pca
+
+N_PIXELS = 64 * 64
+
+
+def test_snapshot_up_to_the_sample_cap():
+    assert choose_solver(SNAPSHOT_MAX_SAMPLES, N_PIXELS, 0.95) == 'snapshot'
+    assert choose_solver(SNAPSHOT_MAX_SAMPLES, N_PIXELS, 100) == 'snapshot'
+
+
+def test_no_gram_matrix_above_the_sample_cap():
+    # A variance fraction needs the full spectrum, so only an exact dense SVD remains
+    assert choose_solver(SNAPSHOT_MAX_SAMPLES + 1, N_PIXELS, 0.95) == 'full'
+    assert choose_solver(30000, N_PIXELS, 0.95) == 'full'
+    assert choose_solver(30000, N_PIXELS, 100) == 'randomized'
+    assert choose_solver(30000, N_PIXELS, 2000) == 'full'
+
+
+def test_more_pixels_than_images_only():
+    assert choose_solver(500, 400, 0.95) == 'full'
+
+
+def test_auto_follows_the_cap(monkeypatch, capsys):
+    monkeypatch.setattr(pca_solvers, 'SNAPSHOT_MAX_SAMPLES', 50)
+    data = np.random.default_rng(0).standard_normal((60, 100)).astype(np.float32)
+    pca, features = fit_pca(data.copy(), 0.9)
+    assert 'PCA solver: full' in capsys.readouterr().out
+    reference, _ = fit_pca(data.copy(), 0.9, solver='snapshot')
+    assert features.shape == (60, pca.n_components_)
+    assert pca.n_components_ == reference.n_components_
@@ -0,0 +1,236 @@
+"""
+Packed JPEG thumbnails of gallery images, served in place of the originals
+by /image/<index>?size=N, and a standalone command that builds them for a
+saved model
+"""
+
+import os
+import io
+import json
+import hashlib
+import argparse
+import threading
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
+
+THUMBNAIL_DIR = 'thumbnails'
+DATA_FILE = 'thumbnails.bin'
+INDEX_FILE = 'index.jsonl'
+# Longest side in pixels of the thumbnails built at training time
+DEFAULT_SIZES = (128, 256)
+JPEG_QUALITY = 85
+
+
+def parse_sizes(value):
+    """Parse a comma separated size list such as '128,256'"""
+    sizes = sorted({int(size) for size in str(value).split(',') if size.strip()})
+    if any(size <= 0 for size in sizes):
+        raise ValueError(f"Thumbnail sizes must be positive: {value}")
+    return tuple(sizes)
+
+
+def make_thumbnails(image_path, sizes):
+    """Return {size: JPEG bytes} with the image scaled so its longest side is at most size"""
+    thumbnails = {}
+    with Image.open(image_path) as image:
+        # JPEGs decode straight at a reduced scale when only a thumbnail is needed
+        image.draft('RGB', (max(sizes), max(sizes)))
+        image = image.convert('RGB')
+        for size in sorted(sizes, reverse=True):
+            image.thumbnail((size, size), Image.LANCZOS)
+            buffer = io.BytesIO()
+            image.save(buffer, 'JPEG', quality=JPEG_QUALITY, optimize=True)
+            thumbnails[size] = buffer.getvalue()
+    return thumbnails
+
+
+def content_etag(data):
+    """Strong ETag (unquoted) derived from the bytes served"""
+    return hashlib.blake2b(data, digest_size=12).hexdigest()
+
+
+class ThumbnailStore:
+    """Thumbnails of one size, packed into a single append-only file.
+
+    Thumbnail bytes are appended to one data file read through np.memmap, so
+    serving one opens no files. An append-only JSON-lines index maps each
+    source image path to its (offset, length, ETag) plus the source's mtime
+    and size, so edited images miss and are rebuilt. Appends are single
+    O_APPEND writes; other processes sharing the directory pick up new index
+    lines on their next miss. Replaced thumbnails are not reclaimed; rebuild
+    the directory to compact it.
+    """
+
+    def __init__(self, store_dir, size):
+        self.store_dir = store_dir
+        self.size = size
+        os.makedirs(store_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._index = {}  # image path -> (offset, length, mtime_ns, file size, etag)
+        self._data_path = os.path.join(store_dir, DATA_FILE)
+        self._index_path = os.path.join(store_dir, INDEX_FILE)
+        self._data_fd = os.open(self._data_path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        self._index_fd = os.open(self._index_path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        self._index_read = 0  # Bytes of the index file already parsed
+        self._data = None
+        self._refresh()
+
+    def __len__(self):
+        return len(self._index)
+
+    def has(self, image_path, stat):
+        """Return True if the store holds an up-to-date thumbnail (without rereading the index)"""
+        with self._lock:
+            return self._entry(image_path, stat) is not None
+
+    def get(self, image_path, stat=None):
+        """Return (JPEG bytes, ETag) of an unchanged source image, or None"""
+        stat = stat or os.stat(image_path)
+        with self._lock:
+            entry = self._entry(image_path, stat)
+            if entry is None:
+                # Another process may have built it since we last read the index
+                self._refresh()
+                entry = self._entry(image_path, stat)
+            if entry is None:
+                return None
+            offset, length, _, _, etag = entry
+            if self._data is None or offset + length > len(self._data):
+                self._open_data()
+            return bytes(self._data[offset:offset + length]), etag
+
+    def add(self, image_path, data, stat=None):
+        """Append a thumbnail of image_path; returns its ETag"""
+        stat = stat or os.stat(image_path)
+        etag = content_etag(data)
+        with self._lock:
+            os.write(self._data_fd, data)
+            # O_APPEND leaves the position at the end of this write, even with other writers
+            offset = os.lseek(self._data_fd, 0, os.SEEK_CUR) - len(data)
+            entry = [image_path, offset, len(data), stat.st_mtime_ns, stat.st_size, etag]
+            os.write(self._index_fd, (json.dumps(entry) + '\n').encode('utf-8'))
+            self._index[image_path] = tuple(entry[1:])
+        return etag
+
+    def get_or_create(self, image_path):
+        """Return (JPEG bytes, ETag), building and persisting the thumbnail on a miss"""
+        stat = os.stat(image_path)
+        cached = self.get(image_path, stat)
+        if cached is not None:
+            return cached
+        data = make_thumbnails(image_path, (self.size,))[self.size]
+        return data, self.add(image_path, data, stat)
+
+    def close(self):
+        os.close(self._data_fd)
+        os.close(self._index_fd)
+
+    def _entry(self, image_path, stat):
+        entry = self._index.get(image_path)
+        if entry is None or entry[2] != stat.st_mtime_ns or entry[3] != stat.st_size:
+            return None
+        return entry
+
+    def _refresh(self):
+        """Parse index lines appended since the last call; later lines win"""
+        with open(self._index_path, 'rb') as f:
+            f.seek(self._index_read)
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break  # A write still in progress (or cut short by a crash)
+                self._index_read += len(line)
+                try:
+                    path, offset, length, mtime_ns, size, etag = json.loads(line)
+                except ValueError:
+                    continue
+                self._index[path] = (offset, length, mtime_ns, size, etag)
+
+    def _open_data(self):
+        if os.path.getsize(self._data_path):
+            self._data = np.memmap(self._data_path, dtype=np.uint8, mode='r')
+
+
+class ThumbnailSet:
+    """The thumbnail stores of one model directory, one per configured size"""
+
+    def __init__(self, model_dir, sizes=DEFAULT_SIZES):
+        self.root = os.path.join(model_dir, THUMBNAIL_DIR)
+        self.sizes = tuple(sorted(sizes))
+        self._stores = {}
+        self._lock = threading.Lock()
+
+    def pick_size(self, requested):
+        """Smallest configured size covering requested, or None if the original is needed"""
+        for size in self.sizes:
+            if size >= requested:
+                return size
+        return None
+
+    def store(self, size):
+        with self._lock:
+            if size not in self._stores:
+                self._stores[size] = ThumbnailStore(os.path.join(self.root, str(size)), size)
+            return self._stores[size]
+
+    def get(self, image_path, size):
+        """Return (JPEG bytes, ETag) for image_path at a configured size"""
+        return self.store(size).get_or_create(image_path)
+
+    def close(self):
+        with self._lock:
+            for store in self._stores.values():
+                store.close()
+            self._stores.clear()
+
+
+def build_thumbnails(image_paths, model_dir, sizes=DEFAULT_SIZES, n_workers=None):
+    """Build missing or stale thumbnails for image_paths at every size, in parallel.
+
+    Each image is decoded once for all sizes. Returns (built, reused, failed)
+    image counts.
+    """
+    thumbnail_set = ThumbnailSet(model_dir, sizes)
+    stores = [thumbnail_set.store(size) for size in thumbnail_set.sizes]
+
+    def build(image_path):
+        try:
+            stat = os.stat(image_path)
+            missing = [store for store in stores if not store.has(image_path, stat)]
+            if not missing:
+                return 'reused'
+            thumbnails = make_thumbnails(image_path, [store.size for store in missing])
+            for store in missing:
+                store.add(image_path, thumbnails[store.size], stat)
+            return 'built'
+        except Exception as e:
+            print(f"Error building thumbnail for {image_path}: {e}")
+            return 'failed'
+
+    # PIL releases the GIL while decoding and resizing, so threads scale
+    with ThreadPoolExecutor(max_workers=n_workers or os.cpu_count() or 1) as executor:
+        outcomes = list(executor.map(build, image_paths))
+    thumbnail_set.close()
+    return outcomes.count('built'), outcomes.count('reused'), outcomes.count('failed')
+
+
+def main():
+    from pca_processor import PCAProcessor
+
+    parser = argparse.ArgumentParser(description="Build gallery thumbnails for a saved model")
+    parser.add_argument("model_dir", help="Saved model directory")
+    parser.add_argument("--sizes", type=parse_sizes, default=DEFAULT_SIZES,
+                        help="Comma separated longest-side sizes in pixels (default: 128,256)")
+    parser.add_argument("--workers", type=int, default=None, help="Threads used to build thumbnails")
+    args = parser.parse_args()
+
+    pca_processor = PCAProcessor()
+    pca_processor.load_model(args.model_dir)
+    image_paths = pca_processor.get_gallery().image_paths
+    built, reused, failed = build_thumbnails(image_paths, args.model_dir, args.sizes, args.workers)
+    print(f"Thumbnails: {built} built, {reused} up to date, {failed} failed "
+          f"(sizes {', '.join(map(str, args.sizes))})")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,47 +3,116 @@ Script to train and save the PCA model
 """
 
 from pca_processor import PCAProcessor
+import dedup
+import thumbnails
+import pca_solvers
+import argparse
 import os
 
+# Dataset path - update this to your actual dataset path
+DEFAULT_DATASET_PATH = r"C:\Users\hamza\.cache\kagglehub\datasets\kostastokis\simpsons-faces\versions\1"
+DEFAULT_MODEL_NAME = "simpsons_faces_pca"
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(__file__), "cache", "preprocessed")
+
+def parse_n_components(value):
+    """Parse n_components as a component count or a variance fraction"""
+    number = float(value)
+    return int(number) if number >= 1 else number
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Train and save a PCA face matching model")
+    parser.add_argument("dataset_path", nargs="?", default=DEFAULT_DATASET_PATH,
+                        help="Dataset root with one subdirectory per person")
+    parser.add_argument("model_name", nargs="?", default=DEFAULT_MODEL_NAME,
+                        help="Name of the model directory under models/")
+    parser.add_argument("--n_components", type=parse_n_components, default=50,
+                        help="Number of components, or variance fraction if below 1")
+    parser.add_argument("--image_width", type=int, default=128)
+    parser.add_argument("--image_height", type=int, default=128)
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Threads used to decode images (default: CPU count)")
+    parser.add_argument("--solver", choices=pca_solvers.SOLVERS, default='auto',
+                        help="PCA solver: snapshot (Gram matrix) for fewer images than pixels, randomized for "
+                             "large galleries, full for sklearn's exact SVD, auto to choose from the data shape")
+    parser.add_argument("--streaming", action="store_true",
+                        help="Train out of core with incremental PCA (needs an integer n_components)")
+    parser.add_argument("--chunk_size", type=int, default=1024,
+                        help="Images held in memory per chunk in streaming mode")
+    parser.add_argument("--cache_dir", default=DEFAULT_CACHE_DIR,
+                        help="Preprocessed image cache reused across training runs")
+    parser.add_argument("--no_cache", action="store_true",
+                        help="Decode every image without using the preprocessed image cache")
+    parser.add_argument("--ann_lists", type=int, default=0,
+                        help="Build an IVF approximate search index with this many lists (0 = none)")
+    parser.add_argument("--ann_pq_subspaces", type=int, default=0,
+                        help="Compress ANN residuals with product quantization (0 = off)")
+    parser.add_argument("--dedup_threshold", type=float, default=None,
+                        help="Drop images whose PCA features have at least this cosine similarity to "
+                             "another image of the same person (e.g. 0.98; default: keep all)")
+    parser.add_argument("--thumbnail_sizes", type=thumbnails.parse_sizes, default=thumbnails.DEFAULT_SIZES,
+                        help="Comma separated thumbnail sizes to prebuild for /image (empty string = none)")
+    return parser.parse_args()
+
 def main():
+    args = parse_args()
     print("Starting PCA model training...")
-    
+
     # Initialize PCA processor
-    pca_processor = PCAProcessor(n_components=50, image_size=(128, 128))
-    
-    # Dataset path - update this to your actual dataset path
-    dataset_path = r"C:\Users\hamza\.cache\kagglehub\datasets\kostastokis\simpsons-faces\versions\1"
-    
+    pca_processor = PCAProcessor(n_components=args.n_components,
+                                 image_size=(args.image_width, args.image_height),
+                                 n_workers=args.workers,
+                                 cache_dir=None if args.no_cache else args.cache_dir,
+                                 solver=args.solver)
+
+    dataset_path = args.dataset_path
+
     try:
         # Check if dataset exists
         if not os.path.exists(dataset_path):
             print(f"Dataset path does not exist: {dataset_path}")
-            print("Please update the dataset_path variable in this script")
+            print("Please pass the dataset path as the first argument")
             return
-        
+
         # Train the model
         print("Loading dataset and training PCA model...")
-        pca_processor.fit(dataset_path)
-        
+        if args.streaming:
+            pca_processor.fit_streaming(dataset_path, chunk_size=args.chunk_size)
+        else:
+            pca_processor.fit(dataset_path)
+
+        duplicates = None
+        if args.dedup_threshold is not None:
+            duplicates = pca_processor.deduplicate(args.dedup_threshold)
+            dedup.print_summary(duplicates[0])
+
+        if args.ann_lists:
+            pca_processor.build_ann_index(n_lists=args.ann_lists, pq_subspaces=args.ann_pq_subspaces)
+
         # Save the trained model
-        model_dir = os.path.join(os.path.dirname(__file__),"models","simpsons_faces_pca")
+        model_dir = os.path.join(os.path.dirname(__file__), "models", args.model_name)
         os.makedirs(model_dir, exist_ok=True)
         saved_path = pca_processor.save_model(model_dir)
-        
+        if duplicates is not None:
+            dedup.save_report(model_dir, *duplicates)
+        if args.thumbnail_sizes:
+            built, reused, failed = thumbnails.build_thumbnails(pca_processor.get_gallery().image_paths, model_dir,
+                                                                args.thumbnail_sizes, n_workers=args.workers)
+            print(f"Thumbnails: {built} built, {reused} up to date, {failed} failed")
+
         # Display model info
         info = pca_processor.get_dataset_info()
         print("\nModel Training Complete!")
         print("=" * 40)
         for key, value in info.items():
             print(f"{key}: {value}")
-        
+
         print(f"\nModel saved to: {saved_path}")
         print("You can now use the saved model for face matching!")
-        
+
     except Exception as e:
         print(f"Error during training: {e}")
         import traceback
         traceback.print_exc()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()